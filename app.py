@@ -1,21 +1,29 @@
 import streamlit as st
-import google.generativeai as genai
-from openai import OpenAI
-import requests
-from bs4 import BeautifulSoup
 import time
 import os
-import hashlib
-import re
-from youtube_transcript_api import YouTubeTranscriptApi
-from urllib.parse import urlparse, parse_qs
-import yt_dlp
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
-import PyPDF2
+from datetime import datetime, timedelta, timezone
 import io
+import json
+import uuid
 import base64 # ★追加：iPhone対策の切り札
+import streamlit.components.v1 as components
+from streamlit import runtime
 import audio_mixer # ★これを追加！
+import audio_post
+import ephemeral_audio
+import tts_cache
+import script_writer
+import summarizer
+import sources
+import radio_store
+import pipeline
+import job_queue
+import pdf_ingest
+import fetcher
+import tracing
+from sources import is_safe_domain
+# openai・firebase_admin・google.generativeai は下の @st.cache_resource の中で読み込む
+# （再実行のたびに読み込み・初期化しない。使わない画面では読み込みもしない）
 
 # ---------------------------
 # 基本設定
@@ -47,133 +55,440 @@ BUCKET_NAME = "webradio-app1.firebasestorage.app"
 gemini_key = st.secrets.get("GEMINI_API_KEY", "")
 openai_key = st.secrets.get("OPENAI_API_KEY", "")
 
-if not firebase_admin._apps:
-    try:
+@st.cache_resource
+def get_firebase():
+    """
+    Firebase を初期化して (Firestore, Storage) のクライアントを返す（サーバープロセスで1回だけ。接続は使い回す）。
+    設定が無ければ (None, None)
+    """
+    if "firebase" not in st.secrets and not os.path.exists("firebase_key.json"):
+        return None, None # 設定が無いときは firebase_admin を読み込みもしない
+    import firebase_admin
+    from firebase_admin import credentials, firestore, storage
+    if not firebase_admin._apps:
         if "firebase" in st.secrets:
             key_dict = dict(st.secrets["firebase"])
             cred = credentials.Certificate(key_dict)
         else:
-            if os.path.exists("firebase_key.json"):
-                cred = credentials.Certificate("firebase_key.json")
-            else:
-                cred = None
-        
-        if cred:
-            firebase_admin.initialize_app(cred, {'storageBucket': BUCKET_NAME})
-    except Exception as e:
-        st.error(f"Firebase設定エラー: {e}")
+            cred = credentials.Certificate("firebase_key.json")
+        firebase_admin.initialize_app(cred, {'storageBucket': BUCKET_NAME})
+    return firestore.client(), storage.bucket()
+
+@st.cache_resource
+def get_openai_client(api_key):
+    """OpenAI のクライアント（HTTPの接続を番組をまたいで使い回す）"""
+    from openai import OpenAI
+    # レート制限の再試行は audio_mixer.synthesize_line が受け持つ（クライアントでも再試行すると回数が掛け算になる）
+    return OpenAI(api_key=api_key, max_retries=0)
+
+@st.cache_resource
+def get_script_writer(api_key):
+    """Gemini の台本係（GenerativeModel をボタンのたびに作り直さない）"""
+    return script_writer.GeminiScriptWriter.from_api_key(api_key)
 
-if firebase_admin._apps:
-    db = firestore.client()
-    bucket = storage.bucket()
+db, bucket = None, None
+try:
+    db, bucket = get_firebase()
+except Exception as e:
+    st.error(f"Firebase設定エラー: {e}") # キャッシュされないので、次の再実行でまた試す
 
 # ---------------------------
 # 関数定義エリア
 # ---------------------------
-def is_safe_domain(url):
-    try:
-        domain = urlparse(url).netloc
-        safe_suffixes = ['.go.jp', '.lg.jp', '.ac.jp', '.ed.jp', '.or.jp']
-        for suffix in safe_suffixes:
-            if domain.endswith(suffix):
-                return True
-        return False
-    except:
-        return False
-
-def generate_cache_key(source_id, style, lang):
-    unique_string = f"{source_id}_{style}_{lang}"
-    return hashlib.md5(unique_string.encode()).hexdigest()
-
-def check_cache(cache_key):
-    if not firebase_admin._apps: return None
-    doc_ref = db.collection('radios').document(cache_key)
-    doc = doc_ref.get()
-    if doc.exists: return doc.to_dict()
-    return None
-
-def save_to_cache(cache_key, audio_data, source_info, style, lang, title):
-    if not firebase_admin._apps: return None
-    blob = bucket.blob(f"audio/{cache_key}.mp3")
-    blob.upload_from_string(audio_data, content_type="audio/mp3")
-    blob.make_public()
-    audio_url = blob.public_url
-
-    doc_ref = db.collection('radios').document(cache_key)
-    doc_ref.set({
-        'source': source_info,
-        'style': style,
-        'language': lang,
-        'title': title,
-        'audio_url': audio_url,
-        'created_at': firestore.SERVER_TIMESTAMP
-    })
-    return audio_url
-
-def get_style_config(style_key, language):
-    config = {
-        "prompt_role": f"【役割】A:メインMC B:アシスタント 口調:{language}の標準的ニュース。落ち着いたトーンで。",
-        "voice_a": "onyx", "voice_b": "nova",
-        "speed": 1.0
-    }
-    
-    if style_key == "jk":
-        config = {
-            "prompt_role": "【役割】A:元気なJK(ボケ) B:冷静なJK(ツッコミ) 口調:『〜だし！』『マジで？』等のタメ口。短文でテンポよく。",
-            "voice_a": "nova", "voice_b": "alloy",
-            "speed": 1.15
-        }
-    elif style_key == "comedian":
-        config = {
-            "prompt_role": "【役割】A:ボケ(ハイテンション) B:ツッコミ(鋭く) 口調:関西弁や漫才口調。掛け合いを早く。",
-            "voice_a": "echo", "voice_b": "onyx",
-            "speed": 1.1
-        }
-    elif style_key == "okayama":
-        config = {
-            "prompt_role": "【役割】A,B:岡山出身の女性。口調:『〜じゃが』『〜だけぇ』等の岡山弁。親しみやすく。",
-            "voice_a": "nova", "voice_b": "alloy",
-            "speed": 1.05
-        }
-    elif style_key == "university":
-        config = {
-            "prompt_role": "【役割】A:男子大学生 B:女子大学生 口調:敬語混じりのカジュアルな会話。サークル棟での会話風。",
-            "voice_a": "fable", "voice_b": "nova",
-            "speed": 1.1
-        }
-    return config
-
-def fetch_content_from_url(url, openai_api_key):
-    if "youtube.com" in url or "youtu.be" in url:
-        parsed = urlparse(url)
-        if "youtube.com" in parsed.netloc: video_id = parse_qs(parsed.query).get("v", [None])[0]
-        elif "youtu.be" in parsed.netloc: video_id = parsed.path[1:]
-        else: video_id = None
+@st.cache_resource
+def get_segment_cache():
+    """セリフ単位の音声キャッシュ（サーバープロセスで1つだけ作る）"""
+    remote = None
+    if bucket is not None and st.secrets.get("TTS_SEGMENT_REMOTE", False):
+        remote = tts_cache.FirebaseSegmentStore(bucket)
+    return tts_cache.SegmentCache(remote=remote)
+
+@st.cache_resource
+def get_pdf_cache():
+    """PDFから取り出した文字のキャッシュ（サーバープロセスで1つだけ作る）"""
+    return pdf_ingest.PdfTextCache()
+
+@st.cache_resource
+def get_page_cache():
+    """取得したWebページ本文のキャッシュ（サーバープロセスで1つだけ作る）"""
+    return fetcher.SourceContentCache()
+
+@st.cache_resource
+def get_summary_cache():
+    """長い資料の部分ごとの要約のキャッシュ（サーバープロセスで1つだけ作る）"""
+    return summarizer.SummaryCache()
+
+@st.cache_resource
+def get_radio_index():
+    """保存済み番組（radios）の索引（サーバープロセスで1つだけ作り、リスナーで最新に保つ）"""
+    listen = st.secrets.get("RADIO_INDEX_LISTEN", True)
+    return radio_store.RadioIndex(db, listen=listen).start()
+
+@st.cache_resource
+def get_job_queue():
+    """番組生成のジョブキュー（サーバープロセスで1つだけ作る）"""
+    max_concurrent = int(st.secrets.get("MAX_CONCURRENT_JOBS", job_queue.DEFAULT_MAX_CONCURRENT))
+    return job_queue.JobQueue(max_concurrent=max_concurrent)
+
+@st.cache_resource
+def get_post_processor(with_bgm):
+    """音声の後処理（音量そろえ・フェード・リミッター。BGM_FILE があればBGMも）を1回だけ作る"""
+    bgm = None
+    if with_bgm:
+        bgm = audio_post.load_bgm(st.secrets["BGM_FILE"])
+    return audio_post.PostProcessor(bgm=bgm)
+
+# ブラウザから見た一時置き場のURL（例: https://radio.example.jp/ephemeral。リバースプロキシで EPHEMERAL_AUDIO_PORT へ）
+EPHEMERAL_AUDIO_URL = st.secrets.get("EPHEMERAL_AUDIO_URL", "").rstrip("/")
+
+@st.cache_resource
+def get_ephemeral_audio():
+    """
+    保存なしモードの音声の一時置き場と、Range 対応の配信サーバー（サーバープロセスで1つだけ）。
+    EPHEMERAL_AUDIO_PORT と EPHEMERAL_AUDIO_URL がそろっていなければ None（そのときは以前どおりHTMLに埋め込む）
+    """
+    port = st.secrets.get("EPHEMERAL_AUDIO_PORT")
+    if not port:
+        return None
+    if not EPHEMERAL_AUDIO_URL:
+        # URL が無いと、ブラウザには画面からの相対パスが渡って 404 になる
+        print("EPHEMERAL_AUDIO_PORT is set but EPHEMERAL_AUDIO_URL is not; the ephemeral store is disabled")
+        return None
+    store = ephemeral_audio.EphemeralAudioStore(
+        max_bytes=int(st.secrets.get("EPHEMERAL_AUDIO_MAX_MB", 256)) * 1024 * 1024,
+        ttl=int(st.secrets.get("EPHEMERAL_AUDIO_TTL", ephemeral_audio.DEFAULT_TTL)),
+        secret=st.secrets.get("EPHEMERAL_AUDIO_SECRET"),
+    )
+    ephemeral_audio.serve(store, int(port))
+    return store
+
+@st.cache_resource
+def start_metrics_server(port):
+    """Prometheus 用の /metrics をサーバープロセスで1回だけ立てる"""
+    return tracing.serve_metrics(port)
+
+if st.secrets.get("METRICS_PORT"):
+    start_metrics_server(int(st.secrets["METRICS_PORT"]))
+
+# 処理の内訳（ウォーターフォール）を表示するか（開発者向け）
+DEBUG_PANEL = st.secrets.get("DEBUG_PANEL", False)
+
+# 保存する音声の形式（audio_mixer.RENDITIONS の名前のリストか、"mp3,opus" のようなカンマ区切り）。
+# 再生は play_saved がブラウザごとに選ぶ
+AUDIO_RENDITIONS = audio_mixer.parse_renditions(st.secrets.get("AUDIO_RENDITIONS", pipeline.DEFAULT_SAVED_RENDITIONS))
+
+STAGE_LABELS = {
+    "fetch": "🐢 資料を読み込んでいます...",
+    # 台本は1行書けるごとにTTSへ流す（Geminiの執筆とTTSを重ねる）
+    "summarize": "📚 長い資料を分割して要約しています...",
+    "record": "✍️🎙️ AIが台本を書きながら収録中（間を調整しています）...",
+    "save": "💾 クラウドに保存中...",
+}
+
+# 先行再生のプレーヤー：パートを1つの <audio> で順番に流す（iPhone でも、終わったら同じ要素で次へ進める）。
+# パートは別の小さな部品から BroadcastChannel で届く（プレーヤーを作り直さずにパートを足せる）。
+# 再生位置は sessionStorage に残し、画面が再実行されて作り直されても続きから流す（最初から流し直さない）
+PART_PLAYER_HTML = """
+<audio id="player" controls style="width: 100%;"></audio>
+<div id="status" style="font: 13px sans-serif; color: #666;"></div>
+<script>
+const channel = new BroadcastChannel("__CHANNEL__");
+const audio = document.getElementById("player");
+const status = document.getElementById("status");
+const parts = {};
+let total = null;
+const saved = JSON.parse(sessionStorage.getItem("__CHANNEL__") || "null");
+let current = saved ? saved.index : 0;
+let seekTo = saved ? saved.time : 0;
+let paused = saved ? saved.paused : false;
+let waiting = true;
+
+function save() {
+  sessionStorage.setItem("__CHANNEL__", JSON.stringify({index: current, time: audio.currentTime || 0, paused: paused}));
+}
+function showStatus() {
+  if (total !== null && current >= total) {
+    status.textContent = "最後まで再生しました";
+  } else if (waiting) {
+    status.textContent = "パート" + (current + 1) + "：できあがるのを待っています...";
+  } else {
+    status.textContent = "パート" + (current + 1) + (total !== null ? " / " + total : "");
+  }
+}
+function load() {
+  if (!(current in parts)) {
+    waiting = true;
+    showStatus();
+    return;
+  }
+  waiting = false;
+  audio.src = parts[current];
+  const time = seekTo;
+  seekTo = 0;
+  audio.addEventListener("loadedmetadata", () => { if (time) audio.currentTime = time; }, {once: true});
+  if (!paused) audio.play().catch(() => {});
+  showStatus();
+}
+channel.onmessage = (e) => {
+  if (e.data.type === "end") {
+    total = e.data.count;
+  } else if (e.data.type === "part" && !(e.data.index in parts)) {
+    parts[e.data.index] = e.data.url;
+    if (waiting && e.data.index === current) load();
+  }
+  showStatus();
+};
+audio.addEventListener("ended", () => { current += 1; paused = false; save(); load(); });
+audio.addEventListener("timeupdate", save);
+audio.addEventListener("play", () => { paused = false; save(); });
+audio.addEventListener("pause", () => { if (!audio.ended) { paused = true; save(); } });
+channel.postMessage({type: "hello"}); // 先に届いていたパートを送り直してもらう
+showStatus();
+</script>
+"""
+
+# パートを1つ（または番組の終わりを）プレーヤーへ届ける部品（画面には出ない）
+PART_FEEDER_HTML = """
+<script>
+const channel = new BroadcastChannel("__CHANNEL__");
+const message = __MESSAGE__;
+channel.postMessage(message);
+channel.onmessage = (e) => { if (e.data.type === "hello") channel.postMessage(message); };
+</script>
+"""
+
+def part_channel(job):
+    return "radio-parts-" + job.key.replace(":", "-")
+
+def part_url(job, index, part_mp3):
+    """
+    先行再生のパートを取りに行くURL（MP3をHTMLに埋め込まない。再実行で送り直すのもURLだけ）。
+    一時置き場があればそこから、無ければ Streamlit のメディア配信（st.audio と同じ /media/...）から配る
+    """
+    name = f"{part_channel(job)}-{index}"
+    ephemeral = get_ephemeral_audio()
+    if ephemeral is not None:
+        # パートはジョブを見ている全員のものなので、セッションごとの本数の上限には数えない
+        signed_path = ephemeral.signed_path(ephemeral.put(None, part_mp3, key=name))
+        if signed_path:
+            return EPHEMERAL_AUDIO_URL + signed_path
+    if not runtime.exists():
+        return ""
+    url = runtime.get_instance().media_file_mgr.add(part_mp3, "audio/mpeg", name)
+    # プレーヤーは iframe の中なので、画面のパスの下で動かしているときはその分を足す
+    base_path = st.get_option("server.baseUrlPath").strip("/")
+    return f"/{base_path}{url}" if base_path else url
+
+def send_to_part_player(job, message):
+    components.html(PART_FEEDER_HTML.replace("__CHANNEL__", part_channel(job))
+                    .replace("__MESSAGE__", json.dumps(message)), height=0)
+
+def play_saved(item):
+    """保存済みの番組を、このブラウザで再生できる一番小さい形式で再生する（形式が無い古い番組は MP3）"""
+    renditions = item.get("renditions") or {}
+    name = audio_mixer.pick_rendition(renditions, st.context.headers.get("User-Agent", ""))
+    if name is None:
+        st.audio(item["audio_url"], format="audio/mp3")
+    else:
+        st.audio(renditions[name]["url"], format=renditions[name]["content_type"])
+
+def show_job(job, private, stream):
+    """
+    ジョブの進み具合と、stream なら先行再生のパートを表示し、終わったら結果を表示する。
+    パートはどのジョブも作るので、先行再生するかどうかは見ている人ごとに選べる
+    """
+    progress_area = st.empty()
+    stream_area = st.container()
+    shown_parts = 0
+    version = -1
+    while not job.finished:
+        version = job.wait(version)
+        if job.status == "queued":
+            progress_area.info("⏳ 混み合っています。順番が来たら生成を始めます...")
+        elif job.stage:
+            progress_area.info(STAGE_LABELS[job.stage])
+
+        if not stream:
+            continue
+        new_parts = job.parts[shown_parts:]
+        with stream_area:
+            for part_bytes, part_time in new_parts:
+                if shown_parts == 0:
+                    st.info(f"⚡ 先行再生（{part_time:.1f}秒で開始。できたパートから続けて流れます）")
+                    components.html(PART_PLAYER_HTML.replace("__CHANNEL__", part_channel(job)), height=80)
+                send_to_part_player(job, {"type": "part", "index": shown_parts,
+                                          "url": part_url(job, shown_parts, part_bytes)})
+                shown_parts += 1
+    progress_area.empty()
+    if shown_parts:
+        with stream_area:
+            send_to_part_player(job, {"type": "end", "count": shown_parts})
+
+    if job.status == "error":
+        if isinstance(job.error, sources.SourceError):
+            st.error(str(job.error))
+        else:
+            st.error(f"エラーが発生しました: {job.error}")
+        return
+
+    result = job.result
+    if result["from_cache"]:
+        st.success(f"♻️ キャッシュから再生します！\nタイトル: {result['title']}")
+        play_saved(result)
+        return
+
+    combined_audio = result["audio"]
+
+    # 4. 完了表示
+    if not private:
+        # 保存ありモード（URL再生なのでiPhoneもOK）
+        st.success("🎉 完成！")
+        if result["audio_url"]:
+            play_saved(result)
+        else:
+            st.audio(combined_audio, format="audio/mp3")
+    else:
+        # 保存なしモード（iPhoneでコケる鬼門）
+        st.success("🎉 完成！（保存なしモード）")
+        st.warning("⚠️ 著作権保護のためサーバーには保存されません。ダウンロードデータは**「私的利用（個人での視聴）」**に留め、**第三者への配布やSNSへのアップロードは絶対に行わないでください。**")
         
-        if not video_id: return "Error: Video ID not found"
-        try:
-            ts = YouTubeTranscriptApi.get_transcript(video_id, languages=['ja','en'])
-            return f"【YouTube(字幕)】\n{' '.join([t['text'] for t in ts])[:5000]}..."
-        except:
-            return "字幕が見つかりませんでした。"
+        ephemeral = get_ephemeral_audio()
+        key = job.key.split(":")[-1]
+        # 再実行のときは、前に置いたものがまだ残っていればそれを使う
+        signed_path = ephemeral.signed_path(key) if ephemeral is not None else None
+        if signed_path is None and ephemeral is not None and combined_audio is not None \
+                and len(combined_audio) <= ephemeral.max_bytes:
+            # サーバーのメモリに置いて、期限つきURLで Range 配信する（iPhoneでも少しずつ読み込んでシークできる）
+            session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+            signed_path = ephemeral.signed_path(ephemeral.put(session_id, combined_audio, key=key))
+        if signed_path:
+            # 音声は一時置き場の上限と期限で管理する。ジョブ（終わってからも残る）には持たせない
+            job.drop_audio()
+            st.audio(EPHEMERAL_AUDIO_URL + signed_path, format="audio/mp3")
+        elif combined_audio is None:
+            st.warning("⌛ 一時置き場から消えたため再生できません。もう一度生成してください。")
+        else:
+            # ★ここが最終兵器：Base64埋め込みプレーヤー（一時置き場を使えないとき）
+            # データを文字列化してHTMLに直接書き込むことで、iPhoneでも強制的に再生させる
+            b64_audio = base64.b64encode(combined_audio).decode()
+            audio_html = f"""
+            <audio controls style="width: 100%;">
+                <source src="data:audio/mp3;base64,{b64_audio}" type="audio/mp3">
+                お使いのブラウザは音声再生に対応していません。
+            </audio>
+            """
+            st.markdown(audio_html, unsafe_allow_html=True)
+
+    # 所要時間（最初の音声までと全体を分けて表示）
+    total_time = job.finished_at - job.created_at
+    if shown_parts:
+        st.caption(f"⏱️ 最初の音声まで {job.parts[0][1]:.1f}秒 / 全体 {total_time:.1f}秒")
     else:
-        try:
-            res = requests.get(url, timeout=10)
-            res.encoding = res.apparent_encoding
-            soup = BeautifulSoup(res.text, 'html.parser')
-            title = soup.title.string if soup.title else "Web記事"
-            return f"【Web記事：{title}】\n{' '.join([p.text for p in soup.find_all('p')])[:5000]}..."
-        except: return f"Error: {url}"
-
-def extract_text_from_pdf(uploaded_file):
-    try:
-        reader = PyPDF2.PdfReader(uploaded_file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-        return f"【PDF資料：{uploaded_file.name}】\n{text[:10000]}..."
-    except Exception as e:
-        return f"PDF読み込みエラー: {e}"
+        st.caption(f"⏱️ 全体 {total_time:.1f}秒")
+
+    # 台本表示
+    st.divider()
+    with st.expander("📝 生成された台本をチェックする（クリックで開閉）", expanded=False):
+        st.write(result["script_text"])
+
+def show_trace(trace):
+    """ジョブの Trace をウォーターフォールと段階ごとの集計で表示する（デバッグ用）"""
+    import altair as alt
+
+    spans = sorted(trace.spans, key=lambda sp: sp.start)
+    if not spans:
+        return
+    origin = spans[0].start
+    rows = []
+    for i, sp in enumerate(spans):
+        rows.append({
+            "row": f"{i:03d} {sp.name}",
+            "stage": sp.name,
+            "start": round(sp.start - origin, 3),
+            "end": round(sp.start - origin + sp.duration, 3),
+            "seconds": round(sp.duration, 3),
+            "thread": sp.thread,
+            "detail": ", ".join(f"{k}={v}" for k, v in sp.attrs.items()) + (f" ⚠️{sp.error}" if sp.error else ""),
+        })
+
+    with st.expander("🔧 処理の内訳（デバッグ）", expanded=False):
+        chart = alt.Chart(alt.Data(values=rows)).mark_bar().encode(
+            x=alt.X("start:Q", title="開始からの秒数"),
+            x2="end:Q",
+            y=alt.Y("row:N", sort=None, axis=None),
+            color=alt.Color("stage:N", title="段階"),
+            tooltip=["stage:N", "seconds:Q", "start:Q", "thread:N", "detail:N"],
+        ).properties(height=max(120, 10 * len(rows)))
+        st.altair_chart(chart, use_container_width=True)
+
+        summary = [
+            {"段階": name, "回数": v["count"], "合計(秒)": round(v["total"], 3), "最大(秒)": round(v["max"], 3),
+             "CPU(秒)": round(v["cpu"], 3)}
+            for name, v in sorted(trace.summary().items(), key=lambda kv: -kv[1]["total"])
+        ]
+        st.caption("同時に走った段階（TTSなど）の合計は重ねて足しています")
+        st.dataframe(summary, use_container_width=True, hide_index=True)
+        st.download_button("OTLP/JSON で保存", data=json.dumps(trace.to_otlp(), ensure_ascii=False),
+                           file_name=f"trace_{trace.trace_id}.json", mime="application/json")
+
+LIBRARY_PAGE_SIZE = 10
+JST = timezone(timedelta(hours=9))
+
+def show_library(style_labels, languages):
+    """
+    保存済みの番組を新しい順に一覧する（雰囲気・言語・作成日で絞り込み、ページ送り）。
+    社内資料かもしれないPDFの番組は出さず、Webの資料から作った番組だけを出す
+    """
+    index = get_radio_index()
+    with st.expander("📚 ライブラリ（これまでに作られた番組）", expanded=False):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            style = st.selectbox("番組の雰囲気", [None] + list(style_labels), key="library_style",
+                                 format_func=lambda x: "すべて" if x is None else style_labels[x])
+        with col2:
+            lang = st.selectbox("放送言語", [None] + languages, key="library_language",
+                                format_func=lambda x: "すべて" if x is None else x)
+        with col3:
+            dates = st.date_input("作成日", value=(), key="library_dates")
+
+        since = until = None
+        if dates:
+            since = datetime.combine(dates[0], datetime.min.time(), tzinfo=JST)
+            if len(dates) > 1:
+                until = datetime.combine(dates[1] + timedelta(days=1), datetime.min.time(), tzinfo=JST)
+
+        # 絞り込みを変えたら1ページ目に戻る
+        filters = (style, lang, tuple(dates))
+        if st.session_state.get("library_filters") != filters:
+            st.session_state["library_filters"] = filters
+            st.session_state["library_page"] = 0
+        page = st.session_state.get("library_page", 0)
+
+        items, total = index.query(style=style, language=lang, since=since, until=until, kind="url",
+                                   offset=page * LIBRARY_PAGE_SIZE, limit=LIBRARY_PAGE_SIZE)
+        if total == 0:
+            st.caption("条件に合う番組はまだありません。")
+            return
+        pages = (total + LIBRARY_PAGE_SIZE - 1) // LIBRARY_PAGE_SIZE
+        for item in items:
+            created_at = item.get("created_at")
+            created = created_at.astimezone(JST).strftime("%Y/%m/%d %H:%M") if isinstance(created_at, datetime) else ""
+            st.markdown(f"**{item.get('title', '無題')}**  \n"
+                        f"{style_labels.get(item.get('style'), item.get('style'))} / {item.get('language', '')} / {created}")
+            st.caption(item.get("source", ""))
+            play_saved(item)
+
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if st.button("◀ 前へ", disabled=page == 0, key="library_prev"):
+                st.session_state["library_page"] = page - 1
+                st.rerun()
+        with col_page:
+            st.caption(f"{page + 1} / {pages} ページ（{total}本）")
+        with col_next:
+            if st.button("次へ ▶", disabled=page + 1 >= pages, key="library_next"):
+                st.session_state["library_page"] = page + 1
+                st.rerun()
 
 # ---------------------------
 # メイン画面
@@ -183,9 +498,10 @@ st.caption("公的情報や社内資料を、AIが聞きやすいラジオ番組
 
 # 設定エリア
 st.markdown("##### ⚙️ 番組の設定")
+LANGUAGES = ["日本語", "英語", "中国語"]
 col1, col2 = st.columns(2)
 with col1:
-    language = st.selectbox("放送言語", ["日本語", "英語", "中国語"], index=0)
+    language = st.selectbox("放送言語", LANGUAGES, index=0)
 with col2:
     style_options = {
         "standard": "🎙️ 標準ニュース",
@@ -195,14 +511,16 @@ with col2:
         "university": "🏫 大学生トーク"
     }
     style_key = st.selectbox("番組の雰囲気", options=list(style_options.keys()), format_func=lambda x: style_options[x])
+stream_playback = st.checkbox("⚡ できた部分から先に再生する", value=True)
+long_document = st.checkbox("📚 長い資料モード（切り詰めずに要約してから台本にする。少し時間がかかります）", value=False)
+use_bgm = False
+if st.secrets.get("BGM_FILE") and os.path.exists(st.secrets["BGM_FILE"]):
+    use_bgm = st.checkbox("🎵 BGMを敷く（セリフ中は小さくなります）", value=False)
 st.markdown("---")
 
 # 入力モード切替
 input_mode = st.radio("入力ソースを選択", ["URL (記事・動画)", "PDF (資料アップロード)"], horizontal=True)
 
-content_text = ""
-source_id = ""
-title_str = "ラジオ番組"
 allow_cache = True
 ready_to_generate = False
 
@@ -211,7 +529,6 @@ if input_mode == "URL (記事・動画)":
     url_input = st.text_input("記事または動画のURL", placeholder="https://...")
     
     if url_input:
-        source_id = url_input
         if is_safe_domain(url_input):
             st.success("✅ 公的機関・教育機関等のドメインを確認しました。通常モードで生成可能です。")
             ready_to_generate = True
@@ -237,9 +554,6 @@ elif input_mode == "PDF (資料アップロード)":
     uploaded_file = st.file_uploader("PDFファイルをアップロード", type="pdf")
     
     if uploaded_file:
-        source_id = uploaded_file.name + str(uploaded_file.size)
-        title_str = uploaded_file.name
-        
         st.markdown("**この資料の種類を選択してください：**")
         doc_type = st.radio("資料タイプ", 
             ["公的機関の資料・広報物（国・自治体など）", 
@@ -267,163 +581,64 @@ if ready_to_generate:
     btn_label = "🎙️ 番組を再生する" if allow_cache else "🎙️ 番組を再生する（保存なしモード）"
     
     if st.button(btn_label, use_container_width=True):
-        style_config = get_style_config(style_key, language)
-        cache_key = generate_cache_key(source_id, style_key, language)
-        
-        # キャッシュ確認
-        cached_data = None
+        if input_mode == "URL (記事・動画)":
+            request = pipeline.RadioRequest(url_input, style_key, language, allow_cache=allow_cache,
+                                            long_document=long_document)
+        else:
+            # ジョブは別スレッドで動くので、アップロードされた中身をコピーして渡す
+            request = pipeline.RadioRequest.for_pdf(io.BytesIO(uploaded_file.getvalue()),
+                                                    uploaded_file.name,
+                                                    style=style_key, language=language,
+                                                    allow_cache=allow_cache,
+                                                    long_document=long_document)
+
+        writer = get_script_writer(gemini_key)
+        radio_pipeline = pipeline.RadioPipeline(
+            # 保存なしモードではPDFの文字もキャッシュしない
+            fetcher=sources.SourceFetcher(pdf_cache=get_pdf_cache() if allow_cache else None,
+                                          page_cache=get_page_cache() if allow_cache else None),
+            writer=writer,
+            tts_client=get_openai_client(openai_key),
+            store=radio_store.FirebaseRadioStore(db, bucket, index=get_radio_index()) if db is not None else None,
+            segment_cache=get_segment_cache(),
+            post=get_post_processor(use_bgm),
+            renditions=AUDIO_RENDITIONS,
+            # 保存なしモードでは要約もキャッシュしない
+            summarizer=summarizer.Summarizer(writer.model, model_name=script_writer.GEMINI_MODEL,
+                                             cache=get_summary_cache() if allow_cache else None),
+        )
+
+        def run_job(job):
+            # ★先行再生のパートもジョブに積む。相乗りしてくる人が先行再生したいかは分からないので、いつも作っておく
+            return radio_pipeline.run_job(request, job)
+
+        queue = get_job_queue()
         if allow_cache:
-            cached_data = check_cache(cache_key)
-        
-        if cached_data:
-            st.success(f"♻️ キャッシュから再生します！\nタイトル: {cached_data.get('title', '無題')}")
-            st.audio(cached_data['audio_url'], format="audio/mp3")
-        
+            # 同じ注文（資料・スタイル・言語）を誰かが作っていれば、そのジョブに相乗りする
+            request_key = radio_store.generate_cache_key(request.source_id, style_key, language)
+            # 出来上がりが変わる設定が違う注文とは別のジョブにする（先行再生するかは見る側の設定なので含めない）
+            for option, enabled in (("long", long_document), ("bgm", use_bgm)):
+                if enabled:
+                    request_key += f":{option}"
+            job, is_new = queue.submit(request_key, run_job)
+            if not is_new:
+                st.info("👥 同じ番組をいま作っている人がいます。完成を一緒に待ちます。")
         else:
-            # 新規生成
-            try:
-                # 1. コンテンツ取得
-                with st.spinner("🐢 資料を読み込んでいます..."):
-                    if input_mode == "URL (記事・動画)":
-                        content_text = fetch_content_from_url(url_input, openai_key)
-                        if "【Web記事：" in content_text:
-                            title_str = content_text.split("【Web記事：")[1].split("】")[0]
-                    else:
-                        # ▼▼▼【ここが修正版！】▼▼▼
-                        # PDFの文字数チェック機能を追加
-                        pdf_reader = PyPDF2.PdfReader(uploaded_file)
-                        text = ""
-                        for page in pdf_reader.pages:
-                            text += page.extract_text()
-                        
-                        st.info(f"🔍 デバッグ: PDFから読み取れた文字数は **{len(text)} 文字** です")
-                        
-                        if len(text) == 0:
-                            st.error("⚠️ エラー: 文字が読み取れませんでした。このPDFは「画像（スキャンデータ）」ではありませんか？ 現在の仕組みでは画像PDFは読めません。")
-                            st.stop() # ここで強制ストップ
-                        
-                        content_text = f"【PDF資料：{uploaded_file.name}】\n{text[:10000]}..."
-                        # ▲▲▲【ここまで】▲▲▲
-                
-                # 2. 台本作成
-                with st.spinner("✍️ AIが構成を考えています..."):
-                    genai.configure(api_key=gemini_key)
-                    model = genai.GenerativeModel('gemini-2.5-flash')
-                    
-                    source_statement = ""
-                    if input_mode == "PDF (資料アップロード)":
-                        source_statement = f"冒頭で『この放送は、資料 {title_str} を元にAIが作成しました』と明言すること。"
-                    
-                    prompt = f"""
-                    以下の情報を元にラジオ台本を作成してください。
-                    {style_config['prompt_role']}
-                    {source_statement}
-                    
-                    【重要：出力形式】
-                    - 各行は「A: セリフ」「B: セリフ」の形式で書くこと。
-                    - 箇条書きの記号（・や*）は使わないこと。
-                    - ト書き（笑いや拍手など）は書かないこと。
-                    - 専門用語はわかりやすく噛み砕くこと。
-                    
-                    【構成】OP→本題→ED。5分程度。
-                    
-                    【入力データ】
-                    {content_text}
-                    """
-                    script_text = model.generate_content(prompt).text
-
-                # 3. 音声合成
-                with st.spinner("🎙️ 収録中（間を調整しています）..."):
-                    client = OpenAI(api_key=openai_key)
-                    lines = script_text.split('\n')
-                    
-                    # ミキサーに渡すためのデータリストを作成
-                    script_data_list = []
-                    
-                    for line in lines:
-                        line = line.strip()
-                        if not line: continue
-                        
-                        # クリーニング処理
-                        clean_line = re.sub(r'^[\*\-・\s]+', '', line)
-                        clean_line = clean_line.replace('**', '')
-                        
-                        parts = re.split('[:：]', clean_line, 1)
-                        
-                        voice = None
-                        text_content = ""
-
-                        # 話者判定と声の割り当て
-                        if len(parts) >= 2:
-                            speaker_part = parts[0].strip()
-                            text_content = parts[1].strip()
-                            if "A" in speaker_part or "Ａ" in speaker_part:
-                                voice = style_config['voice_a']
-                            elif "B" in speaker_part or "Ｂ" in speaker_part:
-                                voice = style_config['voice_b']
-                            else:
-                                voice = style_config['voice_a']
-                                text_content = clean_line
-                        else:
-                            voice = style_config['voice_a']
-                            text_content = clean_line
-                        
-                        # リストに追加
-                        if voice and text_content:
-                            script_data_list.append({
-                                "voice": voice,
-                                "text": text_content
-                            })
-
-                    # ★ここでaudio_mixerを呼び出す！
-                    if script_data_list:
-                        try:
-                            # ミキサー関数を実行（ファイルが生成される）
-                            output_filename = audio_mixer.combine_audio_with_ma(
-                                script_data_list, 
-                                client, 
-                                speed=style_config['speed']
-                            )
-                            
-                            # 生成されたファイルを読み込んで combined_audio に入れる
-                            with open(output_filename, "rb") as f:
-                                combined_audio = f.read()
-                                
-                            # 一時ファイルは削除してもOK（今回は残しておいても上書きされるので放置でも可）
-                            
-                        except Exception as e:
-                            st.error(f"Mixing Error: {e}")
-                            combined_audio = b""
-                    else:
-                        combined_audio = b""
-                        
-                    # 4. 完了表示
-                    if allow_cache:
-                        # 保存ありモード（URL再生なのでiPhoneもOK）
-                        with st.spinner("💾 クラウドに保存中..."):
-                            audio_url = save_to_cache(cache_key, combined_audio, source_id, style_key, language, title_str)
-                        st.success("🎉 完成！")
-                        st.audio(audio_url, format="audio/mp3")
-                    else:
-                        # 保存なしモード（iPhoneでコケる鬼門）
-                        st.success("🎉 完成！（保存なしモード）")
-                        st.warning("⚠️ 著作権保護のためサーバーには保存されません。ダウンロードデータは**「私的利用（個人での視聴）」**に留め、**第三者への配布やSNSへのアップロードは絶対に行わないでください。**")
-                        
-                        # ★ここが最終兵器：Base64埋め込みプレーヤー
-                        # データを文字列化してHTMLに直接書き込むことで、iPhoneでも強制的に再生させる
-                        b64_audio = base64.b64encode(combined_audio).decode()
-                        audio_html = f"""
-                        <audio controls style="width: 100%;">
-                            <source src="data:audio/mp3;base64,{b64_audio}" type="audio/mp3">
-                            お使いのブラウザは音声再生に対応していません。
-                        </audio>
-                        """
-                        st.markdown(audio_html, unsafe_allow_html=True)
-
-                    # 台本表示
-                    st.divider()
-                    with st.expander("📝 生成された台本をチェックする（クリックで開閉）", expanded=False):
-                        st.write(script_text)
-
-            except Exception as e:
-                st.error(f"エラーが発生しました: {e}")
\ No newline at end of file
+            job = queue.submit_private(run_job)
+        st.session_state["job_key"] = job.key
+        st.session_state["job_private"] = not allow_cache
+
+# ジョブの表示（再実行されても、動いているジョブの続きから表示する）
+if "job_key" in st.session_state:
+    current_job = get_job_queue().get(st.session_state["job_key"])
+    if current_job is None:
+        del st.session_state["job_key"]
+    else:
+        show_job(current_job, st.session_state.get("job_private", False), stream_playback)
+        if DEBUG_PANEL:
+            show_trace(current_job.trace)
+
+# 保存済みの番組の一覧
+if db is not None:
+    st.divider()
+    show_library(style_options, LANGUAGES)
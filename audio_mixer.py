@@ -1,65 +1,428 @@
 import random
-from pydub import AudioSegment
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from pydub import AudioSegment
+import tracing
+from tts_cache import make_segment_key
+
+TTS_MODEL = "tts-1"
+# 結合の仕方（間の取り方など）を変えて、保存済みの番組音声を作り直したいときに上げる
+MIX_VERSION = 1
+
+# 同時に投げるTTSリクエストの上限（OpenAIのレート制限に合わせて調整）
+DEFAULT_MAX_WORKERS = 4
+# レート制限(429)時の再試行回数と待ち時間の基準（秒）
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+# 先行再生のパート分け（最初は短く切って早く届ける）
+FIRST_PART_LINES = 3
+PART_LINES = 10
+
+# 番組全体のPCM形式（OpenAI TTSの出力に合わせて 24kHz / モノラル / 16bit）
+FRAME_RATE = 24000
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+# 台本の文字数から番組の長さを見積もるときの目安（1文字あたりのミリ秒）
+EST_MS_PER_CHAR = 150
 
-def create_silence(min_ms=300, max_ms=800):
-    """ランダムな長さの無音を作成する"""
-    duration = random.randint(min_ms, max_ms)
-    return AudioSegment.silent(duration=duration)
+# 保存する音声の形式（rendition）。話し声だけの番組なので、圧縮版はモノラル・低ビットレートで十分。
+# "mp3" は以前からの形式（ffmpeg の既定。24kHz モノラルでは 32kbps）で、保存先では audio_url になる
+RENDITIONS = {
+    "mp3": {"format": "mp3", "args": [], "content_type": "audio/mpeg", "ext": "mp3"},
+    "mp3_low": {"format": "mp3", "args": ["-b:a", "24k"], "content_type": "audio/mpeg", "ext": "low.mp3"},
+    "opus": {"format": "ogg", "args": ["-c:a", "libopus", "-b:a", "24k", "-application", "voip"],
+             "content_type": "audio/ogg", "ext": "opus"},
+    "aac": {"format": "adts", "args": ["-c:a", "aac", "-b:a", "16k"], "content_type": "audio/aac", "ext": "aac"},
+}
+DEFAULT_RENDITIONS = ("mp3",)
 
-def combine_audio_with_ma(script_data, client_openai, speed=1.0):
+def ms_to_bytes(ms):
+    """ミリ秒をPCMのバイト数にする（フレーム境界に揃える）"""
+    return FRAME_RATE * ms // 1000 * CHANNELS * SAMPLE_WIDTH
+
+def create_silence(min_ms=300, max_ms=800, seed=None):
     """
-    台本データ(JSON)を受け取り、セリフごとに音声を生成して
-    「間」を挟みながら結合する関数
+    ランダムな長さの「間」（ミリ秒）を決める。
+    seed を渡すとそれで決まる長さになる（同じ台本からはいつも同じ音声ができる）
     """
-    
-    # 空のオーディオトラックを作成
-    full_audio = AudioSegment.empty()
-    
-    # 最初のBGM的な無音（少し溜める）
-    full_audio += AudioSegment.silent(duration=500)
+    if seed is None:
+        return random.randint(min_ms, max_ms)
+    return random.Random(seed).randint(min_ms, max_ms)
 
-    print("--- 音声結合処理開始 ---")
+def estimate_program_ms(script_data):
+    """台本（リスト）から番組の長さをざっくり見積もる。見積もれないときは 0"""
+    if not isinstance(script_data, (list, tuple)):
+        return 0
+    chars = sum(len(item.get("text", "")) for item in script_data)
+    return 500 + chars * EST_MS_PER_CHAR + len(script_data) * 800
 
-    for index, item in enumerate(script_data):
-        voice = item.get("voice", "alloy") # 指定された声を使う
-        text = item.get("text", "")
-        
-        if not text:
-            continue
+class PcmBuffer:
+    """
+    番組全体のPCMを1本のbytearrayに書き込んでいくバッファ。
+    AudioSegmentの += のように毎回全体をコピーし直さない。
+    容量は先に確保しておき（足りなければ倍々に広げる）、
+    無音は書き込み位置を進めるだけ（確保済みの領域は最初から0なので何も書かない）
+    """
+
+    def __init__(self, expected_ms=0):
+        self._data = bytearray(ms_to_bytes(expected_ms))
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def duration_ms(self):
+        return self._length * 1000 // (FRAME_RATE * CHANNELS * SAMPLE_WIDTH)
+
+    def _reserve(self, n):
+        need = self._length + n
+        if need > len(self._data):
+            grow = max(need, len(self._data) * 2) - len(self._data)
+            self._data.extend(bytearray(grow))
+
+    def append_pcm(self, pcm):
+        """PCMのバイト列を末尾に書き込む"""
+        n = len(pcm)
+        self._reserve(n)
+        self._data[self._length:self._length + n] = pcm
+        self._length += n
+
+    def append_silence(self, ms):
+        """無音を ms ミリ秒ぶん足す"""
+        n = ms_to_bytes(ms)
+        self._reserve(n)
+        self._length += n
+
+    def overwrite(self, start, pcm):
+        """書き込み済みの start バイト目からを pcm で置き換える（後処理の書き戻し用）"""
+        end = start + len(pcm)
+        if end > self._length:
+            raise ValueError("overwrite past the end of the buffer")
+        self._data[start:end] = pcm
+
+    def slice(self, start=0, end=None):
+        """start〜end バイト目のPCMをコピーして返す（パートの書き出し用）"""
+        end = self._length if end is None else min(end, self._length)
+        with memoryview(self._data) as mv:
+            return bytes(mv[start:end])
+
+    def view(self):
+        """書き込み済みの部分をコピーせずに参照する（使い終わったら release すること）"""
+        return memoryview(self._data)[:self._length]
+
+def _ffmpeg(args, data):
+    """ffmpegをパイプでつないで実行し、標準出力のバイト列を返す（一時ファイルを使わない）"""
+    cmd = [AudioSegment.converter, "-hide_banner", "-loglevel", "error"] + args
+    proc = subprocess.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg error: {proc.stderr.decode(errors='ignore').strip()}")
+    return proc.stdout
+
+# エンコード結果を出力先へ流すときの1回あたりの大きさ
+ENCODE_CHUNK_SIZE = 256 * 1024
+
+_PCM_ARGS = ["-f", "s16le", "-ar", str(FRAME_RATE), "-ac", str(CHANNELS)]
+
+def decode_mp3(mp3_bytes):
+    """MP3バイト列を番組のPCM形式（生のバイト列）に直接デコードする"""
+    return _ffmpeg(["-f", "mp3", "-i", "pipe:0"] + _PCM_ARGS + ["-acodec", "pcm_s16le", "pipe:1"],
+                   mp3_bytes)
+
+def encode_pcm_to(pcm, out, format="mp3", bitrate=None, chunk_size=ENCODE_CHUNK_SIZE, codec_args=None):
+    """
+    PCMをまとめて1回でエンコードし、できた分から out（書き込めるファイルオブジェクト）に流し込む。
+    出力全体をいったんメモリに溜めない（out が保存先へのアップロードなら、エンコードしながら送られる）
+    """
+    args = _PCM_ARGS + ["-i", "pipe:0"] + list(codec_args or [])
+    if bitrate:
+        args += ["-b:a", bitrate]
+    cmd = [AudioSegment.converter, "-hide_banner", "-loglevel", "error"] + args + ["-f", format, "pipe:1"]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed():
+        try:
+            proc.stdin.write(pcm)
+        except BrokenPipeError:
+            pass # ffmpegが先に落ちた（エラーは下で拾う）
+        finally:
+            proc.stdin.close()
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        while True:
+            chunk = proc.stdout.read(chunk_size)
+            if not chunk:
+                break
+            out.write(chunk)
+    except BaseException:
+        # 書き込み先で失敗した：ffmpeg は読まれない出力のパイプで止まり、feed も stdin で止まったままになるので、
+        # 先に ffmpeg を止めてから待つ
+        proc.kill()
+        feeder.join()
+        proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+        raise
+    feeder.join()
+    stderr = proc.stderr.read()
+    returncode = proc.wait()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg error: {stderr.decode(errors='ignore').strip()}")
+    return out
+
+def encode_pcm(pcm, format="mp3", bitrate=None):
+    """PCMをまとめて1回でエンコードし、バイト列で返す"""
+    return encode_pcm_to(pcm, BytesIO(), format=format, bitrate=bitrate).getvalue()
+
+def encode_rendition_to(pcm, out, rendition="mp3"):
+    """PCMを RENDITIONS の形式でエンコードして out に流し込む"""
+    spec = RENDITIONS[rendition]
+    return encode_pcm_to(pcm, out, format=spec["format"], codec_args=spec["args"])
+
+def parse_renditions(value):
+    """
+    保存する形式の設定（リストか、"mp3,opus" のようなカンマ区切りの文字列）を名前のタプルにする。
+    RENDITIONS に無い名前があれば ValueError（TTS にお金を払ってから保存で落ちないように、起動時に確かめる）
+    """
+    if isinstance(value, str):
+        value = value.split(",")
+    names = tuple(name.strip() for name in value if name.strip())
+    unknown = [name for name in names if name not in RENDITIONS]
+    if unknown:
+        raise ValueError(f"unknown audio renditions: {', '.join(unknown)} (choose from {', '.join(RENDITIONS)})")
+    return names
+
+def pick_rendition(available, user_agent=""):
+    """
+    保存済みの形式（available: 名前 -> {bytes, ...}）から、そのブラウザで再生できて一番小さいものの名前を返す。
+    Safari（iPhone・iPad・Mac。iOS の Chrome も中身は Safari）は Ogg の Opus を再生できないので外す。
+    大きさが分からないときは Opus → AAC → 低ビットレートの MP3 → MP3 の順。どれも無ければ None
+    """
+    user_agent = user_agent or ""
+    safari = ("iPhone" in user_agent or "iPad" in user_agent
+              or ("Safari" in user_agent and "Chrome" not in user_agent and "Chromium" not in user_agent))
+    order = ("opus", "aac", "mp3_low", "mp3")
+    playable = [name for name in order if name in available and not (safari and name == "opus")]
+    if not playable:
+        return None
+    return min(playable, key=lambda name: ((available[name] or {}).get("bytes", float("inf")), order.index(name)))
+
+def _is_rate_limit_error(e):
+    """OpenAIのレート制限エラー(429)かどうかを判定する"""
+    if type(e).__name__ == "RateLimitError":
+        return True
+    return getattr(e, "status_code", None) == 429
+
+def synthesize_line(client_openai, voice, text, speed=1.0,
+                    max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF, cache=None, trace=None):
+    """
+    1行分のセリフをOpenAI TTSで音声化し、MP3のバイト列を返す。
+    レート制限に当たった場合は指数バックオフで再試行する。
+    cache (tts_cache.SegmentCache) を渡すと、同じセリフはTTSを呼ばずに使い回す。
+    trace (tracing.Trace) を渡すと、1行ごとの時間・バイト数・再試行回数を記録する
+    """
+    with tracing.span(trace, "tts", voice=voice, chars=len(text)) as span:
+        key = None
+        if cache is not None:
+            key = make_segment_key(voice, speed, TTS_MODEL, text)
+            cached = cache.get(key, chars=len(text))
+            if cached is not None:
+                span.set(cached=True, bytes=len(cached))
+                tracing.TTS_CHARS.inc(len(text), cache="hit")
+                return cached
 
-        print(f"Generating: {voice} - {text[:10]}...")
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                response = client_openai.audio.speech.create(
+                    model=TTS_MODEL,
+                    voice=voice,
+                    input=text,
+                    speed=speed
+                )
+                if cache is not None:
+                    cache.put(key, response.content, elapsed=time.perf_counter() - start)
+                span.set(cached=False, bytes=len(response.content), retries=attempt)
+                tracing.TTS_CHARS.inc(len(text), cache="miss")
+                tracing.TTS_BYTES.observe(len(response.content))
+                return response.content
+            except Exception as e:
+                if attempt >= max_retries or not _is_rate_limit_error(e):
+                    raise
+                wait = backoff * (2 ** attempt) + random.uniform(0, backoff)
+                print(f"Rate limited ({voice} - {text[:10]}...), retry in {wait:.1f}s")
+                tracing.TTS_RETRIES.inc()
+                time.sleep(wait)
+                attempt += 1
 
-        # 1. 音声生成 (OpenAI TTS)
+def iter_synthesized(script_data, client_openai, speed=1.0,
+                     max_workers=DEFAULT_MAX_WORKERS, max_retries=DEFAULT_MAX_RETRIES, cache=None,
+                     trace=None):
+    """
+    台本の各セリフを並列で音声化し、台本の順番どおりに (item, MP3バイト列) をyieldする。
+    生成に失敗したセリフのバイト列は None になる。
+    script_data はジェネレーターでもよい（届いたセリフから順にリクエストを投げる）
+    """
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+
+    def pop_result():
+        index, item, future = pending.popleft()
         try:
-            response = client_openai.audio.speech.create(
-                model="tts-1",
-                voice=voice,
-                input=text,
-                speed=speed # 速度も反映させる
-            )
-            
-            # バイナリデータをAudioSegmentに変換
-            audio_data = BytesIO(response.content)
-            segment = AudioSegment.from_file(audio_data, format="mp3")
-            
-            # 2. トラックに追加
-            full_audio += segment
-            
-            # 3. 「間」を追加（最後のセリフ以外）
-            if index < len(script_data) - 1:
-                # ランダムな間を生成 (例: 0.3秒〜0.8秒)
-                ma = create_silence(300, 800)
-                full_audio += ma
-                
+            return item, future.result()
         except Exception as e:
             print(f"Error generating voice for line {index}: {e}")
+            return item, None
+
+    try:
+        for index, item in enumerate(script_data):
+            voice = item.get("voice", "alloy") # 指定された声を使う
+            text = item.get("text", "")
+
+            if not text:
+                continue
+
+            print(f"Generating: {voice} - {text[:10]}...")
+            future = pool.submit(synthesize_line, client_openai, voice, text, speed,
+                                 max_retries, DEFAULT_BACKOFF, cache, trace)
+            pending.append((index, item, future))
+
+            # 先頭から順に、終わっているものだけ先に返す
+            while pending and pending[0][2].done():
+                yield pop_result()
+
+        while pending:
+            yield pop_result()
+    finally:
+        # 途中で打ち切られた場合は、まだ始まっていないリクエストを捨てる
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _decode_mp3(item, mp3_bytes, trace=None):
+    """MP3バイト列をPCMに変換する（失敗したら None）"""
+    try:
+        with tracing.span(trace, "decode", bytes=len(mp3_bytes)):
+            return decode_mp3(mp3_bytes)
+    except Exception as e:
+        print(f"Error decoding voice ({item.get('text', '')[:10]}...): {e}")
+        return None
+
+def iter_program_parts(script_data, client_openai, speed=1.0,
+                       first_part_lines=FIRST_PART_LINES, part_lines=PART_LINES,
+                       max_workers=DEFAULT_MAX_WORKERS, cache=None, program=None, trace=None,
+                       post=None):
+    """
+    番組を先頭から「パート」に区切って、できた順にPCMのバイト列をyieldする（先行再生用）。
+    最初のパートは first_part_lines 行だけで早めに返し、以降は part_lines 行ずつ返す。
+    パートは「間」込みなので、順番につなげるとそのまま番組全体になる。
+    program (PcmBuffer) を渡すと、番組全体もそこに組み立てる。
+    trace (tracing.Trace) を渡すと、セリフごとの合成・デコードの時間を記録する。
+    post (audio_post.PostProcessor) を渡すと、1行ごとに音量・フェード・BGMの後処理をしてからパートにする
+    """
+    if program is None:
+        program = PcmBuffer(estimate_program_ms(script_data))
+
+    # 最初のBGM的な無音（少し溜める）
+    part_start = len(program)
+    program.append_silence(500)
+    lines_in_part = 0
+    limit = first_part_lines
+    is_first = True
+
+    for item, mp3_bytes in iter_synthesized(script_data, client_openai, speed=speed,
+                                            max_workers=max_workers, cache=cache, trace=trace):
+        if mp3_bytes is None:
             continue
 
+        pcm = _decode_mp3(item, mp3_bytes, trace)
+        if pcm is None:
+            continue
+
+        # 「間」を追加（セリフとセリフの間だけ。最初の行の前は冒頭の無音が「間」）
+        gap_start = len(program) if not is_first else part_start
+        if not is_first:
+            # ランダムな間を生成 (例: 0.3秒〜0.8秒)。長さはセリフで決める（同時に何本作っても、同じ台本なら同じ音声）
+            program.append_silence(create_silence(300, 800, seed=f"{item['voice']}:{item['text']}"))
+        is_first = False
+
+        # トラックに追加
+        line_start = len(program)
+        program.append_pcm(pcm)
+        lines_in_part += 1
+        if post is not None:
+            with tracing.span(trace, "post", bytes=len(pcm)):
+                post.process_line(program, gap_start, line_start, len(program))
+
+        if lines_in_part >= limit:
+            yield program.slice(part_start)
+            part_start = len(program)
+            lines_in_part = 0
+            limit = part_lines
+
+    if post is not None and not is_first:
+        post.finish(program)
+    if len(program) > part_start:
+        yield program.slice(part_start)
+
+def export_mp3(pcm):
+    """PCM（パートや番組全体）をMP3のバイト列にする"""
+    return encode_pcm(pcm, format="mp3")
+
+def mix_program(script_data, client_openai, speed=1.0,
+                max_workers=DEFAULT_MAX_WORKERS, cache=None, on_part=None, trace=None, post=None):
+    """
+    台本データ(JSON)を受け取り、セリフごとに音声を生成して「間」を挟みながら結合し、
+    番組全体の PcmBuffer を返す（エンコードはしない。引数は combine_audio_with_ma と同じ）
+    """
+    # 番組全体を書き込むPCMバッファ（台本から長さを見積もって先に確保）
+    program = PcmBuffer(estimate_program_ms(script_data))
+
+    print("--- 音声結合処理開始 ---")
+
+    # mix は最初のセリフを待ち始めてから最後のパートを渡し終えるまで（合成待ちも含む）
+    with tracing.span(trace, "mix") as span:
+        parts = 0
+        for part in iter_program_parts(script_data, client_openai, speed=speed,
+                                       max_workers=max_workers, cache=cache, program=program,
+                                       trace=trace, post=post):
+            parts += 1
+            if on_part:
+                on_part(part)
+        span.set(parts=parts, program_ms=program.duration_ms())
+
     print("--- 音声結合完了 ---")
-    
-    # 一時ファイルとして書き出し
-    output_filename = "radio_output.mp3"
-    full_audio.export(output_filename, format="mp3")
-    
-    return output_filename
\ No newline at end of file
+    return program
+
+def combine_audio_with_ma(script_data, client_openai, speed=1.0,
+                          max_workers=DEFAULT_MAX_WORKERS, cache=None, on_part=None, output=None,
+                          trace=None, post=None):
+    """
+    台本データ(JSON)を受け取り、セリフごとに音声を生成して
+    「間」を挟みながら結合する関数
+    （音声生成は max_workers 本まで並列で行い、結合は台本の順番どおり。
+    cache を渡すと生成済みのセリフ音声を使い回す。
+    on_part を渡すと、パートができるたびにPCMのバイト列で呼ばれる（先行再生用））
+    完成したMP3はメモリ上で作り、バイト列で返す（ファイルには書かない）。
+    output（書き込めるファイルオブジェクト）を渡すとそこへ書き出し、先頭に戻して返す。
+    trace (tracing.Trace) を渡すと、合成・デコード・結合・エンコードの時間を記録する。
+    post (audio_post.PostProcessor) を渡すと、音量の調整・フェード・BGM・リミッターをかける
+    """
+    program = mix_program(script_data, client_openai, speed=speed, max_workers=max_workers,
+                          cache=cache, on_part=on_part, trace=trace, post=post)
+
+    # エンコードは最後に1回だけ
+    pcm = program.view()
+    try:
+        with tracing.span(trace, "export", pcm_bytes=len(pcm)):
+            if output is None:
+                return export_mp3(pcm)
+            encode_pcm_to(pcm, output, format="mp3")
+    finally:
+        pcm.release()
+    output.seek(0)
+    return output
@@ -0,0 +1,179 @@
+import hashlib
+import numpy as np
+import audio_mixer
+
+# 結合した番組PCMの後処理（NumPyでまとめて計算する）
+# ・セリフごとに音量をそろえる（声によって大きさが違うので、ゲートつきRMSで目標の大きさに合わせる）
+# ・セリフの頭と終わりを短くフェードして、無音との境目のプチッという音を消す
+# ・BGMを敷く場合は、セリフの間は大きく、セリフ中は小さく（ダッキング）
+# ・最後にピークリミッターで音割れを防ぐ
+# 処理はセリフが1行届くたびに、その行（と直前の間）の範囲だけを PcmBuffer の上で書き換える。
+# 先行再生のパートも完成した番組も同じ音になる
+
+DEFAULT_TARGET_DB = -20.0 # セリフの目標の大きさ（dBFS、ゲートつきRMS）
+DEFAULT_MAX_GAIN_DB = 12.0 # 1行あたりに上げ下げする上限
+DEFAULT_FADE_MS = 10
+DEFAULT_LIMIT_DB = -1.0 # ピークの上限（dBFS）
+DEFAULT_BGM_DB = -22.0 # セリフの間のBGMの大きさ
+DEFAULT_DUCK_DB = -14.0 # セリフ中にBGMをさらに下げる量
+DEFAULT_DUCK_MS = 200 # BGMを上げ下げするのにかける時間
+DEFAULT_TAIL_MS = 1500 # BGMを敷いたときの番組の終わりの余韻
+
+GATE_BLOCK_MS = 100 # 大きさを測る区切り
+ABSOLUTE_GATE_DB = -70.0 # これより小さい区切りは無音として数えない
+RELATIVE_GATE_DB = -10.0 # 全体の大きさよりこれだけ小さい区切りも数えない（息継ぎなど）
+LIMIT_BLOCK_MS = 5 # リミッターがゲインを決める区切り
+LIMIT_WINDOW_BLOCKS = 8 # ピークの前後この区切り数ぶんは同じだけ下げる（急にゲインが変わらないように）
+
+FULL_SCALE = 32768.0
+
+def _db_to_gain(db):
+    return 10.0 ** (db / 20.0)
+
+def _samples(ms):
+    return audio_mixer.FRAME_RATE * ms // 1000
+
+def measure_loudness(x):
+    """
+    セリフの大きさ（dBFS）を測る。GATE_BLOCK_MS ごとの平均パワーのうち、
+    無音と小さすぎる区切りを除いて平均する（BS.1770 のゲートと同じ考え方。Kフィルターは省略）。
+    無音なら None
+    """
+    block = _samples(GATE_BLOCK_MS)
+    n = len(x) // block
+    if n == 0:
+        power = np.array([np.mean(np.square(x, dtype=np.float64))]) if len(x) else np.array([0.0])
+    else:
+        power = np.mean(np.square(x[:n * block].reshape(n, block), dtype=np.float64), axis=1)
+    with np.errstate(divide="ignore"):
+        power_db = 10.0 * np.log10(power / FULL_SCALE ** 2)
+    gated = power[power_db > ABSOLUTE_GATE_DB]
+    if len(gated) == 0:
+        return None
+    relative = 10.0 * np.log10(np.mean(gated) / FULL_SCALE ** 2) + RELATIVE_GATE_DB
+    with np.errstate(divide="ignore"):
+        kept = gated[10.0 * np.log10(gated / FULL_SCALE ** 2) > relative]
+    return float(10.0 * np.log10(np.mean(kept) / FULL_SCALE ** 2))
+
+def fade_envelope(n, fade):
+    """長さ n の、頭と終わりが fade サンプルずつ直線で 0 になる包絡線"""
+    env = np.ones(n, dtype=np.float32)
+    fade = min(fade, n // 2)
+    if fade > 0:
+        ramp = np.linspace(0.0, 1.0, fade, endpoint=False, dtype=np.float32)
+        env[:fade] = ramp
+        env[n - fade:] = ramp[::-1]
+    return env
+
+def limit_peaks(x, limit):
+    """
+    x（float32、その場で書き換える）のピークを limit 以下に抑える。
+    LIMIT_BLOCK_MS ごとに必要なゲインを求め、前後 LIMIT_WINDOW_BLOCKS 区切りの最小値を
+    区切りの境目のゲインにして直線でつなぐ。ゲインは滑らかに変わり、どのサンプルも必ず limit 以下になる
+    """
+    peak = float(np.max(np.abs(x))) if len(x) else 0.0
+    if peak <= limit:
+        return x
+    block = _samples(LIMIT_BLOCK_MS)
+    n = -(-len(x) // block)
+    padded = np.zeros(n * block, dtype=np.float32)
+    padded[:len(x)] = np.abs(x)
+    block_peak = padded.reshape(n, block).max(axis=1)
+    need = np.minimum(1.0, limit / np.maximum(block_peak, 1e-9))
+    # 境目 k のゲインは need[k-w]〜need[k+w-1] の最小値（両隣の区切りにとって十分小さい）
+    w = LIMIT_WINDOW_BLOCKS
+    padded_need = np.concatenate((np.ones(w), need, np.ones(w)))
+    edge = np.lib.stride_tricks.sliding_window_view(padded_need, 2 * w).min(axis=1)
+    positions = np.arange(n + 1) * block
+    gain = np.interp(np.arange(len(x)), positions, edge).astype(np.float32)
+    x *= gain
+    np.clip(x, -limit, limit, out=x)
+    return x
+
+def load_bgm(path):
+    """BGMのファイル（ffmpegで読める形式なら何でも）を番組のPCM形式に直す"""
+    with open(path, "rb") as f:
+        data = f.read()
+    return audio_mixer._ffmpeg(["-i", "pipe:0"] + audio_mixer._PCM_ARGS + ["-acodec", "pcm_s16le", "pipe:1"],
+                               data)
+
+class PostProcessor:
+    """
+    番組PCMの後処理の設定。状態は持たないので、同時に何本の番組で使ってもよい。
+    bgm は番組と同じ形式のPCMバイト列（load_bgm で作る。None ならBGMなし）で、足りなければ繰り返す
+    """
+
+    def __init__(self, target_db=DEFAULT_TARGET_DB, max_gain_db=DEFAULT_MAX_GAIN_DB,
+                 fade_ms=DEFAULT_FADE_MS, limit_db=DEFAULT_LIMIT_DB, bgm=None,
+                 bgm_db=DEFAULT_BGM_DB, duck_db=DEFAULT_DUCK_DB, duck_ms=DEFAULT_DUCK_MS,
+                 tail_ms=DEFAULT_TAIL_MS):
+        self.target_db = target_db
+        self.max_gain_db = max_gain_db
+        self.fade = _samples(fade_ms)
+        self.limit = _db_to_gain(limit_db) * FULL_SCALE
+        self.limit_db = limit_db
+        self.bgm = None
+        self.bgm_hash = None
+        if bgm:
+            self.bgm = np.frombuffer(bgm, dtype=np.int16).astype(np.float32) * _db_to_gain(bgm_db)
+            self.bgm_hash = hashlib.sha256(bgm).hexdigest()[:16]
+        self.bgm_db = bgm_db
+        self.duck = _db_to_gain(duck_db)
+        self.duck_db = duck_db
+        self.duck_samples = _samples(duck_ms)
+        self.tail_ms = tail_ms
+
+    def fingerprint(self):
+        """設定の指紋（番組音声のキャッシュキーに混ぜる。設定やBGMが変われば作り直しになる）"""
+        parts = [self.target_db, self.max_gain_db, self.fade, self.limit_db]
+        if self.bgm is not None:
+            parts += [self.bgm_hash, self.bgm_db, self.duck_db, self.duck_samples, self.tail_ms]
+        return hashlib.sha256(repr(parts).encode()).hexdigest()[:12]
+
+    def _bgm_bed(self, start, n, levels_at, levels):
+        """番組の start サンプル目から n サンプルぶんのBGM（levels_at の位置で levels の大きさ）"""
+        bed = np.take(self.bgm, np.arange(start, start + n) % len(self.bgm))
+        bed *= np.interp(np.arange(n), levels_at, levels).astype(np.float32)
+        return bed
+
+    def process_line(self, program, gap_start, line_start, line_end):
+        """
+        program（audio_mixer.PcmBuffer）の gap_start〜line_end バイト目（直前の間 + 1行）を後処理して書き戻す。
+        line_start〜line_end がセリフ
+        """
+        size = audio_mixer.SAMPLE_WIDTH
+        if self.bgm is None:
+            gap_start = line_start # BGMが無ければ間は無音のままなので触らない
+        region = np.frombuffer(program.slice(gap_start, line_end), dtype=np.int16).astype(np.float32)
+        speech_at = (line_start - gap_start) // size
+        speech = region[speech_at:]
+
+        loudness = measure_loudness(speech)
+        if loudness is not None:
+            gain_db = np.clip(self.target_db - loudness, -self.max_gain_db, self.max_gain_db)
+            speech *= _db_to_gain(gain_db)
+        speech *= fade_envelope(len(speech), self.fade)
+
+        if self.bgm is not None:
+            # 間の頭でセリフ中の大きさから戻し、次のセリフの直前で下げる（番組の最初はBGMのフェードイン）
+            gap = speech_at
+            ramp = min(self.duck_samples, gap // 2)
+            start_level = self.duck if gap_start > 0 else 0.0
+            region += self._bgm_bed(gap_start // size, len(region),
+                                    [0, ramp, gap - ramp, gap, len(region)],
+                                    [start_level, 1.0, 1.0, self.duck, self.duck])
+
+        limit_peaks(region, self.limit)
+        program.overwrite(gap_start, region.astype(np.int16).tobytes())
+
+    def finish(self, program):
+        """番組の終わりの処理（BGMを敷いたときは、余韻をつけてBGMをフェードアウトする）"""
+        if self.bgm is None or len(program) == 0:
+            return
+        start = len(program)
+        program.append_silence(self.tail_ms)
+        n = (len(program) - start) // audio_mixer.SAMPLE_WIDTH
+        ramp = min(self.duck_samples, n // 2)
+        tail = self._bgm_bed(start // audio_mixer.SAMPLE_WIDTH, n, [0, ramp, n], [self.duck, 1.0, 0.0])
+        limit_peaks(tail, self.limit)
+        program.overwrite(start, tail.astype(np.int16).tobytes())
@@ -0,0 +1,1109 @@
+"""
+オフライン計測用のスクリプト（外部APIを使わず、フェイクのクライアントで計測する）
+
+動作の確認は tests/ のテストで行う（python -m pytest -q）。ここでは時間・メモリ・呼び出し回数を測るだけ
+
+使い方:
+    python benchmark.py tts --lines 60 --latency 0.3 --workers 1 4 8
+    python benchmark.py script --lines 60 --gemini-latency 0.05
+    python benchmark.py pipeline --sources 3 --jobs 2
+    python benchmark.py mix --lines 10 100 1000
+    python benchmark.py pdf --pages 300
+    python benchmark.py trace --programs 4 --concurrent 2
+    python benchmark.py post --minutes 10
+    python benchmark.py index --programs 2000
+    python benchmark.py ephemeral --mb 5 --clients 8
+    python benchmark.py summarize --pages 50 200 --workers 1 4 8 16
+    python benchmark.py startup --repeat 5 --reruns 20
+    python benchmark.py e2e --lines 10 40 120 --jobs 1 4               （benchmark_baseline.json と比べ、呼び出し回数が違うか遅くなっていれば失敗）
+    python benchmark.py renditions --minutes 5 --plays 1000
+    python benchmark.py e2e --save-baseline                            （今の結果を基準として保存）
+"""
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+import numpy as np
+
+import audio_mixer
+import audio_post
+import ephemeral_audio
+import fetcher
+import job_queue
+import pdf_ingest
+import pipeline
+import radio_store
+import script_writer
+import sources
+import summarizer
+import tracing
+from fakes import (VOICE_LEVELS, ConnectionCountingServer, FakeBucket, FakeFirestore, FakeGeminiModel,
+                   FakeSummaryModel, FakeTTSClient, InMemoryRadioStore, StubFetcher, StubHTTPServer, dominant_freq,
+                   make_pdf, make_script, silent_mp3, speech_like_pcm, tone_mp3, voice_spread, wait_until)
+
+# ---------------------------
+# 計測
+# ---------------------------
+def bench_tts(args):
+    script = make_script(args.lines)
+    print(f"lines={args.lines} latency={args.latency}s")
+    baseline = None
+    for workers in args.workers:
+        random.seed(0)
+        # 結合しないので中身はダミーでよい
+        client = FakeTTSClient(latency=args.latency, content=b"ID3")
+        start = time.perf_counter()
+        results = list(audio_mixer.iter_synthesized(script, client, max_workers=workers))
+        elapsed = time.perf_counter() - start
+        if baseline is None:
+            baseline = elapsed
+        print(f"  workers={workers:3d}  {elapsed:7.2f}s  x{baseline / elapsed:5.1f}  "
+              f"(calls={client.calls}, max_in_flight={client.max_in_flight})")
+
+    # 429 を混ぜたときの、待って再試行する分の遅れ
+    client = FakeTTSClient(latency=args.latency, content=b"ID3", fail_every=args.fail_every)
+    start = time.perf_counter()
+    results = list(audio_mixer.iter_synthesized(script, client, max_workers=max(args.workers)))
+    elapsed = time.perf_counter() - start
+    print(f"  rate limited     {elapsed:7.2f}s  (calls={client.calls}, 429={client.rate_limited}, "
+          f"retries={client.calls - len(script)})")
+
+def bench_stream(args):
+    script = make_script(args.lines)
+    print(f"lines={args.lines} latency={args.latency}s workers={args.workers}")
+    random.seed(0)
+    client = FakeTTSClient(latency=args.latency)
+    start = time.perf_counter()
+    part_times = []
+    for part in audio_mixer.iter_program_parts(script, client, max_workers=args.workers):
+        audio_mixer.export_mp3(part)
+        part_times.append(time.perf_counter() - start)
+    total = time.perf_counter() - start
+    print(f"  time-to-first-audio {part_times[0]:7.2f}s")
+    print(f"  total               {total:7.2f}s  (parts={len(part_times)})")
+
+def bench_script(args):
+    print(f"lines={args.lines} gemini={args.gemini_latency}s/line tts={args.latency}s workers={args.workers}")
+    model = FakeGeminiModel(args.lines, line_latency=args.gemini_latency)
+
+    # 台本を全部書き終えてからTTS
+    client = FakeTTSClient(latency=args.latency, content=b"ID3")
+    start = time.perf_counter()
+    script = script_writer.parse_script(model.generate_content("").text, "onyx", "nova")
+    results = list(audio_mixer.iter_synthesized(script, client, max_workers=args.workers))
+    sequential = time.perf_counter() - start
+    print(f"  sequential  {sequential:7.2f}s  (lines={len(results)})")
+
+    # 書けた行から順にTTS
+    client = FakeTTSClient(latency=args.latency, content=b"ID3")
+    start = time.perf_counter()
+    parser = script_writer.ScriptLineParser("onyx", "nova")
+    items = script_writer.iter_script_items(script_writer.stream_script(model, ""), parser)
+    results = list(audio_mixer.iter_synthesized(items, client, max_workers=args.workers))
+    streaming = time.perf_counter() - start
+    print(f"  streaming   {streaming:7.2f}s  x{sequential / streaming:5.1f}")
+
+def bench_pipeline(args):
+    """スタブのバックエンドだけで RadioPipeline のバッチを通しで動かす"""
+    store = InMemoryRadioStore()
+    source_fetcher = StubFetcher()
+    gemini = FakeGeminiModel(args.lines, line_latency=0.01)
+    tts = FakeTTSClient(latency=args.latency)
+    radio_pipeline = pipeline.RadioPipeline(
+        fetcher=source_fetcher,
+        writer=script_writer.GeminiScriptWriter(gemini),
+        tts_client=tts,
+        store=store,
+        max_workers=args.workers,
+    )
+    requests = [
+        pipeline.RadioRequest(f"https://example.go.jp/page{i}", style, "日本語")
+        for i in range(args.sources) for style in ("standard", "jk")
+    ]
+    print(f"programs={len(requests)} lines={args.lines} jobs={args.jobs}")
+
+    def run(label):
+        gemini_calls, tts_calls = gemini.calls, tts.calls
+        start = time.perf_counter()
+        results = radio_pipeline.run_batch(requests, jobs=args.jobs)
+        elapsed = time.perf_counter() - start
+        errors = [e for _, _, e in results if e is not None]
+        if errors:
+            sys.exit(f"{label}: {errors}")
+        cached = sum(1 for _, r, _ in results if r["from_cache"])
+        print(f"  {label:14s} {elapsed:7.2f}s  from_cache={cached}/{len(results)}  "
+              f"gemini_calls={gemini.calls - gemini_calls}  tts_calls={tts.calls - tts_calls}")
+
+    run("cold")
+    run("warm")
+    # 音声だけ消える（結合方法を変えた場合など）→ 台本は使い回し、Geminiは呼ばない
+    store.docs.clear()
+    run("audio dropped")
+    # 資料の本文が変わった → 台本から作り直す
+    source_fetcher.version += 1
+    run("source changed")
+    print(f"  scripts={len(store.scripts)} programs={len(store.docs)}")
+
+def bench_jobs(args):
+    """同じ番組を同時に頼む人が何人いるときの、生成の回数と全員が受け取るまでの時間を測る"""
+    runs = []
+
+    def run_job(job):
+        runs.append(job.key)
+        for stage in ("fetch", "record", "save"):
+            job.set_stage(stage)
+            time.sleep(args.latency)
+        return {"from_cache": False}
+
+    queue = job_queue.JobQueue(max_concurrent=args.concurrent)
+    start = time.perf_counter()
+    jobs = []
+    for i in range(args.users):
+        key = f"program{i % args.programs}"
+        jobs.append(queue.submit(key, run_job)[0])
+    for job in jobs:
+        version = -1
+        while not job.finished:
+            version = job.wait(version)
+    elapsed = time.perf_counter() - start
+    print(f"users={args.users} programs={args.programs} concurrent={args.concurrent}")
+    print(f"  runs={len(runs)}  {elapsed:7.2f}s  stats={queue.stats()}")
+
+def bench_trace(args):
+    """
+    スタブのバックエンドで番組をジョブキューから作り、一番待たされたジョブの内訳と、
+    Prometheus・OTLP の出力にかかる時間、span 1つあたりの計測のオーバーヘッドを測る
+    """
+    store = InMemoryRadioStore()
+    gemini = FakeGeminiModel(args.lines, line_latency=0.01)
+    radio_pipeline = pipeline.RadioPipeline(
+        fetcher=StubFetcher(),
+        writer=script_writer.GeminiScriptWriter(gemini),
+        tts_client=FakeTTSClient(latency=args.latency),
+        store=store,
+        max_workers=args.workers,
+    )
+    queue = job_queue.JobQueue(max_concurrent=args.concurrent)
+
+    def submit(i):
+        request = pipeline.RadioRequest(f"https://example.go.jp/page{i}", "standard", "日本語")
+        return queue.submit(f"program{i}", lambda job: radio_pipeline.run_job(request, job))[0]
+
+    start = time.perf_counter()
+    jobs = [submit(i) for i in range(args.programs)]
+    for job in jobs:
+        version = -1
+        while not job.finished:
+            version = job.wait(version)
+    elapsed = time.perf_counter() - start
+    if any(job.status != "done" for job in jobs):
+        sys.exit(f"failed: {[job.error for job in jobs if job.error]}")
+    print(f"programs={args.programs} lines={args.lines} concurrent={args.concurrent}  {elapsed:.2f}s")
+
+    # 順番待ちが一番長かったジョブの内訳（混んでいるときの遅れの原因を探す例）
+    slowest = max(jobs, key=lambda job: job.finished_at - job.created_at)
+    print(f"  slowest {slowest.key}: {slowest.finished_at - slowest.created_at:.2f}s")
+    for name, v in sorted(slowest.trace.summary().items(), key=lambda kv: -kv[1]["total"]):
+        print(f"    {name:16s} n={v['count']:3d}  total={v['total']:7.3f}s  max={v['max']:6.3f}s")
+
+    t0 = time.perf_counter()
+    exported = [json.dumps(job.trace.to_otlp()) for job in jobs]
+    print(f"  otlp: {(time.perf_counter() - t0) / len(jobs) * 1000:.2f}ms/job  "
+          f"{sum(map(len, exported)) / len(jobs) / 1024:.1f}KB/job")
+    t0 = time.perf_counter()
+    text = tracing.render_prometheus()
+    print(f"  prometheus: {len(text.splitlines())} lines in {(time.perf_counter() - t0) * 1000:.2f}ms, "
+          f"tts_count={tracing.STAGE_SECONDS.count(stage='tts')}")
+
+    # 計測そのものの重さ
+    n = 100000
+    for label, trace in (("no trace", None), ("with trace", tracing.Trace("overhead"))):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            with tracing.span(trace, "overhead"):
+                pass
+        print(f"  span overhead ({label:10s}) {(time.perf_counter() - t0) / n * 1e6:6.2f}us")
+
+def bench_render(args):
+    """
+    2本の番組を同時に結合するのにかかる時間を測る
+    （番組Aは440Hz、番組Bは880Hzの音だけでできていて、出力の音の高さで混ざっていないかも見られる）
+    """
+    programs = {"A": (440, args.lines), "B": (880, args.lines * 2)}
+    outputs = {}
+
+    def render(name):
+        freq, lines = programs[name]
+        client = FakeTTSClient(latency=args.latency, content=tone_mp3(freq))
+        outputs[name] = audio_mixer.combine_audio_with_ma(make_script(lines), client,
+                                                          max_workers=args.workers)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=render, args=(name,)) for name in programs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    for name, (freq, lines) in programs.items():
+        pcm = audio_mixer.decode_mp3(outputs[name])
+        seconds = len(pcm) / audio_mixer.ms_to_bytes(1000)
+        # 無音の「間」があるので、音の高さは実際より少し低めに出る
+        measured = dominant_freq(pcm) * seconds / lines
+        print(f"  {name}  lines={lines:3d}  {seconds:6.1f}s  {measured:5.0f}Hz  mp3={len(outputs[name]) / 1024:.0f}KB")
+    print(f"  concurrent renders {elapsed:.2f}s")
+
+def _pdf_legacy(data, max_chars):
+    """以前の読み方（全ページを += でつないでから切る）"""
+    import PyPDF2
+    reader = PyPDF2.PdfReader(BytesIO(data))
+    text = ""
+    for page in reader.pages:
+        text += page.extract_text()
+    return text if max_chars is None else text[:max_chars]
+
+def _measure(fn, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+def bench_pdf(args):
+    data = make_pdf(args.pages)
+    print(f"pages={args.pages} pdf={len(data) / 1024:.0f}KB workers={args.workers}")
+    for max_chars in (pdf_ingest.PDF_CHAR_LIMIT, None):
+        label = f"max_chars={max_chars or 'all'}"
+        expected, elapsed, peak = _measure(_pdf_legacy, data, max_chars)
+        print(f"  {label:16s} legacy      {elapsed:7.2f}s  peak={peak:6.1f}MB  chars={len(expected)}")
+        for name, workers in (("sequential", 1), ("parallel", args.workers)):
+            text, elapsed, peak = _measure(pdf_ingest.extract_pdf_text, data,
+                                           max_chars=max_chars, max_workers=workers)
+            print(f"  {label:16s} {name:10s}  {elapsed:7.2f}s  peak={peak:6.1f}MB  (親プロセスのみ)")
+
+    cache = pdf_ingest.PdfTextCache(tempfile.mkdtemp(prefix="pdf_text_cache_"))
+    pdf_ingest.read_pdf(BytesIO(data), cache=cache)
+    _, elapsed, _ = _measure(pdf_ingest.read_pdf, BytesIO(data), cache=cache)
+    print(f"  cached re-upload  {elapsed * 1000:7.1f}ms  (hits={cache.hits})")
+
+def bench_fetch(args):
+    import requests
+    server = StubHTTPServer()
+    cache = fetcher.SourceContentCache(tempfile.mkdtemp(prefix="source_cache_"))
+    url = f"{server.url}/article"
+    try:
+        # キャッシュの経路ごとの時間（miss → hit → 304で使い回し）
+        for label, kwargs in (("miss", {}), ("hit", {}), ("revalidated", {"max_age": 0})):
+            start = time.perf_counter()
+            status = fetcher.fetch_url(url, cache=cache, **kwargs)["status"]
+            print(f"  {label:12s} {(time.perf_counter() - start) * 1000:7.2f}ms  (status={status})")
+        print(f"  {cache.stats()}  server_requests={server.requests} 304={server.not_modified}")
+
+        start = time.perf_counter()
+        big = fetcher.fetch_url(f"{server.url}/big", max_bytes=args.max_kb * 1024)
+        print(f"  /big truncated to {len(big['text']) // 1024}KB in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        # 接続の使い回しあり・なしの比較
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            res = requests.get(url, timeout=10)
+            res.encoding = res.apparent_encoding
+            res.text
+        fresh = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            fetcher.fetch_url(url, max_age=0)
+        pooled = time.perf_counter() - start
+        print(f"  {args.requests} GETs  requests.get {fresh:6.2f}s  pooled {pooled:6.2f}s")
+    finally:
+        server.close()
+
+def _mix_legacy(lines, mp3_bytes, line_pcm, decode):
+    """以前の結合方法（AudioSegmentの += で毎回つなぎ直す）"""
+    from pydub import AudioSegment
+    line = AudioSegment(data=line_pcm, sample_width=audio_mixer.SAMPLE_WIDTH,
+                        frame_rate=audio_mixer.FRAME_RATE, channels=audio_mixer.CHANNELS)
+    full_audio = AudioSegment.silent(duration=500, frame_rate=audio_mixer.FRAME_RATE)
+    for i in range(lines):
+        if decode:
+            line = AudioSegment.from_file(BytesIO(mp3_bytes), format="mp3")
+        if i > 0:
+            full_audio += AudioSegment.silent(duration=audio_mixer.create_silence(300, 800),
+                                              frame_rate=audio_mixer.FRAME_RATE)
+        full_audio += line
+    buf = BytesIO()
+    full_audio.export(buf, format="mp3")
+    return buf.getvalue()
+
+def _mix_pcm(lines, mp3_bytes, line_pcm, decode):
+    """PcmBufferで1本のバッファに書き込み、最後に1回だけエンコードする"""
+    line_ms = len(line_pcm) * 1000 // audio_mixer.ms_to_bytes(1000)
+    program = audio_mixer.PcmBuffer(500 + lines * (line_ms + 800))
+    program.append_silence(500)
+    for i in range(lines):
+        pcm = audio_mixer.decode_mp3(mp3_bytes) if decode else line_pcm
+        if i > 0:
+            program.append_silence(audio_mixer.create_silence(300, 800))
+        program.append_pcm(pcm)
+    view = program.view()
+    try:
+        return audio_mixer.export_mp3(view)
+    finally:
+        view.release()
+
+def bench_mix_one(args):
+    """1回分の結合を計測してJSONで出力する（ピークRSSを分けるため別プロセスで呼ばれる）"""
+    random.seed(0)
+    mp3_bytes = silent_mp3(args.line_ms)
+    line_pcm = audio_mixer.decode_mp3(mp3_bytes)
+    mix = _mix_legacy if args.engine == "legacy" else _mix_pcm
+    start = time.perf_counter()
+    out = mix(args.lines, mp3_bytes, line_pcm, args.decode)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "seconds": elapsed,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "mp3_bytes": len(out),
+    }))
+
+def bench_mix(args):
+    print(f"line={args.line_ms}ms decode={args.decode}")
+    for lines in args.lines:
+        for engine in ("legacy", "pcm"):
+            cmd = [sys.executable, __file__, "mix-one", "--engine", engine,
+                   "--lines", str(lines), "--line-ms", str(args.line_ms)]
+            if args.decode:
+                cmd.append("--decode")
+            out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+            r = json.loads(out.decode().strip().splitlines()[-1])
+            print(f"  lines={lines:5d}  {engine:6s}  {r['seconds']:8.2f}s  "
+                  f"peak_rss={r['peak_rss_mb']:7.1f}MB  mp3={r['mp3_bytes'] / 1024:8.0f}KB")
+
+def bench_post(args):
+    """
+    10分ほどの番組の後処理（音量そろえ・フェード・BGM・リミッター）にかかる時間を測る。
+    実時間（番組の長さ）よりどれだけ速いかと、声ごとの大きさの差・ピークを出す
+    """
+    rng = np.random.default_rng(0)
+    voices = list(VOICE_LEVELS)
+    line_pcm = []
+    total_ms = 0
+    while total_ms < args.minutes * 60 * 1000:
+        voice = voices[len(line_pcm) % len(voices)]
+        pcm = speech_like_pcm(rng, VOICE_LEVELS[voice], rng.uniform(2, 6))
+        line_pcm.append((voice, pcm))
+        total_ms += len(pcm) * 1000 // audio_mixer.ms_to_bytes(1000) + 550
+    bgm = speech_like_pcm(rng, -12.0, 7.3)
+    print(f"program={total_ms / 60000:.1f}min lines={len(line_pcm)}")
+
+    def assemble(post):
+        """iter_program_parts と同じ順番で組み立て、後処理にかかった時間だけを測る"""
+        random.seed(0)
+        program = audio_mixer.PcmBuffer(total_ms + 2000)
+        program.append_silence(500)
+        lines = []
+        spent = 0.0
+        gap_start = 0
+        for i, (voice, pcm) in enumerate(line_pcm):
+            if i > 0:
+                gap_start = len(program)
+                program.append_silence(audio_mixer.create_silence(300, 800))
+            line_start = len(program)
+            program.append_pcm(pcm)
+            lines.append((voice, line_start, len(program)))
+            if post is not None:
+                t0 = time.perf_counter()
+                post.process_line(program, gap_start, line_start, len(program))
+                spent += time.perf_counter() - t0
+        if post is not None:
+            t0 = time.perf_counter()
+            post.finish(program)
+            spent += time.perf_counter() - t0
+        return program, lines, spent
+
+    program, lines, _ = assemble(None)
+    peak = np.max(np.abs(np.frombuffer(program.slice(), dtype=np.int16).astype(np.int32)))
+    print(f"  {'raw':10s}  {'':>8s}  {'':>8s}  voice_spread={voice_spread(program, lines):5.1f}dB  "
+          f"peak={20 * np.log10(peak / 32768):6.1f}dBFS")
+
+    for label, post in (("normalize", audio_post.PostProcessor()),
+                        ("with bgm", audio_post.PostProcessor(bgm=bgm))):
+        program, lines, spent = assemble(post)
+        data = np.frombuffer(program.slice(), dtype=np.int16).astype(np.int32)
+        peak_db = 20 * np.log10(max(np.max(np.abs(data)), 1) / 32768)
+        spread = voice_spread(program, lines)
+        print(f"  {label:10s}  {spent:7.2f}s  x{total_ms / 1000 / spent:6.0f}  "
+              f"voice_spread={spread:5.1f}dB  peak={peak_db:6.1f}dBFS")
+
+    # 比較：pydub でセリフごとにゲイン・フェードをかけて += でつなぐ
+    from pydub import AudioSegment
+    random.seed(0)
+    t0 = time.perf_counter()
+    combined = AudioSegment.silent(duration=500, frame_rate=audio_mixer.FRAME_RATE)
+    for i, (voice, pcm) in enumerate(line_pcm):
+        seg = AudioSegment(data=pcm, sample_width=audio_mixer.SAMPLE_WIDTH,
+                           frame_rate=audio_mixer.FRAME_RATE, channels=audio_mixer.CHANNELS)
+        seg = seg.apply_gain(audio_post.DEFAULT_TARGET_DB - seg.dBFS).fade_in(10).fade_out(10)
+        if i > 0:
+            combined += AudioSegment.silent(duration=audio_mixer.create_silence(300, 800),
+                                            frame_rate=audio_mixer.FRAME_RATE)
+        combined += seg
+    print(f"  {'pydub':10s}  {time.perf_counter() - t0:7.2f}s  (gain + fade + += per line, no limiter)")
+
+def bench_index(args):
+    """
+    radios の索引（RadioIndex）を Firestore のスタブで測る。
+    キャッシュの確認1回あたりの時間と読み込み回数・他のプロセスの保存が届くまでの時間・ライブラリのページ送り・
+    キャッシュ済みの注文を pipeline.run で流したときの Firestore の読み込み回数
+    """
+    db = FakeFirestore(latency=args.latency)
+    styles = ["standard", "jk", "comedian"]
+    languages = ["日本語", "英語"]
+    now = datetime.now(timezone.utc)
+    collection = db.collection('radios')
+    for i in range(args.programs):
+        collection.docs[f"key{i}"] = {
+            # PDF の source は 'pdf:...'。古い番組は「ファイル名 + 大きさ」のまま
+            'source': (f"pdf:{i}" if i % 10 == 0 else f"社内資料{i}.pdf{i * 1000}" if i % 5 == 0
+                       else f"https://example.go.jp/{i}"),
+            'style': styles[i % 3], 'language': languages[i % 2], 'title': f"番組{i}",
+            'audio_url': f"memory://audio/key{i}.mp3",
+            'created_at': now - timedelta(hours=i),
+        }
+    keys = [f"key{random.randrange(args.programs * 2)}" for _ in range(args.lookups)]
+    print(f"programs={args.programs} lookups={args.lookups} latency={args.latency * 1000:.0f}ms")
+
+    def lookups(store, label):
+        reads = db.reads
+        start = time.perf_counter()
+        found = sum(1 for key in keys if store.get(key) is not None)
+        elapsed = time.perf_counter() - start
+        print(f"  {label:16s} {elapsed * 1000 / len(keys):8.3f}ms/lookup  found={found}  "
+              f"firestore_reads={db.reads - reads}")
+
+    lookups(radio_store.FirebaseRadioStore(db, FakeBucket()), "no index")
+
+    start = time.perf_counter()
+    index = radio_store.RadioIndex(db, listen=True).start()
+    print(f"  index start      {time.perf_counter() - start:8.3f}s  stats={index.stats()}")
+    store = radio_store.FirebaseRadioStore(db, FakeBucket(), index=index)
+    lookups(store, "listener index")
+
+    # 他のプロセスが保存した番組がリスナーで届くまで
+    start = time.perf_counter()
+    collection.document("from-other-process").set({'source': "https://example.go.jp/x", 'style': "jk",
+                                                   'language': "日本語", 'title': "別プロセス",
+                                                   'audio_url': "memory://x",
+                                                   'created_at': datetime.now(timezone.utc)})
+    wait_until(lambda: index.get("from-other-process") is not None)
+    print(f"  listener update  {time.perf_counter() - start:8.3f}s  stats={index.stats()}")
+
+    # ライブラリ：絞り込み結果を全部めくる
+    since = now - timedelta(hours=args.programs // 2)
+    start = time.perf_counter()
+    offset = 0
+    while True:
+        page, total = index.query(style="jk", language="日本語", since=since, kind="url",
+                                  offset=offset, limit=10)
+        if not page:
+            break
+        offset += len(page)
+    elapsed = time.perf_counter() - start
+    print(f"  library pages    {elapsed * 1000:8.2f}ms  matched={total} pages={-(-total // 10)}")
+    index.stop()
+
+    # キャッシュ済みの注文を pipeline.run で通しで流したときの Firestore の読み込み回数
+    run_db = FakeFirestore(latency=args.latency)
+    run_index = radio_store.RadioIndex(run_db, listen=True).start()
+    request = pipeline.RadioRequest("https://example.go.jp/cached", "standard", "日本語")
+
+    def run_once(store, label):
+        radio_pipeline = pipeline.RadioPipeline(
+            fetcher=StubFetcher(),
+            writer=script_writer.GeminiScriptWriter(FakeGeminiModel(6)),
+            tts_client=FakeTTSClient(latency=0.0),
+            store=store,
+        )
+        reads = run_db.reads
+        start = time.perf_counter()
+        result = radio_pipeline.run(request)
+        elapsed = time.perf_counter() - start
+        print(f"  {label:16s} {elapsed:8.3f}s  from_cache={result['from_cache']}  "
+              f"firestore_reads={run_db.reads - reads}")
+
+    run_once(radio_store.FirebaseRadioStore(run_db, FakeBucket(), index=run_index), "run (cold)")
+    run_once(radio_store.FirebaseRadioStore(run_db, FakeBucket()), "run (no index)")
+    run_once(radio_store.FirebaseRadioStore(run_db, FakeBucket(), index=run_index), "run (index)")
+    run_index.stop()
+
+def bench_ephemeral(args):
+    """
+    保存なしモードの一時置き場（署名URL + Range 配信）を測る。
+    base64 埋め込みとの大きさの差と、同時に取りに来たときの速さ
+    """
+    import base64
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+
+    audio = random.Random(0).randbytes(args.mb * 1024 * 1024)
+    store = ephemeral_audio.EphemeralAudioStore(max_bytes=args.mb * 5 // 2 * 1024 * 1024)
+    server = ephemeral_audio.serve(store, 0, host="127.0.0.1")
+    port = server.server_address[1]
+    key = store.put("session-a", audio)
+    path = store.signed_path(key)
+    inline = len(base64.b64encode(audio)) + 200
+    print(f"audio={len(audio) / 1e6:.1f}MB  base64 html={inline / 1e6:.1f}MB  url={len(path)}B")
+
+    # Safari のように 256KB ずつ Range で取りに来るクライアントを同時に走らせる
+    def client(_):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        received = 0
+        for start in range(0, len(audio), 256 * 1024):
+            end = min(start + 256 * 1024, len(audio)) - 1
+            conn.request("GET", path, headers={"Range": f"bytes={start}-{end}"})
+            received += len(conn.getresponse().read())
+        conn.close()
+        return received
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        total = sum(pool.map(client, range(args.clients)))
+    elapsed = time.perf_counter() - start
+    print(f"  clients={args.clients}  {total / 1e6:.0f}MB in {elapsed:.2f}s  ({total / 1e6 / elapsed:.0f}MB/s)")
+    server.shutdown()
+
+def bench_summarize(args):
+    """
+    長い資料モードの要約（map-reduce）をフェイクのLLMで測る。
+    ページ数と同時に投げる数ごとの時間と、再実行・1ページ変えたとき・途中に文章を足したときに
+    LLMを呼び直す回数
+    """
+    texts = {}
+    for pages in args.pages:
+        texts[pages] = pdf_ingest.extract_pdf_text(make_pdf(pages), max_chars=None)
+    print(f"latency={args.latency}s/call chunk={summarizer.DEFAULT_MAX_CHUNK_TOKENS} tokens")
+
+    print("  pages  chunks  workers  calls  max_in_flight  seconds")
+    for pages, text in texts.items():
+        chunks = len(summarizer.split_chunks(text))
+        for workers in args.workers:
+            model = FakeSummaryModel(latency=args.latency)
+            start = time.perf_counter()
+            summarizer.Summarizer(model, max_workers=workers).condense(text)
+            elapsed = time.perf_counter() - start
+            print(f"  {pages:5d}  {chunks:6d}  {workers:7d}  {model.calls:5d}  {model.max_in_flight:13d}  {elapsed:7.2f}")
+
+    # かたまりごとのキャッシュ
+    pages = max(texts)
+    text = texts[pages]
+    cache = summarizer.SummaryCache(tempfile.mkdtemp(prefix="summary_cache_"))
+    model = FakeSummaryModel(latency=args.latency)
+    condenser = summarizer.Summarizer(model, cache=cache, max_workers=max(args.workers))
+    condenser.condense(text)
+    cold_calls = model.calls
+    start = time.perf_counter()
+    condenser.condense(text)
+    print(f"  rerun            {time.perf_counter() - start:.2f}s  calls={model.calls - cold_calls} (cold={cold_calls})")
+
+    def rerun(label, new_text):
+        """new_text を要約し直して、前に無かったかたまりの数とLLMを呼び直した回数を出す"""
+        before = set(summarizer.split_chunks(text))
+        chunks = summarizer.split_chunks(new_text)
+        changed = [c for c in chunks if c not in before]
+        trace = tracing.Trace(label)
+        calls = model.calls
+        condenser.condense(new_text, trace=trace)
+        map_calls = sum(1 for sp in trace.spans if sp.name == "summarize_map" and not sp.attrs.get("cached"))
+        print(f"  {label:16s} chunks={len(chunks)}  unchanged={len(chunks) - len(changed)}  "
+              f"map_calls={map_calls}  calls={model.calls - calls} (map + reduce)")
+
+    page = pages // 2
+    rerun("one page edited", text.replace(f"Page {page} line 7:", f"Page {page} line 7 (revised):"))
+    # 途中にかたまり1つぶんくらいの文章を足す
+    inserted_text = "".join(f"Inserted line {i}: new findings about item {i} were added.\n" for i in range(300))
+    marker = f"Page {page} line 1:"
+    rerun("chunk inserted", text.replace(marker, inserted_text + marker, 1))
+
+    # パイプラインを通す：長い資料モードでは切り詰めずに要約してから台本にする
+    trace = tracing.Trace("summarize")
+    radio_pipeline = pipeline.RadioPipeline(
+        fetcher=sources.SourceFetcher(),
+        writer=script_writer.GeminiScriptWriter(FakeGeminiModel(4, line_latency=0.0)),
+        tts_client=FakeTTSClient(latency=0.0),
+        summarizer=summarizer.Summarizer(FakeSummaryModel(latency=0.0), max_workers=max(args.workers)),
+    )
+    request = pipeline.RadioRequest.for_pdf(BytesIO(make_pdf(pages)), "report.pdf", long_document=True)
+    radio_pipeline.run(request, trace=trace)
+    stages = trace.summary()
+    print(f"  pipeline         summarize={stages['summarize']['total']:.2f}s "
+          f"map_calls={stages['summarize_map']['count']} reduce_calls={stages.get('summarize_reduce', {}).get('count', 0)}")
+
+# 以前の app.py が起動のたびに読み込んでいたもの（yt_dlp は使っていなかった）
+EAGER_IMPORTS = ["streamlit", "openai", "yt_dlp", "firebase_admin", "firebase_admin.firestore",
+                 "firebase_admin.storage", "google.generativeai", "PyPDF2", "bs4", "youtube_transcript_api"]
+# app.py が読み込む自前のモジュール
+APP_MODULES = ["audio_mixer", "audio_post", "ephemeral_audio", "tts_cache", "script_writer", "summarizer",
+               "sources", "radio_store", "pipeline", "job_queue", "pdf_ingest", "fetcher", "tracing"]
+# 使うときまで読み込まないもの
+LAZY_MODULES = ["openai", "yt_dlp", "firebase_admin", "google.generativeai", "PyPDF2", "bs4",
+                "youtube_transcript_api"]
+
+def _import_seconds(modules):
+    """新しいプロセスで modules を読み込むのにかかる秒数と、読み込まれた重いモジュール"""
+    code = (f"import importlib, json, sys, time\n"
+            f"start = time.perf_counter()\n"
+            f"for name in {modules!r}:\n"
+            f"    try: importlib.import_module(name)\n"
+            f"    except ImportError: pass\n" # yt_dlp はもう requirements に入っていない
+            f"print(json.dumps([time.perf_counter() - start, [m for m in {LAZY_MODULES!r} if m in sys.modules]]))")
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", code], check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def bench_startup(args):
+    """
+    画面の起動と再実行にかかる時間を測る。
+    ・新しいプロセスでの読み込み時間（以前の app.py の読み込み方 と 今の読み込み方）
+    ・Streamlit の再実行1回あたりの時間（AppTest で app.py をそのまま動かす）
+    ・クライアントを作り直す場合と使い回す場合の、作る時間と張られる接続の数
+    """
+    from openai import OpenAI
+    from streamlit.testing.v1 import AppTest
+
+    eager = min(_import_seconds(EAGER_IMPORTS + APP_MODULES)[0] for _ in range(args.repeat))
+    runs = [_import_seconds(["streamlit"] + APP_MODULES) for _ in range(args.repeat)]
+    lazy = min(seconds for seconds, _ in runs)
+    loaded = runs[0][1]
+    print(f"cold import  eager={eager:.2f}s  lazy={lazy:.2f}s  ({eager / lazy:.1f}x)  heavy loaded={loaded}")
+
+    at = AppTest.from_file("app.py", default_timeout=60)
+    at.secrets["GEMINI_API_KEY"] = "dummy"
+    at.secrets["OPENAI_API_KEY"] = "dummy"
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    if at.exception:
+        sys.exit(f"app.py failed: {at.exception}")
+    samples = []
+    for _ in range(args.reruns):
+        start = time.perf_counter()
+        at.run()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    print(f"app.py run   first={first * 1000:.0f}ms  rerun p50={samples[len(samples) // 2] * 1000:.0f}ms  "
+          f"p90={samples[int(len(samples) * 0.9)] * 1000:.0f}ms  (n={args.reruns})")
+
+    # ボタンのたびにクライアントを作る（以前）と、プロセスで1つを使い回す（今）
+    import google.generativeai as genai
+    start = time.perf_counter()
+    for _ in range(args.reruns):
+        OpenAI(api_key="dummy")
+        genai.GenerativeModel(script_writer.GEMINI_MODEL)
+    per_click = (time.perf_counter() - start) / args.reruns
+    print(f"clients      build per click={per_click * 1000:.1f}ms  cached=0ms")
+
+    server = ConnectionCountingServer(silent_mp3())
+    for label, reuse in (("new client per job", False), ("cached client", True)):
+        server.connections = 0
+        shared = OpenAI(api_key="dummy", base_url=server.base_url, max_retries=0)
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            client = shared if reuse else OpenAI(api_key="dummy", base_url=server.base_url, max_retries=0)
+            audio_mixer.synthesize_line(client, "onyx", "こんにちは", 1.0)
+        elapsed = time.perf_counter() - start
+        print(f"  {label:20s} requests={args.requests}  connections={server.connections}  {elapsed:.2f}s")
+    server.server.shutdown()
+
+def bench_renditions(args):
+    """
+    保存する音声の形式ごとに、大きさ・配信量（egress）・アップロードの時間とメモリを、
+    以前の保存方法（MP3をまとめて作ってから upload_from_string で1回で送る）と比べる
+    """
+    from firebase_admin import firestore # 保存の中で初めて読み込まれてメモリの計測に混ざらないように
+    rng = np.random.default_rng(0)
+    pcm = b"".join(speech_like_pcm(rng, VOICE_LEVELS["onyx" if i % 2 else "nova"], 6.0)
+                   for i in range(int(args.minutes * 10)))
+    seconds = len(pcm) / (audio_mixer.FRAME_RATE * audio_mixer.SAMPLE_WIDTH)
+    print(f"program={seconds / 60:.1f}min  chunk={radio_store.UPLOAD_CHUNK_SIZE // 1024}KB "
+          f"chunk_latency={args.chunk_latency}s  fail_every={args.fail_every}  plays={args.plays}")
+
+    def measure(fn):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, elapsed, peak / 1e6
+
+    # 以前：MP3を全部メモリに作ってから1回で送る（失敗したら全部送り直し）
+    def legacy():
+        mp3 = audio_mixer.export_mp3(pcm)
+        FakeBucket(chunk_latency=args.chunk_latency).blob("audio/legacy.mp3").upload_from_string(mp3)
+        return len(mp3)
+    baseline, legacy_seconds, legacy_peak = measure(legacy)
+
+    def stream(names, bucket):
+        store = radio_store.FirebaseRadioStore(FakeFirestore(latency=0.0), bucket)
+        trace = tracing.Trace("renditions")
+        uploaded = store.save("program", lambda name, out: audio_mixer.encode_rendition_to(pcm, out, name),
+                              "https://example.go.jp/", "standard", "日本語", "テスト",
+                              trace=trace, renditions=names)
+        return uploaded, {span.attrs["rendition"]: span.duration
+                          for span in trace.spans if span.name == "storage_upload"}
+
+    # 今：エンコードしながら塊ずつ再開できるアップロードで送る（同じ MP3 だけで比べる）
+    bucket = FakeBucket(chunk_latency=args.chunk_latency, fail_every=args.fail_every)
+    (uploaded, _), stream_seconds, stream_peak = measure(lambda: stream(("mp3",), bucket))
+    print(f"  mp3 legacy     {legacy_seconds:6.2f}s  peak={legacy_peak:5.1f}MB  resend on failure={baseline / 1024:.0f}KB")
+    print(f"  mp3 streamed   {stream_seconds:6.2f}s  peak={stream_peak:5.1f}MB  "
+          f"resend on failure<={radio_store.UPLOAD_CHUNK_SIZE // 1024}KB  "
+          f"(retried_chunks={bucket.retried_chunks}, buffer<={bucket.peak_buffer // 1024}KB)")
+
+    # 形式ごとの大きさ・配信量（全部の形式を同時にエンコードして送る）
+    bucket = FakeBucket(chunk_latency=args.chunk_latency, fail_every=args.fail_every)
+    names = tuple(audio_mixer.RENDITIONS)
+    (uploaded, upload_seconds), total_seconds, peak = measure(lambda: stream(names, bucket))
+    print(f"  {'rendition':12s} {'size':>8s}  {'kbps':>5s}  {'vs mp3':>6s}  {'egress':>8s}  upload")
+    for name in names:
+        size = uploaded[name]["bytes"]
+        print(f"  {name:12s} {size / 1024:6.0f}KB  {size * 8 / seconds / 1000:5.1f}  {size / baseline * 100:5.1f}%  "
+              f"{size * args.plays / 1e9:6.2f}GB  {upload_seconds[name]:5.2f}s")
+    print(f"  all renditions {total_seconds:.2f}s  peak={peak:.1f}MB  "
+          f"storage={sum(u['bytes'] for u in uploaded.values()) / baseline:.2f}x of mp3 only")
+
+    # ブラウザごとの選び方（再生できるもののうち一番小さいもの）と、配信量の見積もり
+    agents = {
+        "iPhone Safari": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 "
+                         "Version/17.0 Mobile/15E148 Safari/604.1",
+        "Android Chrome": "Mozilla/5.0 (Linux; Android 14) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36",
+        "Firefox": "Mozilla/5.0 (Windows NT 10.0; rv:121.0) Gecko/20100101 Firefox/121.0",
+    }
+    for label, ua in agents.items():
+        name = audio_mixer.pick_rendition(uploaded, ua)
+        size = uploaded[name]["bytes"]
+        print(f"  {label:15s} -> {name:8s} egress/{args.plays}plays={size * args.plays / 1e9:.2f}GB "
+              f"(mp3 {baseline * args.plays / 1e9:.2f}GB)")
+
+# e2e の基準と比べる項目。回数と保存した大きさは決まった値になるので、1つでも違えば失敗
+E2E_COUNTERS = ("tts_calls", "gemini_calls", "stored_bytes")
+# 時間は同じプロセスで測った較正（_calibrate）の何回分かで比べる（大きいほど悪い）。誤差として許す量（割合, 絶対値）
+E2E_METRICS = {
+    "wall_x": (0.25, 0.5),
+    "ttfa_x": (0.25, 0.5),
+    "cpu_x": (0.30, 0.5),
+    "peak_rss_mb": (0.15, 20.0),
+}
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+def _calibrate(repeat=3):
+    """
+    この機械の今の速さを、決まった仕事（ffmpeg で20秒のPCMをMP3にする + Python の計算）で測る。
+    アプリのコードは使わないので、アプリが遅くなっても較正は変わらない。(経過秒, CPU秒) の一番速い回を返す
+    """
+    from pydub import AudioSegment
+    pcm = np.random.default_rng(0).integers(-3000, 3000, audio_mixer.FRAME_RATE * 20, dtype=np.int16).tobytes()
+    cmd = [AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-f", "s16le",
+           "-ar", str(audio_mixer.FRAME_RATE), "-ac", "1", "-i", "pipe:0", "-f", "mp3", "pipe:1"]
+    best = None
+    for _ in range(repeat):
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        subprocess.run(cmd, input=pcm, capture_output=True, check=True)
+        json.dumps([{"line": i, "text": f"これは{i}行目のセリフです。"} for i in range(100000)])
+        wall = time.perf_counter() - start
+        cpu = (_cpu_seconds(resource.getrusage(resource.RUSAGE_SELF), usage_before)
+               + _cpu_seconds(resource.getrusage(resource.RUSAGE_CHILDREN), children_before))
+        if best is None or wall < best[0]:
+            best = (wall, cpu)
+    return best
+
+def _cpu_seconds(usage, before):
+    return (usage.ru_utime - before.ru_utime) + (usage.ru_stime - before.ru_stime)
+
+def bench_e2e_one(args):
+    """
+    画面と同じ流れ（ジョブキュー → RadioPipeline.run_job → 先行再生のパート → 保存）を1通りだけ動かして、
+    結果をJSONで出力する（ピークRSSとCPUを分けるため、e2e から別プロセスで呼ばれる）
+    """
+    random.seed(0)
+    calib_wall, calib_cpu = _calibrate()
+    server = StubHTTPServer()
+    gemini = FakeGeminiModel(args.lines, line_latency=args.gemini_latency)
+    tts = FakeTTSClient(latency=args.latency)
+    firestore_client = FakeFirestore(latency=0.005)
+    bucket = FakeBucket()
+    radio_pipeline = pipeline.RadioPipeline(
+        fetcher=sources.SourceFetcher(page_cache=fetcher.SourceContentCache(tempfile.mkdtemp(prefix="source_cache_"))),
+        writer=script_writer.GeminiScriptWriter(gemini),
+        tts_client=tts,
+        store=radio_store.FirebaseRadioStore(firestore_client, bucket),
+        max_workers=args.workers,
+        post=audio_post.PostProcessor(),
+    )
+    queue = job_queue.JobQueue(max_concurrent=args.jobs)
+
+    def submit(i):
+        request = pipeline.RadioRequest(f"{server.url}/news/{i}", "standard", "日本語", allow_cache=True)
+        return queue.submit(f"program{i}", lambda job: radio_pipeline.run_job(request, job))[0]
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    jobs = [submit(i) for i in range(args.jobs)]
+    for job in jobs:
+        version = -1
+        while not job.finished:
+            version = job.wait(version)
+    wall = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    server.close()
+    if any(job.status != "done" for job in jobs):
+        sys.exit(f"failed: {[job.error for job in jobs if job.error]}")
+
+    stages = {}
+    for job in jobs:
+        for name, v in job.trace.summary().items():
+            entry = stages.setdefault(name, {"count": 0, "total": 0.0, "cpu": 0.0})
+            for field in entry:
+                entry[field] += v[field]
+    ttfa = max(job.parts[0][1] for job in jobs) # 一番待たされた人の、最初の音が届くまで
+    cpu = _cpu_seconds(usage, usage_before) + _cpu_seconds(children, children_before) # ffmpeg の子プロセスも含む
+    print(json.dumps({
+        "wall_s": wall,
+        "ttfa_s": ttfa,
+        "cpu_s": cpu,
+        "calib_wall_s": calib_wall,
+        "calib_cpu_s": calib_cpu,
+        "wall_x": wall / calib_wall,
+        "ttfa_x": ttfa / calib_wall,
+        "cpu_x": cpu / calib_cpu,
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "tts_calls": tts.calls,
+        "gemini_calls": gemini.calls,
+        "stored_bytes": sum(getattr(blob, "size", 0) for blob in bucket.blobs.values()), # 同じ音声は1つにまとまる
+        "stages": stages,
+    }))
+
+def _e2e_regressions(name, result, baseline):
+    """基準と回数が違う項目と、基準より遅く（大きく）なった項目の説明のリスト"""
+    problems = []
+    for counter in E2E_COUNTERS:
+        if counter in baseline and result[counter] != baseline[counter]:
+            problems.append(f"{name} {counter}: {result[counter]} != {baseline[counter]} (baseline)")
+    for metric, (ratio, slack) in E2E_METRICS.items():
+        if metric not in baseline:
+            continue
+        limit = baseline[metric] * (1 + ratio) + slack
+        if result[metric] > limit:
+            problems.append(f"{name} {metric}: {result[metric]:.3f} > {limit:.3f} (baseline {baseline[metric]:.3f})")
+    return problems
+
+def bench_e2e(args):
+    """
+    画面と同じ流れを、台本の長さ × 同時に作る番組の数 ごとに通しで動かす。
+    全体の時間・最初の音が届くまでの時間・ピークメモリ・CPU と、段階ごとの時間とCPUを出す。
+    保存した基準（--baseline）と比べ、TTS・Gemini の呼び出し回数や保存した大きさが違うか、
+    時間（較正の何回分か）・メモリが悪くなっていれば終了コード1で終わる
+    """
+    print(f"gemini={args.gemini_latency}s/line tts={args.latency}s/line workers={args.workers}")
+    results = {}
+    for lines in args.lines:
+        for jobs in args.jobs:
+            name = f"lines={lines},jobs={jobs}"
+            cmd = [sys.executable, __file__, "e2e-one", "--lines", str(lines), "--jobs", str(jobs),
+                   "--workers", str(args.workers), "--latency", str(args.latency),
+                   "--gemini-latency", str(args.gemini_latency)]
+            # 1回目はファイルキャッシュなどが温まっていないので、何回か走らせて一番速い回を使う
+            runs = []
+            for _ in range(args.repeat):
+                out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+                runs.append(json.loads(out.decode().strip().splitlines()[-1]))
+            r = min(runs, key=lambda run: run["wall_x"])
+            results[name] = r
+            print(f"  {name:18s} wall={r['wall_s']:6.2f}s ({r['wall_x']:5.2f}x)  ttfa={r['ttfa_s']:5.2f}s "
+                  f"({r['ttfa_x']:5.2f}x)  cpu={r['cpu_s']:5.2f}s ({r['cpu_x']:5.2f}x)  "
+                  f"peak_rss={r['peak_rss_mb']:6.1f}MB  tts_calls={r['tts_calls']}  "
+                  f"stored={r['stored_bytes'] / 1024:.0f}KB")
+            if args.stages:
+                for stage, v in sorted(r["stages"].items(), key=lambda kv: -kv[1]["total"]):
+                    print(f"      {stage:16s} n={v['count']:4d}  wall={v['total']:7.3f}s  cpu={v['cpu']:6.3f}s")
+    calib = min(results.values(), key=lambda r: r["calib_wall_s"])
+    print(f"  calibration      wall={calib['calib_wall_s']:.3f}s cpu={calib['calib_cpu_s']:.3f}s (1x)")
+
+    settings = {"workers": args.workers, "latency": args.latency, "gemini_latency": args.gemini_latency}
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"baseline saved: {args.baseline}")
+        return
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"no baseline ({args.baseline}); run with --save-baseline to create one")
+        return
+    if baseline["settings"] != settings:
+        print(f"baseline settings differ ({baseline['settings']}); not compared")
+        return
+    problems = []
+    for name, result in results.items():
+        if name in baseline["results"]:
+            problems += _e2e_regressions(name, result, baseline["results"][name])
+    for problem in problems:
+        print(f"  REGRESSION {problem}")
+    if problems:
+        sys.exit(1)
+    print(f"no regressions against {args.baseline}")
+
+def main():
+    parser = argparse.ArgumentParser(description="WebRadio オフラインベンチマーク")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("tts", help="TTS並列化の効果を測る")
+    p.add_argument("--lines", type=int, default=60)
+    p.add_argument("--latency", type=float, default=0.3)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    p.add_argument("--fail-every", type=int, default=7)
+    p.set_defaults(func=bench_tts)
+
+    p = sub.add_parser("stream", help="先行再生で最初の音声が出るまでの時間を測る")
+    p.add_argument("--lines", type=int, default=60)
+    p.add_argument("--latency", type=float, default=0.3)
+    p.add_argument("--workers", type=int, default=4)
+    p.set_defaults(func=bench_stream)
+
+    p = sub.add_parser("script", help="台本のストリーミング生成とTTSの重なりを測る")
+    p.add_argument("--lines", type=int, default=60)
+    p.add_argument("--gemini-latency", type=float, default=0.05)
+    p.add_argument("--latency", type=float, default=0.3)
+    p.add_argument("--workers", type=int, default=4)
+    p.set_defaults(func=bench_script)
+
+    p = sub.add_parser("pipeline", help="スタブのバックエンドでバッチ生成を通しで動かす")
+    p.add_argument("--sources", type=int, default=3)
+    p.add_argument("--lines", type=int, default=12)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--jobs", type=int, default=2)
+    p.set_defaults(func=bench_pipeline)
+
+    p = sub.add_parser("jobs", help="ジョブキューの相乗り（同じ番組は1回だけ生成）を確かめる")
+    p.add_argument("--users", type=int, default=20)
+    p.add_argument("--programs", type=int, default=3)
+    p.add_argument("--concurrent", type=int, default=job_queue.DEFAULT_MAX_CONCURRENT)
+    p.add_argument("--latency", type=float, default=0.1)
+    p.set_defaults(func=bench_jobs)
+
+    p = sub.add_parser("trace", help="ジョブごとの処理の内訳（Trace）とメトリクスの出力を確かめる")
+    p.add_argument("--programs", type=int, default=4)
+    p.add_argument("--lines", type=int, default=12)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--concurrent", type=int, default=2)
+    p.set_defaults(func=bench_trace)
+
+    p = sub.add_parser("post", help="番組の後処理（音量そろえ・フェード・BGM・リミッター）の速さを測る")
+    p.add_argument("--minutes", type=float, default=10)
+    p.set_defaults(func=bench_post)
+
+    p = sub.add_parser("index", help="保存済み番組の索引（キャッシュ確認・ライブラリ）を確かめる")
+    p.add_argument("--programs", type=int, default=2000)
+    p.add_argument("--lookups", type=int, default=200)
+    p.add_argument("--latency", type=float, default=0.02)
+    p.set_defaults(func=bench_index)
+
+    p = sub.add_parser("ephemeral", help="保存なしモードの一時置き場（署名URL・Range配信）を確かめる")
+    p.add_argument("--mb", type=int, default=5)
+    p.add_argument("--clients", type=int, default=8)
+    p.set_defaults(func=bench_ephemeral)
+
+    p = sub.add_parser("summarize", help="長い資料の要約（並列のmap-reduce・かたまりごとのキャッシュ）を確かめる")
+    p.add_argument("--pages", type=int, nargs="+", default=[50, 200])
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    p.add_argument("--latency", type=float, default=0.1)
+    p.set_defaults(func=bench_summarize)
+
+    p = sub.add_parser("startup", help="画面の起動・再実行の時間と、クライアントの使い回しを確かめる")
+    p.add_argument("--repeat", type=int, default=5, help="読み込み時間を測る回数（一番速いものを使う）")
+    p.add_argument("--reruns", type=int, default=20)
+    p.add_argument("--requests", type=int, default=20)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("renditions", help="保存する音声の形式ごとの大きさ・配信量・アップロードを以前の方法と比べる")
+    p.add_argument("--minutes", type=float, default=5)
+    p.add_argument("--plays", type=int, default=1000, help="配信量（egress）の見積もりに使う再生回数")
+    p.add_argument("--chunk-latency", type=float, default=0.05, help="アップロードの塊1つを送るのにかかる秒数")
+    p.add_argument("--fail-every", type=int, default=7, help="この回数に1回、塊の送信を失敗させる（0なら失敗なし）")
+    p.set_defaults(func=bench_renditions)
+
+    p = sub.add_parser("e2e", help="画面と同じ流れを通しで計測し、保存した基準と比べる")
+    p.add_argument("--lines", type=int, nargs="+", default=[10, 40, 120])
+    p.add_argument("--jobs", type=int, nargs="+", default=[1, 4], help="同時に作る番組の数")
+    p.add_argument("--workers", type=int, default=audio_mixer.DEFAULT_MAX_WORKERS)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--gemini-latency", type=float, default=0.01)
+    p.add_argument("--repeat", type=int, default=2)
+    p.add_argument("--stages", action="store_true", help="段階ごとの時間とCPUも出す")
+    p.add_argument("--baseline", default=DEFAULT_BASELINE)
+    p.add_argument("--save-baseline", action="store_true")
+    p.set_defaults(func=bench_e2e)
+
+    p = sub.add_parser("e2e-one", help=argparse.SUPPRESS)
+    p.add_argument("--lines", type=int, required=True)
+    p.add_argument("--jobs", type=int, required=True)
+    p.add_argument("--workers", type=int, required=True)
+    p.add_argument("--latency", type=float, required=True)
+    p.add_argument("--gemini-latency", type=float, required=True)
+    p.set_defaults(func=bench_e2e_one)
+
+    p = sub.add_parser("render", help="2本の番組を同時に作っても出力が混ざらないことを確かめる")
+    p.add_argument("--lines", type=int, default=5)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--workers", type=int, default=4)
+    p.set_defaults(func=bench_render)
+
+    p = sub.add_parser("pdf", help="PDFの読み込み（以前の方法・途中で打ち切り・並列）を比べる")
+    p.add_argument("--pages", type=int, default=300)
+    p.add_argument("--workers", type=int, default=pdf_ingest.DEFAULT_MAX_WORKERS)
+    p.set_defaults(func=bench_pdf)
+
+    p = sub.add_parser("fetch", help="記事取得のキャッシュ（hit / 304 / miss）と接続の使い回しを確かめる")
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--max-kb", type=int, default=256)
+    p.set_defaults(func=bench_fetch)
+
+    p = sub.add_parser("mix", help="結合エンジン（+= とPcmBuffer）の時間とピークRSSを比べる")
+    p.add_argument("--lines", type=int, nargs="+", default=[10, 100, 1000])
+    p.add_argument("--line-ms", type=int, default=3000)
+    p.add_argument("--decode", action="store_true", help="毎行MP3のデコードも含めて測る")
+    p.set_defaults(func=bench_mix)
+
+    p = sub.add_parser("mix-one", help=argparse.SUPPRESS)
+    p.add_argument("--engine", choices=["legacy", "pcm"], required=True)
+    p.add_argument("--lines", type=int, required=True)
+    p.add_argument("--line-ms", type=int, default=3000)
+    p.add_argument("--decode", action="store_true")
+    p.set_defaults(func=bench_mix_one)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
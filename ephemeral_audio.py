@@ -0,0 +1,202 @@
+import hashlib
+import hmac
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# 保存なしモードの番組音声の一時置き場
+# ・サーバープロセスのメモリだけに置き、Firebase Storage には上げない
+# ・ブラウザには期限つきの署名URLを渡す（HTMLにbase64で埋め込まない）
+# ・HTTP の Range に対応する（iPhone の Safari は Range で少しずつ取りに来る。シークもできる）
+# ・ttl を過ぎたものと、合計が max_bytes を超えたときの古いものから消す
+
+DEFAULT_TTL = 30 * 60 # 置いておく時間（秒）。署名URLの期限も同じ
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024 # 全セッション合計の上限
+DEFAULT_MAX_PER_SESSION = 3 # 1セッションが置ける番組の数（それ以上は古いものから消す）
+STREAM_CHUNK = 64 * 1024
+
+class EphemeralAudioStore:
+    """
+    番組音声（バイト列）をメモリに置いて、署名つきのパスで取り出せるようにする。
+    入れたバイト列はコピーせずにそのまま持つ
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL,
+                 max_per_session=DEFAULT_MAX_PER_SESSION, secret=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_per_session = max_per_session
+        self.secret = secret.encode() if isinstance(secret, str) else (secret or os.urandom(32))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> entry（古い順）
+        self._total_bytes = 0
+        self.evicted = 0
+
+    def put(self, session_id, data, content_type="audio/mpeg", key=None):
+        """
+        data を置いてキーを返す。同じ key がまだ残っていれば置き直さない。
+        session_id が None のもの（先行再生のパートなど、誰か1人のものではない音声）はセッションの本数に数えない。
+        1本で max_bytes を超えるものは置けない（ValueError）
+        """
+        if len(data) > self.max_bytes:
+            raise ValueError(f"audio too large for the ephemeral store: {len(data)} bytes")
+        key = key or uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            if key in self._entries:
+                return key
+            self._entries[key] = {
+                "data": data, "size": len(data), "session": session_id,
+                "content_type": content_type, "expires_at": math.ceil(time.time() + self.ttl),
+            }
+            self._total_bytes += len(data)
+            # セッションごとの本数の上限
+            if session_id is not None:
+                own = [k for k, e in self._entries.items() if e["session"] == session_id]
+                for old in own[:-self.max_per_session]:
+                    self._remove(old)
+            # 全体の上限（古いものから）
+            while self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return key
+
+    def get(self, key):
+        with self._lock:
+            self._expire()
+            return self._entries.get(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry["size"]
+        self.evicted += 1
+
+    def _expire(self):
+        """期限切れを消す（_lock を持った状態で呼ぶ）"""
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if e["expires_at"] <= now]:
+            self._remove(key)
+
+    def _sign(self, key, expires_at):
+        return hmac.new(self.secret, f"{key}:{expires_at}".encode(), hashlib.sha256).hexdigest()
+
+    def signed_path(self, key):
+        """署名つきのパス（期限は置いたときに決まるので、再実行しても同じURLになる）"""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        expires_at = entry["expires_at"]
+        return f"/audio/{key}?exp={expires_at}&sig={self._sign(key, expires_at)}"
+
+    def verify(self, key, expires_at, sig):
+        try:
+            expires_at = int(expires_at)
+        except (TypeError, ValueError):
+            return False
+        if expires_at <= time.time():
+            return False
+        return hmac.compare_digest(self._sign(key, expires_at), sig or "")
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total_bytes, "evicted": self.evicted}
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+def parse_range(header, size):
+    """
+    Range ヘッダーから (start, end)（end を含む）を返す。ヘッダーが無い・読めないときは None（全体を返す）。
+    範囲が本文の外なら ValueError（416 を返す）
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None # 複数範囲などは対応しない（全体を返してよいことになっている）
+    first, last = match.groups()
+    if first == "":
+        # bytes=-500 は最後の500バイト
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+def serve(store, port, host="0.0.0.0"):
+    """store の音声を /audio/<key>?exp=..&sig=.. で返す HTTP サーバーを裏のスレッドで立てる"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # 同じ接続で Range を何回も取りに来る
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _error(self, status):
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+
+        def _handle(self, with_body):
+            url = urlsplit(self.path)
+            match = re.fullmatch(r"/audio/([0-9a-zA-Z:_-]+)", url.path)
+            if not match:
+                return self._error(404)
+            key = match.group(1)
+            query = parse_qs(url.query)
+            if not store.verify(key, query.get("exp", [None])[0], query.get("sig", [None])[0]):
+                return self._error(403)
+            entry = store.get(key)
+            if entry is None:
+                return self._error(404) # 期限切れか、上限で消えた
+
+            size = entry["size"]
+            try:
+                byte_range = parse_range(self.headers.get("Range"), size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start, end = byte_range if byte_range else (0, size - 1)
+
+            self.send_response(206 if byte_range else 200)
+            self.send_header("Content-Type", entry["content_type"])
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start + 1))
+            if byte_range:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header("Cache-Control", "private, no-store")
+            self.end_headers()
+            if not with_body:
+                return
+            with memoryview(entry["data"]) as view:
+                for offset in range(start, end + 1, STREAM_CHUNK):
+                    self.wfile.write(view[offset:min(offset + STREAM_CHUNK, end + 1)])
+
+        def do_GET(self):
+            try:
+                self._handle(with_body=True)
+            except (BrokenPipeError, ConnectionResetError):
+                pass # 再生をやめた・シークしたブラウザが接続を切っただけ
+
+        def do_HEAD(self):
+            try:
+                self._handle(with_body=False)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="ephemeral-audio").start()
+    return server
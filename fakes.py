@@ -0,0 +1,573 @@
+"""
+外部APIの代わりに使うフェイクとスタブ（benchmark.py の計測と tests/ のテストで共通に使う）
+
+ネットワークや課金のあるサービス（OpenAI / Gemini / Firestore / Storage / 記事のサイト）を呼ばずに、
+決まった遅さと中身で応答する。MP3やPCMを作るものは ffmpeg が必要
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+import numpy as np
+
+import audio_mixer
+import audio_post
+import radio_store
+import tracing
+
+# ---------------------------
+# フェイクのTTSクライアント
+# ---------------------------
+_SILENT_MP3 = None
+
+def silent_mp3(duration_ms=1000):
+    """本物のMP3バイト列（無音）を作る（ffmpegが必要）"""
+    global _SILENT_MP3
+    if _SILENT_MP3 is None:
+        from pydub import AudioSegment
+        buf = BytesIO()
+        AudioSegment.silent(duration=duration_ms, frame_rate=24000).export(buf, format="mp3")
+        _SILENT_MP3 = buf.getvalue()
+    return _SILENT_MP3
+
+class _FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+class _FakeSpeech:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model, voice, input, speed=1.0, **kwargs):
+        return self.owner._create(model, voice, input, speed)
+
+class _FakeAudio:
+    def __init__(self, owner):
+        self.speech = _FakeSpeech(owner)
+
+class RateLimitError(Exception):
+    """openai.RateLimitError の代わり（名前と status_code で見分けられる）"""
+    status_code = 429
+
+class FakeTTSClient:
+    """
+    OpenAIクライアントの client.audio.speech.create だけを真似るフェイク。
+    1リクエストごとに latency 秒待ってから、固定のMP3バイト列を返す。
+    fail_every を渡すと、その回数に1回は 429（RateLimitError）を返す（fail_every=1 ならいつも）
+    """
+
+    def __init__(self, latency=0.3, content=None, fail_every=None):
+        self.latency = latency
+        self.content = content if content is not None else silent_mp3()
+        self.fail_every = fail_every
+        self.audio = _FakeAudio(self)
+        self.calls = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _create(self, model, voice, text, speed):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            fail = self.fail_every is not None and self.calls % self.fail_every == 0
+            if fail:
+                self.rate_limited += 1
+        try:
+            time.sleep(self.latency)
+            if fail:
+                raise RateLimitError("Rate limit reached for requests")
+            return _FakeResponse(self.content)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+class _FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeGeminiModel:
+    """
+    genai.GenerativeModel の generate_content だけを真似るフェイク。
+    「A: 〜」「B: 〜」形式の台本を n_lines 行、1行あたり line_latency 秒かけて書く。
+    stream=True のときは数文字ずつの断片で返す
+    """
+
+    def __init__(self, n_lines=60, line_latency=0.05, chunk_chars=7):
+        self.n_lines = n_lines
+        self.line_latency = line_latency
+        self.chunk_chars = chunk_chars
+        self.calls = 0
+
+    def _lines(self):
+        for i in range(self.n_lines):
+            speaker = "AB"[i % 2]
+            yield f"{speaker}: これは{i + 1}行目のセリフです。\n"
+
+    def _stream(self):
+        for line in self._lines():
+            time.sleep(self.line_latency)
+            for i in range(0, len(line), self.chunk_chars):
+                yield _FakeChunk(line[i:i + self.chunk_chars])
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        if stream:
+            return self._stream()
+        return _FakeChunk("".join(chunk.text for chunk in self._stream()))
+
+class FakeSummaryModel:
+    """
+    要約用の generate_content（stream なし）だけを真似るフェイク。
+    1回ごとに latency 秒待って、プロンプトの中身から決まる summary_chars 文字の要約を返す
+    """
+
+    def __init__(self, latency=0.1, summary_chars=300):
+        self.latency = latency
+        self.summary_chars = summary_chars
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            digest = hashlib.sha256(prompt.encode()).hexdigest()
+            return _FakeChunk((f"要約{digest[:8]}。" * self.summary_chars)[:self.summary_chars])
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+class StubFetcher:
+    """資料取得のスタブ（ネットワークに出ず、決まった文章を返す。version を変えると本文が変わる）"""
+
+    def __init__(self):
+        self.version = 1
+
+    def fetch(self, request):
+        return f"【Web記事：{request.source}】\nダミーの本文です（版{self.version}）。", request.source
+
+class InMemoryRadioStore:
+    """番組の保存先のスタブ（Firestore + Storage の代わりに辞書に入れる）"""
+
+    def __init__(self):
+        self.docs = {}
+        self.blobs = {}
+        self.scripts = {}
+
+    def get(self, cache_key, trace=None):
+        with tracing.span(trace, "firestore_read", collection='radios'):
+            return self.docs.get(cache_key)
+
+    def find(self, script_key, mix_key, trace=None):
+        return None # 索引は持たないので、いつも台本を読んで audio_key で確かめる
+
+    def get_script(self, script_key, trace=None):
+        with tracing.span(trace, "firestore_read", collection='scripts'):
+            return self.scripts.get(script_key)
+
+    def save_script(self, script_key, script_text, text_hash, style, lang, trace=None):
+        with tracing.span(trace, "firestore_write", collection='scripts'):
+            self.scripts[script_key] = {'script_text': script_text, 'text_hash': text_hash,
+                                        'style': style, 'language': lang}
+
+    def save(self, cache_key, audio_data, source_info, style, lang, title, extra=None, trace=None,
+             renditions=audio_mixer.DEFAULT_RENDITIONS):
+        uploaded = {}
+        for name in dict.fromkeys(("mp3",) + tuple(renditions)):
+            with tracing.span(trace, "storage_upload", rendition=name) as span:
+                if callable(audio_data):
+                    buffer = BytesIO()
+                    audio_data(name, buffer)
+                    data = buffer.getvalue()
+                elif hasattr(audio_data, "read"):
+                    audio_data.seek(0)
+                    data = audio_data.read()
+                else:
+                    data = audio_data
+                spec = audio_mixer.RENDITIONS[name]
+                self.blobs[f"{cache_key}.{spec['ext']}"] = data
+                span.set(bytes=len(data))
+            uploaded[name] = {'url': f"memory://audio/{cache_key}.{spec['ext']}", 'bytes': len(data),
+                              'content_type': spec["content_type"]}
+            if not callable(audio_data):
+                break # MP3 を渡されたときは MP3 だけ
+        with tracing.span(trace, "firestore_write", collection='radios'):
+            self.docs[cache_key] = {
+                'source': source_info, 'style': style, 'language': lang, 'title': title,
+                'audio_url': uploaded["mp3"]["url"], 'renditions': uploaded, **(extra or {}),
+            }
+        return uploaded
+
+class _FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+class _FakeChangeType:
+    def __init__(self, name):
+        self.name = name
+
+class _FakeChange:
+    def __init__(self, type_name, snapshot):
+        self.type = _FakeChangeType(type_name)
+        self.document = snapshot
+
+class _FakeDocument:
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self):
+        return self.collection._read(self.id)
+
+    def set(self, data):
+        self.collection._write(self.id, data)
+
+class _FakeCollection:
+    def __init__(self, owner):
+        self.owner = owner
+        self.docs = {}
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def document(self, doc_id):
+        return _FakeDocument(self, doc_id)
+
+    def _read(self, doc_id):
+        time.sleep(self.owner.latency)
+        with self._lock:
+            self.owner.reads += 1
+            return _FakeSnapshot(doc_id, self.docs.get(doc_id))
+
+    def _write(self, doc_id, data):
+        from firebase_admin import firestore
+        data = {k: (datetime.now(timezone.utc) if v is firestore.SERVER_TIMESTAMP else v)
+                for k, v in data.items()}
+        with self._lock:
+            kind = "MODIFIED" if doc_id in self.docs else "ADDED"
+            self.docs[doc_id] = data
+            listeners = list(self.listeners)
+        for callback in listeners:
+            # 本物と同じく、通知は別スレッドで少し遅れて届く
+            threading.Timer(self.owner.latency, callback,
+                            ([], [_FakeChange(kind, _FakeSnapshot(doc_id, data))], None)).start()
+
+    def stream(self):
+        time.sleep(self.owner.latency)
+        with self._lock:
+            self.owner.reads += 1
+            return [_FakeSnapshot(k, v) for k, v in self.docs.items()]
+
+    def on_snapshot(self, callback):
+        with self._lock:
+            self.owner.reads += 1
+            snapshot = [_FakeChange("ADDED", _FakeSnapshot(k, v)) for k, v in self.docs.items()]
+            self.listeners.append(callback)
+        threading.Timer(self.owner.latency, callback, ([], snapshot, None)).start()
+        owner = self
+
+        class Watch:
+            def unsubscribe(self):
+                with owner._lock:
+                    owner.listeners.remove(callback)
+        return Watch()
+
+class FakeFirestore:
+    """Firestore クライアントのスタブ（collection / document / get / set / stream / on_snapshot だけ）。読み込み回数を数える"""
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.reads = 0
+        self._collections = {}
+
+    def collection(self, name):
+        return self._collections.setdefault(name, _FakeCollection(self))
+
+class _FakeBlobWriter:
+    """
+    blob.open("wb") のスタブ。本物と同じく chunk_size ずつ溜めてから送る（再開できるアップロード）。
+    送るたびに bucket.chunk_latency 秒待ち、bucket.fail_every 回に1回は1度失敗してその塊だけ送り直す
+    """
+
+    def __init__(self, blob, chunk_size):
+        self.blob = blob
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.peak_buffer = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.peak_buffer = max(self.peak_buffer, len(self.buffer))
+        while len(self.buffer) >= self.chunk_size:
+            self._send(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def _send(self, chunk):
+        bucket = self.blob.bucket
+        for attempt in range(2):
+            time.sleep(bucket.chunk_latency)
+            with bucket.lock:
+                bucket.chunks_sent += 1
+                failed = attempt == 0 and bucket.fail_every and bucket.chunks_sent % bucket.fail_every == 0
+                if failed:
+                    bucket.retried_chunks += 1
+                else:
+                    bucket.sent_bytes += len(chunk)
+            if not failed:
+                break
+        self.blob.size += len(chunk)
+
+    def close(self):
+        if self.buffer:
+            self._send(bytes(self.buffer))
+            self.buffer.clear()
+        self.blob.bucket.peak_buffer = max(self.blob.bucket.peak_buffer, self.peak_buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class _FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.public_url = f"memory://{name}"
+        self.size = 0
+
+    def upload_from_string(self, data, content_type=None):
+        # 1回で送る（送る時間は塊に分けた場合と同じだけかける。失敗したら最初から送り直しになる）
+        time.sleep(self.bucket.chunk_latency * -(-len(data) // radio_store.UPLOAD_CHUNK_SIZE))
+        self.size = len(data)
+        self.bucket.sent_bytes += len(data)
+
+    def upload_from_file(self, file_obj, content_type=None, rewind=False):
+        if rewind:
+            file_obj.seek(0)
+        self.upload_from_string(file_obj.read(), content_type)
+
+    def open(self, mode="wb", chunk_size=None, content_type=None, **kwargs):
+        self.size = 0
+        return _FakeBlobWriter(self, chunk_size or radio_store.UPLOAD_CHUNK_SIZE)
+
+    def make_public(self):
+        pass
+
+class FakeBucket:
+    """Storage のバケットのスタブ（上げたバイト数だけ覚える）"""
+
+    def __init__(self, chunk_latency=0.0, fail_every=0):
+        self.blobs = {}
+        self.chunk_latency = chunk_latency
+        self.fail_every = fail_every
+        self.lock = threading.Lock()
+        self.chunks_sent = 0
+        self.retried_chunks = 0
+        self.sent_bytes = 0
+        self.peak_buffer = 0
+
+    def blob(self, name):
+        with self.lock:
+            return self.blobs.setdefault(name, _FakeBlob(self, name))
+
+def make_script(n_lines, voices=("onyx", "nova")):
+    """n_lines 行のダミー台本を作る"""
+    return [
+        {"voice": voices[i % len(voices)], "text": f"これは{i + 1}行目のセリフです。"}
+        for i in range(n_lines)
+    ]
+
+def tone_mp3(freq, duration_ms=1000):
+    """決まった高さの音のMP3バイト列を作る（どの番組の音か聞き分けるため。ffmpegが必要）"""
+    from pydub.generators import Sine
+    buf = BytesIO()
+    Sine(freq, sample_rate=audio_mixer.FRAME_RATE).to_audio_segment(duration=duration_ms).export(buf, format="mp3")
+    return buf.getvalue()
+
+def dominant_freq(pcm):
+    """PCMのゼロ交差の数から、いちばん強い音の高さ（Hz）をざっくり求める（無音部分の細かい揺れは数えない）"""
+    import array
+    samples = array.array("h", pcm)
+    crossings = sum(1 for a, b in zip(samples, samples[1:])
+                    if (a < 0) != (b < 0) and abs(a - b) > 1000)
+    return crossings / 2 / (len(samples) / audio_mixer.FRAME_RATE)
+
+def make_pdf(n_pages, lines_per_page=40):
+    """テキストだけのPDFを手で組み立てる（n_pages ページ、1ページ lines_per_page 行）"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None, # ページ一覧（あとで埋める）
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for page in range(n_pages):
+        lines = [f"({'Page %d line %d: public notice text for the radio program.' % (page + 1, i + 1)}) Tj 0 -14 Td"
+                 for i in range(lines_per_page)]
+        stream = ("BT /F1 10 Tf 40 800 Td " + " ".join(lines) + " ET").encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % n_pages
+
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % i + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+class StubHTTPServer:
+    """
+    記事を返すローカルのHTTPサーバー（スレッドで動かす）。
+    /article は ETag / Last-Modified 付きで、変わっていなければ 304 を返す。
+    /sjis は Shift_JIS（metaタグにだけ文字コードがある）、/big は大きいページ、
+    /news/<番号> は番号ごとに本文の違う記事
+    """
+
+    def __init__(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        owner = self
+        self.version = 1
+        self.requests = 0
+        self.not_modified = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # 接続の使い回しができるように
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", headers=()):
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                owner.requests += 1
+                if self.path == "/article":
+                    etag = f'"v{owner.version}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        owner.not_modified += 1
+                        return self._send(304, headers=[("ETag", etag)])
+                    body = (f"<html><head><title>お知らせ v{owner.version}</title></head>"
+                            f"<body><p>公的機関のお知らせ本文です（版{owner.version}）。</p></body></html>").encode()
+                    return self._send(200, body, [("Content-Type", "text/html; charset=utf-8"), ("ETag", etag),
+                                                  ("Last-Modified", "Mon, 01 Jan 2024 00:00:00 GMT")])
+                if self.path == "/sjis":
+                    body = ('<html><head><meta charset="Shift_JIS"><title>市報</title></head>'
+                            '<body><p>岡山市からのお知らせです。</p></body></html>').encode("shift_jis")
+                    return self._send(200, body, [("Content-Type", "text/html")])
+                if self.path.startswith("/news/"):
+                    number = self.path[len("/news/"):]
+                    paragraphs = "".join(f"<p>{number}番目のお知らせの{i + 1}段落目です。</p>" for i in range(20))
+                    body = f"<html><head><title>お知らせ{number}</title></head><body>{paragraphs}</body></html>"
+                    return self._send(200, body.encode(), [("Content-Type", "text/html; charset=utf-8")])
+                if self.path == "/big":
+                    body = b"<html><body>" + (b"<p>" + b"x" * 1000 + b"</p>") * 3000 + b"</body></html>"
+                    return self._send(200, body, [("Content-Type", "text/html; charset=utf-8")])
+                return self._send(404)
+
+        class Server(ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                pass # 途中で読むのをやめた接続の切断は想定どおり
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+# 声ごとの大きさの違い（dBFS。OpenAIの声も onyx / nova / fable で聞いてわかるほど違う）
+VOICE_LEVELS = {"onyx": -30.0, "nova": -17.0, "fable": -23.0}
+
+def speech_like_pcm(rng, level_db, seconds):
+    """声に似たPCM（100〜300Hzの音を1秒に4回ほど強弱させ、ノイズを混ぜる）。ときどき大きな破裂音を入れる"""
+    n = int(audio_mixer.FRAME_RATE * seconds)
+    t = np.arange(n) / audio_mixer.FRAME_RATE
+    pitch = rng.uniform(100, 300)
+    syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t), 0, None) ** 2
+    x = (np.sin(2 * np.pi * pitch * t) + 0.3 * rng.standard_normal(n)) * syllables
+    x *= 10 ** (level_db / 20) * 32768 / max(np.sqrt(np.mean(x ** 2)), 1e-9)
+    burst = rng.integers(0, n - 240)
+    x[burst:burst + 240] *= 6 # 「パ」のような一瞬のピーク
+    return np.clip(x, -32768, 32767).astype(np.int16).tobytes()
+
+def voice_spread(program, lines):
+    """声ごとの平均の大きさ（dB）の最大と最小の差"""
+    data = np.frombuffer(program.slice(), dtype=np.int16).astype(np.float32)
+    levels = {}
+    for voice, start, end in lines:
+        loudness = audio_post.measure_loudness(data[start // 2:end // 2])
+        levels.setdefault(voice, []).append(loudness)
+    means = [np.mean(v) for v in levels.values()]
+    return max(means) - min(means)
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+class ConnectionCountingServer:
+    """OpenAI の音声合成APIのふりをする HTTP サーバー（張られたTCP接続の数を数える）"""
+
+    def __init__(self, content):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        owner = self
+        self.connections = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with owner._lock:
+                    owner.connections += 1
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/mpeg")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
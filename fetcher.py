@@ -0,0 +1,265 @@
+import codecs
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import requests
+from requests.adapters import HTTPAdapter
+
+# Web記事の取得
+# ・HTTPセッションを使い回す（接続プール）
+# ・取得した本文はURLごとにキャッシュし、ETag / Last-Modified で条件付きGETして変わっていなければ使い回す
+#   （キャッシュの合計が上限を超えたら古いものから消す）
+# ・大きすぎるページは max_bytes で打ち切る
+# ・文字コードはヘッダー → metaタグ → 先頭だけの推定 の順に決める（全体を推定しない）
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 # 2MBを超える部分は読まない
+DEFAULT_MAX_AGE = 10 * 60 # この秒数以内に取ったページはサーバーに問い合わせずに使う
+DEFAULT_CACHE_DIR = ".source_cache"
+DEFAULT_CACHE_MAX_BYTES = 200 * 1024 * 1024 # キャッシュが200MBを超えたら古いものから消す
+POOL_SIZE = 16
+SNIFF_BYTES = 64 * 1024 # 文字コード推定に使う先頭の大きさ
+USER_AGENT = "WebRadioMaker/1.0"
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """プロセスで1つだけのHTTPセッション（接続を使い回す）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+            _session = session
+        return _session
+
+def normalize_url(url):
+    """キャッシュ用にURLをそろえる（ホストの大文字小文字・#以降・utm_系パラメータ・クエリの順番）"""
+    parts = urlsplit(url.strip())
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.startswith("utm_"))
+    path = parts.path or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), ""))
+
+_CHARSET_HEADER = re.compile(r'charset=["\']?([\w.:-]+)', re.I)
+_CHARSET_META = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.I)
+
+def _valid_encoding(name):
+    try:
+        return codecs.lookup(name).name
+    except (LookupError, TypeError):
+        return None
+
+def detect_encoding(content_type, body):
+    """
+    本文の文字コードを決める。
+    Content-Type の charset → 先頭のmetaタグ → BOM → 先頭 SNIFF_BYTES だけで推定 の順
+    """
+    match = _CHARSET_HEADER.search(content_type or "")
+    if match and _valid_encoding(match.group(1)):
+        return _valid_encoding(match.group(1))
+
+    match = _CHARSET_META.search(body[:4096])
+    if match and _valid_encoding(match.group(1).decode("ascii", "ignore")):
+        return _valid_encoding(match.group(1).decode("ascii"))
+
+    if body.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+
+    sample = body[:SNIFF_BYTES]
+    try:
+        sample.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        if e.start >= len(sample) - 3:
+            return "utf-8" # 先頭で切ったせいで最後の文字が欠けただけ
+    try:
+        from charset_normalizer import from_bytes
+        best = from_bytes(sample).best()
+        return best.encoding if best else "utf-8"
+    except ImportError:
+        import chardet
+        return chardet.detect(sample)["encoding"] or "utf-8"
+
+class SourceContentCache:
+    """
+    取得したページ本文のディスクキャッシュ（正規化したURLがキー）。
+    本文と一緒に ETag / Last-Modified / 文字コード / 取得時刻を覚えておく。
+    合計サイズ（本文 + メタ情報）が max_bytes を超えると古い順（LRU）に消す
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> サイズ（古い順）
+        self._total_bytes = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _key(self, url):
+        return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return f"{base}.json", f"{base}.body"
+
+    def _load_index(self):
+        """起動時にディスク上のファイルを更新日時順に読み込む"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".body"):
+                continue
+            key = name[:-5]
+            try:
+                sizes = [os.stat(path) for path in self._paths(key)]
+            except OSError:
+                continue
+            files.append((sizes[1].st_mtime, key, sizes[0].st_size + sizes[1].st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _record(self, key, size):
+        """key の大きさを覚え直して、上限を超えていれば古いものを消す"""
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def get(self, url):
+        """(メタ情報, 本文) を返す。無ければ None"""
+        key = self._key(url)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+            os.utime(body_path) # 再起動後もLRUの順番が保たれるように
+        except (OSError, ValueError):
+            return None
+        return meta, body
+
+    def put(self, url, meta, body):
+        key = self._key(url)
+        meta_path, body_path = self._paths(key)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        try:
+            with open(body_path + suffix, "wb") as f:
+                f.write(body)
+            with open(meta_path + suffix, "wb") as f:
+                f.write(meta_bytes)
+            os.replace(body_path + suffix, body_path)
+            os.replace(meta_path + suffix, meta_path)
+        except OSError as e:
+            print(f"Source cache write error: {e}")
+            return
+        self._record(key, len(meta_bytes) + len(body))
+
+    def touch(self, url, meta):
+        """304 で変わっていなかったときに、取得時刻だけ更新する"""
+        key = self._key(url)
+        meta_path, body_path = self._paths(key)
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        try:
+            with open(meta_path, "wb") as f:
+                f.write(meta_bytes)
+            body_size = os.path.getsize(body_path)
+        except OSError as e:
+            print(f"Source cache write error: {e}")
+            return
+        self._record(key, len(meta_bytes) + body_size)
+
+    def count(self, status):
+        with self._lock:
+            setattr(self, status, getattr(self, status) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses,
+                    "entries": len(self._entries), "bytes": self._total_bytes}
+
+def _read_bounded(res, max_bytes):
+    """レスポンス本文を max_bytes まで読む（それ以上は捨てる）"""
+    chunks = []
+    total = 0
+    for chunk in res.iter_content(chunk_size=64 * 1024):
+        chunks.append(chunk)
+        total += len(chunk)
+        if total >= max_bytes:
+            print(f"Response truncated at {max_bytes} bytes: {res.url}")
+            break
+    return b"".join(chunks)[:max_bytes]
+
+def fetch_url(url, cache=None, max_age=DEFAULT_MAX_AGE, max_bytes=DEFAULT_MAX_BYTES,
+              timeout=DEFAULT_TIMEOUT):
+    """
+    URLの本文を取ってきて dict（text, encoding, status）で返す。
+    status は hit（max_age 以内なので問い合わせなし）/ revalidated（304で使い回し）/ miss（新しく取得）
+    """
+    cached = cache.get(url) if cache is not None else None
+    headers = {}
+    if cached is not None:
+        meta, body = cached
+        if time.time() - meta["fetched_at"] < max_age:
+            cache.count("hits")
+            return {"text": body.decode(meta["encoding"], errors="replace"),
+                    "encoding": meta["encoding"], "status": "hit"}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with get_session().get(url, headers=headers, timeout=timeout, stream=True) as res:
+        if res.status_code == 304 and cached is not None:
+            meta["fetched_at"] = time.time()
+            cache.touch(url, meta)
+            cache.count("revalidated")
+            return {"text": body.decode(meta["encoding"], errors="replace"),
+                    "encoding": meta["encoding"], "status": "revalidated"}
+        res.raise_for_status()
+        body = _read_bounded(res, max_bytes)
+        encoding = detect_encoding(res.headers.get("Content-Type"), body)
+        meta = {
+            "url": normalize_url(url),
+            "etag": res.headers.get("ETag"),
+            "last_modified": res.headers.get("Last-Modified"),
+            "encoding": encoding,
+            "fetched_at": time.time(),
+        }
+
+    if cache is not None:
+        cache.put(url, meta, body)
+        cache.count("misses")
+    return {"text": body.decode(encoding, errors="replace"), "encoding": encoding, "status": "miss"}
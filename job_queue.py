@@ -0,0 +1,135 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+
+# 番組生成のジョブキュー
+# ・同じキー（cache_key）のジョブが動いている間は、新しく作らずにそのジョブに相乗りする
+# ・同時に動かすジョブの数を制限する（OpenAIのレート制限を使い切らないように）
+# ・ジョブはサーバープロセスに残るので、Streamlitの再実行（rerun）をまたいで追いかけられる
+# ・ジョブごとに Trace を持ち、順番待ちの時間と fn の中の各段階を記録する（デバッグ画面用）
+
+DEFAULT_MAX_CONCURRENT = 2
+DEFAULT_KEEP_SECONDS = 15 * 60 # 終わったジョブを残しておく時間
+
+class Job:
+    """1本の番組生成。進み具合はどのスレッドからでも読める"""
+
+    def __init__(self, key):
+        self.key = key
+        self.status = "queued" # queued / running / done / error
+        self.stage = None # pipeline の on_progress で届く段階（fetch / record / save）
+        self.parts = [] # 先行再生用のパート（MP3バイト列, 開始からの秒数）
+        self.trace = tracing.Trace(key) # fn の中では pipeline.run(..., trace=job.trace) に渡す
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.subscribers = 1 # このジョブを見ている人数（相乗りで増える）
+        self.version = 0
+        self._cond = threading.Condition()
+
+    def _changed(self, **fields):
+        with self._cond:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._cond.notify_all()
+
+    def set_stage(self, stage):
+        self._changed(stage=stage)
+
+    def add_part(self, part_mp3):
+        with self._cond:
+            self.parts.append((part_mp3, time.time() - self.created_at))
+            self.version += 1
+            self._cond.notify_all()
+
+    def drop_audio(self):
+        """
+        結果とパートの音声を手放す（保存なしモードで一時置き場に渡したあと。ジョブは keep_seconds の間残るので）。
+        パートの秒数は残す
+        """
+        with self._cond:
+            self.parts = [(None, seconds) for _, seconds in self.parts]
+            if self.result is not None and self.result.get("audio") is not None:
+                self.result = {**self.result, "audio": None}
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def wait(self, version, timeout=1.0):
+        """version から何か変わるか、終わるか、timeout 秒たつまで待つ。今の version を返す"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version or self.finished, timeout)
+            return self.version
+
+class JobQueue:
+    """
+    キーごとに1本だけ動かす（single-flight）ジョブキュー。
+    submit(key, fn) の fn は Job を受け取って結果を返す関数
+    """
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT, keep_seconds=DEFAULT_KEEP_SECONDS):
+        self.keep_seconds = keep_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="radio-job")
+        self._lock = threading.Lock()
+        self._jobs = {} # key -> Job
+
+    def submit(self, key, fn):
+        """
+        ジョブを登録して (job, 新しく作ったか) を返す。
+        同じキーのジョブが待ち・実行中なら、それに相乗りする
+        """
+        with self._lock:
+            self._cleanup()
+            job = self._jobs.get(key)
+            if job is not None and not job.finished:
+                with job._cond:
+                    job.subscribers += 1
+                return job, False
+            job = Job(key)
+            self._jobs[key] = job
+        self._pool.submit(self._run, job, fn)
+        return job, True
+
+    def submit_private(self, fn):
+        """相乗りさせないジョブ（保存なしモードなど）を登録する。キーは毎回別になる"""
+        job, _ = self.submit(f"private:{uuid.uuid4().hex}", fn)
+        return job
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def _run(self, job, fn):
+        job._changed(status="running")
+        try:
+            # job の span は登録したときから（順番待ちも含めた、利用者から見た待ち時間）
+            with tracing.span(job.trace, "job", since=job.created_at, subscribers=job.subscribers):
+                tracing.record(job.trace, "queue_wait", job.created_at, time.time())
+                result = fn(job)
+        except Exception as e:
+            print(f"Job {job.key} failed: {e}")
+            job._changed(status="error", error=e, finished_at=time.time())
+        else:
+            job._changed(status="done", result=result, finished_at=time.time())
+
+    def _cleanup(self):
+        """終わってから keep_seconds 以上たったジョブを消す（_lock を持った状態で呼ぶ）"""
+        now = time.time()
+        for key in [k for k, j in self._jobs.items()
+                    if j.finished and now - j.finished_at > self.keep_seconds]:
+            del self._jobs[key]
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "queued": sum(1 for j in jobs if j.status == "queued"),
+            "running": sum(1 for j in jobs if j.status == "running"),
+            "finished": sum(1 for j in jobs if j.finished),
+            "shared": sum(j.subscribers - 1 for j in jobs),
+        }
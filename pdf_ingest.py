@@ -0,0 +1,202 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+# PDFから番組用の文字を取り出す
+# ・必要な文字数（max_chars）に達したら、残りのページは読まない
+# ・ページ数の多いPDFは、ページをまとめて複数プロセスで並列に読む
+# ・取り出した文字はファイルの中身のハッシュでキャッシュする（同じPDFの再アップロードは読み直さない）。
+#   キャッシュの合計が上限を超えたら古いものから消す
+
+PDF_CHAR_LIMIT = 10000 # 台本に渡す文字数の上限
+PARALLEL_MIN_PAGES = 40 # これ以上のページ数なら並列で読む
+PAGES_PER_TASK = 10 # 1プロセスに1回で渡すページ数
+DEFAULT_MAX_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_CACHE_DIR = ".pdf_text_cache"
+DEFAULT_CACHE_MAX_BYTES = 100 * 1024 * 1024 # 100MBを超えたら古いものから消す
+
+def read_pdf_bytes(pdf_file):
+    """PDF（ファイルパスまたはファイルオブジェクト）の中身をバイト列で返す"""
+    if isinstance(pdf_file, (str, os.PathLike)):
+        with open(pdf_file, "rb") as f:
+            return f.read()
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    pdf_file.seek(0)
+    return pdf_file.read()
+
+def _extract_from_reader(reader, start, end, max_chars):
+    """start〜end-1 ページの文字を取り出す（max_chars に達したらそこでやめる）"""
+    pieces = []
+    total = 0
+    for i in range(start, min(end, len(reader.pages))):
+        text = reader.pages[i].extract_text() or ""
+        pieces.append(text)
+        total += len(text)
+        if max_chars is not None and total >= max_chars:
+            break
+    return "".join(pieces)
+
+# プロセスプール用（各プロセスで1回だけPDFを開く。ページ範囲だけを渡せばよい）
+_worker_reader = None
+
+def _init_worker(data):
+    global _worker_reader
+    import PyPDF2
+    _worker_reader = PyPDF2.PdfReader(BytesIO(data))
+
+def _extract_pages(start, end, max_chars):
+    return _extract_from_reader(_worker_reader, start, end, max_chars)
+
+def extract_pdf_text(data, max_chars=PDF_CHAR_LIMIT, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    PDFのバイト列から先頭 max_chars 文字ぶんの文字を取り出す（None なら全ページ）。
+    ページ数が多いときは PAGES_PER_TASK ページずつプロセスプールで読み、
+    先頭から数えて max_chars に達した時点で残りのページは読まない
+    """
+    import PyPDF2 # 画面の起動では読み込まない（PDFを読むときだけ）
+    reader = PyPDF2.PdfReader(BytesIO(data))
+    page_count = len(reader.pages)
+    if max_workers <= 1 or page_count < PARALLEL_MIN_PAGES:
+        text = _extract_from_reader(reader, 0, page_count, max_chars)
+        return text if max_chars is None else text[:max_chars]
+
+    # 先頭のページだけで足りることも多いので、まずはこのプロセスで読む（プールを立ち上げずに済む）
+    head = _extract_from_reader(reader, 0, PAGES_PER_TASK, max_chars)
+    if max_chars is not None and len(head) >= max_chars:
+        return head[:max_chars]
+
+    pieces = [head]
+    total = len(head)
+    starts = iter(range(PAGES_PER_TASK, page_count, PAGES_PER_TASK))
+    pending = deque()
+    # fork は使わない（Streamlit のサーバーは gRPC（Firestore のリスナー）やスレッドを持っていて、fork すると固まることがある）。
+    # PDFの中身は initializer で渡すので、spawn でも読み直すものは無い
+    pool = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(data,),
+                               mp_context=multiprocessing.get_context("spawn"))
+
+    def fill():
+        # 先読みはプロセス数の2倍まで（文字数が足りたら、それ以上のページは投げない）
+        while len(pending) < max_workers * 2:
+            start = next(starts, None)
+            if start is None:
+                return
+            pending.append(pool.submit(_extract_pages, start, start + PAGES_PER_TASK, max_chars))
+
+    try:
+        fill()
+        # ページ順に受け取る（後ろのページが先に終わっても順番は崩さない）
+        while pending:
+            text = pending.popleft().result()
+            pieces.append(text)
+            total += len(text)
+            if max_chars is not None and total >= max_chars:
+                break
+            fill()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    text = "".join(pieces)
+    return text if max_chars is None else text[:max_chars]
+
+class PdfTextCache:
+    """
+    取り出したPDFの文字のディスクキャッシュ。
+    キーはファイルの中身のハッシュと文字数の上限（同じ名前・サイズの別ファイルとは混ざらない）。
+    合計サイズが max_bytes を超えると古い順（LRU）に消す
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> サイズ（古い順）
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def _load_index(self):
+        """起動時にディスク上のファイルを更新日時順に読み込む"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".txt"):
+                continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            files.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                text = f.read()
+            os.utime(self._path(key)) # 再起動後もLRUの順番が保たれるように
+        except OSError:
+            with self._lock:
+                if key in self._entries:
+                    self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key, text):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        data = text.encode("utf-8")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"PDF text cache write error: {e}")
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+def pdf_text_key(data, max_chars):
+    return f"{hashlib.sha256(data).hexdigest()}_{max_chars or 'all'}"
+
+def read_pdf(pdf_file, max_chars=PDF_CHAR_LIMIT, cache=None, max_workers=DEFAULT_MAX_WORKERS):
+    """PDFを読んで先頭 max_chars 文字を返す（cache を渡すと同じ中身のPDFは読み直さない）"""
+    data = read_pdf_bytes(pdf_file)
+    key = None
+    if cache is not None:
+        key = pdf_text_key(data, max_chars)
+        text = cache.get(key)
+        if text is not None:
+            return text
+
+    text = extract_pdf_text(data, max_chars=max_chars, max_workers=max_workers)
+    if cache is not None and text:
+        cache.put(key, text)
+    return text
@@ -0,0 +1,420 @@
+"""
+番組生成のパイプライン（資料取得 → 台本 → 音声合成・結合 → 保存）。
+Streamlit に依存しないので、画面からもバッチからも同じ処理を呼べる
+
+バッチの使い方（1行に1つ、URLまたはPDFのパス）:
+    python pipeline.py batch sources.txt --styles standard jk --languages 日本語 --jobs 2
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import audio_mixer
+import pdf_ingest
+import script_writer
+import radio_store
+import sources
+import summarizer
+import tracing
+
+class RadioRequest:
+    """番組1本ぶんの注文（資料・スタイル・言語・保存してよいか）"""
+
+    def __init__(self, source, style="standard", language="日本語", allow_cache=True,
+                 pdf_file=None, title="ラジオ番組", source_id=None, long_document=False):
+        self.source = source # URL（PDFのときはファイル名）
+        self.style = style
+        self.language = language
+        self.allow_cache = allow_cache
+        self.pdf_file = pdf_file # PDFのファイルパスまたはファイルオブジェクト
+        self.title = title
+        self.source_id = source_id if source_id is not None else source
+        self.long_document = long_document # True なら資料を切り詰めず、要約してから台本に渡す
+
+    @classmethod
+    def for_pdf(cls, pdf_file, name, **kwargs):
+        """PDFの注文（IDはファイルの中身のハッシュなので、同じ名前・サイズの別ファイルとは混ざらない）"""
+        digest = hashlib.sha256(pdf_ingest.read_pdf_bytes(pdf_file)).hexdigest()
+        return cls(name, pdf_file=pdf_file, title=name, source_id=f"pdf:{digest}", **kwargs)
+
+    @classmethod
+    def from_source(cls, source, style, language, long_document=False):
+        """
+        バッチ用：URLかローカルPDFのパスから注文を作る。
+        URLは公的機関のドメインだけ保存する（PDFは手元の資料なので保存してよい）
+        """
+        if os.path.exists(source):
+            return cls.for_pdf(source, os.path.basename(source), style=style, language=language,
+                               long_document=long_document)
+        return cls(source, style=style, language=language,
+                   allow_cache=sources.is_safe_domain(source), long_document=long_document)
+
+    def __repr__(self):
+        return f"RadioRequest({self.source!r}, {self.style!r}, {self.language!r})"
+
+class RadioPipeline:
+    """
+    番組を作るパイプライン。各段階の担当は差し替えられる
+    - fetcher: fetch(request) -> (文章, タイトル)   （標準は sources.SourceFetcher）
+    - writer: stream(prompt, on_text) -> 台本の断片   （標準は script_writer.GeminiScriptWriter）
+    - tts_client: audio.speech.create を持つクライアント（OpenAI）
+    - store: get(cache_key) / save(...) を持つ保存先（None なら保存しない）。どのメソッドも trace を受け取る。
+      save は形式ごとの {url, bytes, content_type} を返す
+    - post: 音声の後処理（audio_post.PostProcessor。None なら結合したままの音）
+    - summarizer: 長い資料の要約役 condense(text, trace)（summarizer.Summarizer。None なら要約しない）
+    - renditions: 保存する音声の形式（audio_mixer.RENDITIONS の名前。mp3 はいつも作る）
+    結果の audio は MP3 のバイト列（spool_bytes を指定したときは読み出し位置が先頭のファイルオブジェクト）。
+    保存したときは形式ごとにエンコードしながら保存先へ送るので audio は None（audio_url / renditions で再生する）
+    """
+
+    def __init__(self, fetcher, writer, tts_client, store=None, segment_cache=None,
+                 max_workers=audio_mixer.DEFAULT_MAX_WORKERS, spool_bytes=None, post=None,
+                 summarizer=None, renditions=audio_mixer.DEFAULT_RENDITIONS):
+        self.fetcher = fetcher
+        self.writer = writer
+        self.tts_client = tts_client
+        self.store = store
+        self.segment_cache = segment_cache
+        self.max_workers = max_workers
+        self.spool_bytes = spool_bytes # None なら完成したMP3はバイト列で返す
+        self.post = post
+        self.summarizer = summarizer
+        self.renditions = audio_mixer.parse_renditions(renditions)
+
+    def run(self, request, on_part=None, on_progress=None, trace=None):
+        """
+        番組を1本作って結果を dict で返す。
+        キャッシュは 資料の文章 → 台本 → 音声 の3段で、変わった段から下だけを作り直す
+        （文章が同じなら Gemini を呼ばず、台本・声・速度が同じなら TTS も呼ばない）。
+        on_part はパートができるたびに（先行再生用）、on_progress は段階が変わるたびに呼ばれる。
+        trace (tracing.Trace) を渡すと、各段階の span がそこに残る（run 全体も1つの span になる）。
+        保存先の索引で見つかったキャッシュは台本を読まないので、script_text は None になる
+        """
+        with tracing.span(trace, "run", source=request.source, style=request.style,
+                          language=request.language) as span:
+            result = self._run(request, on_part, on_progress, trace)
+            span.set(from_cache=result["from_cache"], lines=result["lines"])
+        return result
+
+    def run_job(self, request, job):
+        """
+        job_queue のジョブとして run する（画面も benchmark.py の e2e もこれを使う）。
+        パートができるたびにMP3にして job に積み（先行再生する人の画面が拾って流す）、
+        段階と Trace も job に渡す
+        """
+        def on_part(part):
+            with tracing.span(job.trace, "part_export", pcm_bytes=len(part)):
+                job.add_part(audio_mixer.export_mp3(part))
+        return self.run(request, on_part=on_part, on_progress=job.set_stage, trace=job.trace)
+
+    def _run(self, request, on_part, on_progress, trace):
+        def progress(stage):
+            if on_progress:
+                on_progress(stage)
+
+        start = time.time()
+        style_config = script_writer.get_style_config(request.style, request.language)
+        use_store = request.allow_cache and self.store is not None
+        mix_version = f"{audio_mixer.TTS_MODEL}:{audio_mixer.MIX_VERSION}"
+        if self.post is not None:
+            # 後処理の設定（BGMを含む）が変われば別の音声として作り直す
+            mix_version += f":post-{self.post.fingerprint()}"
+
+        # 1. コンテンツ取得（URL・PDFはそれぞれの取得キャッシュが効く）
+        progress("fetch")
+        with tracing.span(trace, "fetch" if request.pdf_file is None else "pdf_parse") as span:
+            content_text, title = self.fetcher.fetch(request)
+            span.set(chars=len(content_text))
+        text_hash = radio_store.text_key(content_text)
+
+        pdf_title = title if request.pdf_file is not None else None
+        # 長い資料は要約してから台本に渡す（要約の作り方が変われば台本も作り直す）
+        condense = (request.long_document and self.summarizer is not None
+                    and len(content_text) > summarizer.LONG_SOURCE_MIN_CHARS)
+        prompt_fingerprint = script_writer.prompt_fingerprint(style_config, pdf_title)
+        if condense:
+            prompt_fingerprint += f":summary-{self.summarizer.fingerprint()}"
+        script_key = radio_store.script_key(text_hash, request.style, request.language, prompt_fingerprint)
+        mix_key = radio_store.mix_key(style_config, mix_version)
+        if use_store:
+            # 索引に同じ台本・同じ設定の音声があれば、台本を読まずにそのまま返す（台本の本文は返さない）
+            found = self.store.find(script_key, mix_key, trace=trace)
+            if found:
+                audio_key, cached = found
+                return {
+                    "cache_key": audio_key, "from_cache": True, "title": cached.get('title', '無題'),
+                    "audio": None, "audio_url": cached['audio_url'], "renditions": cached.get('renditions'),
+                    "script_text": None,
+                    "lines": 0, "seconds": time.time() - start,
+                }
+        cached_script = self.store.get_script(script_key, trace=trace) if use_store else None
+
+        # 2. 台本：保存済みならそれを使い、無ければ Gemini にストリーミングで書かせる
+        parser = script_writer.ScriptLineParser(style_config['voice_a'], style_config['voice_b'])
+        if cached_script:
+            script_text = cached_script['script_text']
+            audio_key = radio_store.audio_key(script_text, style_config, mix_version)
+            cached = self.store.get(audio_key, trace=trace)
+            if cached:
+                return {
+                    "cache_key": audio_key, "from_cache": True, "title": cached.get('title', '無題'),
+                    "audio": None, "audio_url": cached['audio_url'], "renditions": cached.get('renditions'),
+                    "script_text": script_text,
+                    "lines": 0, "seconds": time.time() - start,
+                }
+            script_chunks = [script_text]
+            items = parser.feed(script_text) + parser.close()
+        else:
+            if condense:
+                # 台本が保存済みなら要約もしない（キャッシュキーは要約前の文章から作っている）
+                progress("summarize")
+                with tracing.span(trace, "summarize", chars=len(content_text)) as span:
+                    content_text = self.summarizer.condense(content_text, trace=trace)
+                    span.set(summary_chars=len(content_text))
+            prompt = script_writer.build_prompt(style_config, content_text, pdf_title=pdf_title)
+            script_chunks = []
+            # Gemini の span は最初の断片を待ち始めてから書き終わるまで（TTSと重なる）
+            chunks = tracing.iter_span(trace, "gemini",
+                                       self.writer.stream(prompt, on_text=script_chunks.append),
+                                       prompt_chars=len(prompt))
+            items = script_writer.iter_script_items(chunks, parser)
+
+        # 3. 音声合成（台本が新しいときは、書けた行から順に合成する）
+        progress("record")
+        # 保存なしモードではセリフ音声もキャッシュしない
+        segment_cache = self.segment_cache if request.allow_cache else None
+        program = None
+        if use_store:
+            # 保存するときは結合したPCMのまま持っておき、形式ごとにエンコードしながら保存先へ送る（4.）
+            program = audio_mixer.mix_program(
+                items,
+                self.tts_client,
+                speed=style_config['speed'],
+                max_workers=self.max_workers,
+                cache=segment_cache,
+                on_part=on_part,
+                trace=trace,
+                post=self.post
+            )
+            audio = None
+        else:
+            # 完成したMP3は1回ごとにメモリ上で受け取る（ファイルを共有しないので同時に何本でも作れる）。
+            # spool_bytes を超える番組は、このジョブ専用の一時ファイルに逃がす
+            output = None
+            if self.spool_bytes is not None:
+                output = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+            audio = audio_mixer.combine_audio_with_ma(
+                items,
+                self.tts_client,
+                speed=style_config['speed'],
+                max_workers=self.max_workers,
+                cache=segment_cache,
+                on_part=on_part,
+                output=output,
+                trace=trace,
+                post=self.post
+            )
+        if segment_cache:
+            stats = segment_cache.stats()
+            print(f"Segment cache: hits={stats['hits']} misses={stats['misses']} "
+                  f"saved_chars={stats['saved_chars']} saved_seconds={stats['saved_seconds']:.1f}")
+        if parser.lines_emitted == 0:
+            audio = b"" # 台本からセリフが1行も取れなかった
+        script_text = "".join(script_chunks)
+        audio_key = radio_store.audio_key(script_text, style_config, mix_version)
+
+        # 4. 保存（台本と音声は別々に保存する）
+        audio_url = None
+        renditions = None
+        if use_store and parser.lines_emitted > 0:
+            progress("save")
+            if not cached_script:
+                self.store.save_script(script_key, script_text, text_hash,
+                                       request.style, request.language, trace=trace)
+            pcm = program.view()
+            try:
+                def encode(rendition, out):
+                    with tracing.span(trace, "export", rendition=rendition, pcm_bytes=len(pcm)):
+                        audio_mixer.encode_rendition_to(pcm, out, rendition)
+                renditions = self.store.save(audio_key, encode, request.source_id,
+                                             request.style, request.language, title,
+                                             extra={'text_hash': text_hash, 'script_key': script_key,
+                                                    'mix_key': mix_key},
+                                             trace=trace, renditions=self.renditions)
+            finally:
+                pcm.release()
+            audio_url = renditions["mp3"]["url"]
+
+        return {
+            "cache_key": audio_key, "from_cache": False, "title": title,
+            "audio": audio, "audio_url": audio_url, "renditions": renditions, "script_text": script_text,
+            "lines": parser.lines_emitted, "seconds": time.time() - start,
+        }
+
+    def run_batch(self, requests, jobs=2, on_result=None, trace_path=None):
+        """
+        複数の注文をスレッドで並列に処理する（夜間のキャッシュ温めなど）。
+        結果は (request, result, error) のリストで返す。
+        trace_path を渡すと、1本ごとの Trace を OTLP/JSON でそのファイルに追記する
+        """
+        def run_one(request):
+            if trace_path is None:
+                return self.run(request)
+            trace = tracing.Trace(repr(request))
+            try:
+                return self.run(request, trace=trace)
+            finally:
+                tracing.write_trace(trace, trace_path)
+
+        results = []
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(run_one, request): request for request in requests}
+            for future in as_completed(futures):
+                request = futures[future]
+                try:
+                    outcome = (request, future.result(), None)
+                except Exception as e:
+                    outcome = (request, None, e)
+                if on_result:
+                    on_result(*outcome)
+                results.append(outcome)
+        return results
+
+# 本番で保存する形式（聞く人の多くはスマホなので、MP3 に加えてモノラル低ビットレートの Opus / AAC も置く）
+DEFAULT_SAVED_RENDITIONS = ("mp3", "opus", "aac")
+
+def build_pipeline_from_env(max_workers=audio_mixer.DEFAULT_MAX_WORKERS, spool_bytes=None):
+    """
+    環境変数（GEMINI_API_KEY / OPENAI_API_KEY / BGM_FILE / AUDIO_RENDITIONS）と firebase_key.json から
+    本番用のパイプラインを組み立てる（バッチ用）
+    """
+    from openai import OpenAI
+    import firebase_admin
+    from firebase_admin import credentials, firestore, storage
+    import tts_cache
+    import fetcher
+    import audio_post
+    from radio_store import FirebaseRadioStore, RadioIndex
+
+    store = None
+    if not firebase_admin._apps and os.path.exists("firebase_key.json"):
+        bucket_name = os.environ.get("FIREBASE_BUCKET", "webradio-app1.firebasestorage.app")
+        firebase_admin.initialize_app(credentials.Certificate("firebase_key.json"),
+                                      {'storageBucket': bucket_name})
+    if firebase_admin._apps:
+        db = firestore.client()
+        # 何百本も作るときに1本ごとにキャッシュを問い合わせない（リスナーで変更を受け取り続ける）
+        store = FirebaseRadioStore(db, storage.bucket(), index=RadioIndex(db).start())
+
+    renditions = audio_mixer.parse_renditions(os.environ.get("AUDIO_RENDITIONS", DEFAULT_SAVED_RENDITIONS))
+    bgm_file = os.environ.get("BGM_FILE")
+    bgm = audio_post.load_bgm(bgm_file) if bgm_file else None
+    writer = script_writer.GeminiScriptWriter.from_api_key(os.environ.get("GEMINI_API_KEY", ""))
+
+    return RadioPipeline(
+        fetcher=sources.SourceFetcher(pdf_cache=pdf_ingest.PdfTextCache(),
+                                      page_cache=fetcher.SourceContentCache()),
+        writer=writer,
+        # レート制限の再試行は synthesize_line が受け持つ（クライアントでは再試行しない）
+        tts_client=OpenAI(api_key=os.environ.get("OPENAI_API_KEY", ""), max_retries=0),
+        store=store,
+        segment_cache=tts_cache.SegmentCache(),
+        max_workers=max_workers,
+        spool_bytes=spool_bytes,
+        post=audio_post.PostProcessor(bgm=bgm),
+        summarizer=summarizer.Summarizer(writer.model, model_name=script_writer.GEMINI_MODEL,
+                                         cache=summarizer.SummaryCache()),
+        renditions=renditions,
+    )
+
+def read_batch_file(path, styles, languages, long_document=False):
+    """バッチファイル（1行1資料、# はコメント）と スタイル × 言語 から注文を作る"""
+    with open(path, encoding="utf-8") as f:
+        source_list = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [
+        RadioRequest.from_source(source, style, language, long_document=long_document)
+        for source in source_list for style in styles for language in languages
+    ]
+
+# プロセスプール用（各プロセスで1回だけパイプラインを作る）
+_worker_pipeline = None
+_worker_trace_path = None
+
+def _init_worker(max_workers, spool_bytes, trace_path=None):
+    global _worker_pipeline, _worker_trace_path
+    _worker_pipeline = build_pipeline_from_env(max_workers, spool_bytes)
+    _worker_trace_path = trace_path
+
+def _run_in_worker(source, style, language, long_document=False):
+    request = RadioRequest.from_source(source, style, language, long_document=long_document)
+    trace = tracing.Trace(repr(request)) if _worker_trace_path else None
+    try:
+        result = _worker_pipeline.run(request, trace=trace)
+    finally:
+        if trace is not None:
+            tracing.write_trace(trace, _worker_trace_path)
+    result["audio"] = None # 親プロセスに音声を送り返さない（保存先に入っている）
+    return result
+
+def _print_result(request, result, error):
+    if error is not None:
+        print(f"NG    {request}: {error}")
+    elif result["from_cache"]:
+        print(f"CACHE {request}: {result['title']}")
+    else:
+        print(f"OK    {request}: {result['title']} ({result['lines']} lines, {result['seconds']:.1f}s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="WebRadio バッチ生成")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("batch", help="資料の一覧 × スタイル × 言語 をまとめて生成する")
+    p.add_argument("sources_file")
+    p.add_argument("--styles", nargs="+", default=["standard"])
+    p.add_argument("--languages", nargs="+", default=["日本語"])
+    p.add_argument("--jobs", type=int, default=2, help="同時に作る番組の数")
+    p.add_argument("--processes", action="store_true", help="スレッドではなくプロセスで並列化する")
+    p.add_argument("--tts-workers", type=int, default=audio_mixer.DEFAULT_MAX_WORKERS)
+    p.add_argument("--spool-mb", type=int, default=None,
+                   help="これより大きい番組はメモリではなくジョブごとの一時ファイルで受け取る")
+    p.add_argument("--long-document", action="store_true",
+                   help="資料を切り詰めず、分割して要約してから台本にする（長いPDF・報告書向け）")
+    p.add_argument("--trace-file", default=None,
+                   help="1本ごとの処理の内訳（OTLP/JSON）を1行ずつ追記するファイル")
+    p.add_argument("--metrics-file", default=None,
+                   help="終わったときの集計（Prometheusのテキスト形式）を書き出すファイル（スレッド実行のみ）")
+    args = parser.parse_args()
+
+    requests = read_batch_file(args.sources_file, args.styles, args.languages, args.long_document)
+    # 保存できない（公的機関以外の）URLは作っても温まらないので飛ばす
+    for request in [r for r in requests if not r.allow_cache]:
+        print(f"SKIP  {request}: 公的機関以外のドメイン")
+    requests = [r for r in requests if r.allow_cache]
+    print(f"{len(requests)} programs, jobs={args.jobs}")
+
+    spool_bytes = args.spool_mb * 1024 * 1024 if args.spool_mb is not None else None
+    start = time.time()
+    if args.processes:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                                 initargs=(args.tts_workers, spool_bytes, args.trace_file)) as pool:
+            futures = {pool.submit(_run_in_worker, r.source if r.pdf_file is None else r.pdf_file,
+                                   r.style, r.language, r.long_document): r for r in requests}
+            for future in as_completed(futures):
+                try:
+                    _print_result(futures[future], future.result(), None)
+                except Exception as e:
+                    _print_result(futures[future], None, e)
+    else:
+        pipeline = build_pipeline_from_env(args.tts_workers, spool_bytes)
+        pipeline.run_batch(requests, jobs=args.jobs, on_result=_print_result,
+                           trace_path=args.trace_file)
+        if args.metrics_file:
+            with open(args.metrics_file, "w", encoding="utf-8") as f:
+                f.write(tracing.render_prometheus())
+    print(f"done in {time.time() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
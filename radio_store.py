@@ -0,0 +1,335 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import audio_mixer
+import tracing
+
+# 番組の保存先
+# キャッシュは3段になっていて、上の段が変わったときだけ下の段を作り直す
+#   1. 資料の文章  → text_key   （文章そのもののハッシュ）
+#   2. 台本        → script_key （文章のハッシュ + スタイル + 言語 + プロンプトの指紋）… Firestore の scripts
+#   3. 完成した音声 → audio_key  （台本のハッシュ + 声 + 速度 + TTS/結合の版）… Firestore の radios + Storage の audio/
+#      音声は形式（audio_mixer.RENDITIONS）ごとに audio/<key>.<ext> に置き、radios の renditions に一覧を持つ
+# radios はプロセス内の索引（RadioIndex）にも持っておき、キャッシュの確認とライブラリ表示に使う
+#   radios には script_key と mix_key（声 + 速度 + TTS/結合の版）も入れておくので、
+#   台本を Firestore から読まなくても、索引だけで「この台本の音声はもうある」と答えられる
+# firebase_admin は保存するときに読み込む（Firebase を使わない画面・バッチの起動を遅くしないため）
+
+DEFAULT_INDEX_TTL = 5 * 60 # リスナーを使わないとき、索引を読み直す間隔（秒）
+INDEX_READY_TIMEOUT = 10 # リスナーの最初のスナップショットを待つ秒数
+# 索引に持つ項目（台本の本文などは持たない）
+INDEX_FIELDS = ('source', 'style', 'language', 'title', 'audio_url', 'renditions', 'created_at',
+                'text_hash', 'script_key', 'mix_key')
+# 再開できるアップロードの1回に送る大きさ（256KBの倍数）。失敗してもこの単位で送り直す
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def _hash(*parts):
+    return hashlib.sha256("\n".join(str(p) for p in parts).encode()).hexdigest()
+
+def generate_cache_key(source_id, style, lang):
+    """注文そのもののキー（同じ注文が同時に来たときの相乗り用。キャッシュには使わない）"""
+    unique_string = f"{source_id}_{style}_{lang}"
+    return hashlib.md5(unique_string.encode()).hexdigest()
+
+def text_key(content_text):
+    return _hash(content_text)
+
+def script_key(text_hash, style, lang, prompt_fingerprint):
+    return _hash("script", text_hash, style, lang, prompt_fingerprint)
+
+def audio_key(script_text, style_config, mix_version):
+    return _hash("audio", _hash(script_text), style_config['voice_a'], style_config['voice_b'],
+                 f"{float(style_config['speed']):.3f}", mix_version)
+
+def mix_key(style_config, mix_version):
+    """台本を音声にするときの設定（audio_key から台本を除いた部分）のキー"""
+    return _hash("mix", style_config['voice_a'], style_config['voice_b'],
+                 f"{float(style_config['speed']):.3f}", mix_version)
+
+def _sort_time(doc):
+    created_at = doc.get('created_at')
+    # 書き込んだ直後はサーバーの時刻がまだ入っていないことがあるので「今」として並べる
+    return created_at if isinstance(created_at, datetime) else datetime.now(timezone.utc)
+
+def _is_web_source(source):
+    """
+    Webの資料から作った番組か。PDFの source は 'pdf:' で始まるが、それより前に保存した番組は
+    「ファイル名 + 大きさ」なので、http(s) で始まるものだけを Web の資料とみなす
+    """
+    return str(source or '').startswith(('http://', 'https://'))
+
+class RadioIndex:
+    """
+    radios コレクションのメタデータをプロセス内に持つ索引（サーバープロセスで1つ作って使い回す）。
+    listen=True なら Firestore のスナップショットリスナーで変更を受け取り続けるので、
+    キャッシュの確認はネットワークに出ずに索引だけで答えられる（live が True の間は、索引に無い = 保存されていない）。
+    listen=False なら ttl 秒ごとに読み直す（読み直しは裏のスレッドで行い、その間は古い索引を使う）
+    """
+
+    def __init__(self, db, ttl=DEFAULT_INDEX_TTL, listen=True, ready_timeout=INDEX_READY_TIMEOUT):
+        self.collection = db.collection('radios')
+        self.ttl = ttl
+        self.listen = listen
+        self.ready_timeout = ready_timeout
+        self._lock = threading.Lock()
+        self._docs = {} # cache_key -> メタデータ
+        self._sorted = None # 新しい順に並べた (cache_key, doc)（変更があったら作り直す）
+        self._by_mix = None # (script_key, mix_key) -> cache_key（変更があったら作り直す）
+        self._loaded_at = None
+        self._refreshing = False
+        self._ready = threading.Event()
+        self._watch = None
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        """最初の読み込み（リスナーなら最初のスナップショットが届くまで ready_timeout 秒だけ待つ）"""
+        if self.listen:
+            self._watch = self.collection.on_snapshot(self._on_snapshot)
+            if not self._ready.wait(self.ready_timeout):
+                print("Radio index: first snapshot not received yet, falling back to Firestore reads")
+        else:
+            self.refresh()
+        return self
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    @property
+    def live(self):
+        """リスナーで最新の状態を受け取っているか（False のときは索引に無くても保存されているかもしれない）"""
+        return self._watch is not None and self._ready.is_set()
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        with self._lock:
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    self._docs.pop(change.document.id, None)
+                else:
+                    self._docs[change.document.id] = self._meta(change.document.to_dict())
+            self._sorted = None
+            self._by_mix = None
+            self._loaded_at = time.time()
+        self._ready.set()
+
+    @staticmethod
+    def _meta(doc):
+        return {k: doc[k] for k in INDEX_FIELDS if k in doc}
+
+    def refresh(self):
+        """コレクションを全部読み直す"""
+        docs = {snap.id: self._meta(snap.to_dict()) for snap in self.collection.stream()}
+        with self._lock:
+            self._docs = docs
+            self._sorted = None
+            self._by_mix = None
+            self._loaded_at = time.time()
+            self._refreshing = False
+        self._ready.set()
+
+    def _refresh_if_stale(self):
+        if self.listen:
+            return
+        with self._lock:
+            if self._refreshing or (self._loaded_at is not None and time.time() - self._loaded_at < self.ttl):
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Radio index refresh error: {e}")
+                with self._lock:
+                    self._refreshing = False
+        threading.Thread(target=run, daemon=True, name="radio-index").start()
+
+    def get(self, cache_key):
+        self._refresh_if_stale()
+        with self._lock:
+            doc = self._docs.get(cache_key)
+            if doc is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(doc)
+
+    def find(self, script_key, mix_key):
+        """台本と音声の設定が同じ番組を探して (cache_key, メタデータ) を返す。無ければ None"""
+        self._refresh_if_stale()
+        with self._lock:
+            if self._by_mix is None:
+                self._by_mix = {(doc['script_key'], doc['mix_key']): k for k, doc in self._docs.items()
+                                if 'script_key' in doc and 'mix_key' in doc}
+            cache_key = self._by_mix.get((script_key, mix_key))
+            if cache_key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return cache_key, dict(self._docs[cache_key])
+
+    def put(self, cache_key, doc):
+        """このプロセスで保存した番組をすぐに索引へ入れる（リスナーの通知を待たない）"""
+        with self._lock:
+            self._docs[cache_key] = self._meta(doc)
+            self._sorted = None
+            self._by_mix = None
+
+    def query(self, style=None, language=None, since=None, until=None, kind=None, offset=0, limit=20):
+        """
+        新しい順に絞り込んで1ページぶんを返す。(その page の項目のリスト, 絞り込んだ件数)。
+        since / until は created_at の範囲（datetime。until は含まない）、
+        kind は 'url'（Webの資料）か 'pdf'（PDFなど、Webでない資料）
+        """
+        self._refresh_if_stale()
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sorted(self._docs.items(), key=lambda kv: _sort_time(kv[1]), reverse=True)
+            ordered = self._sorted
+        matched = []
+        for cache_key, doc in ordered:
+            if style is not None and doc.get('style') != style:
+                continue
+            if language is not None and doc.get('language') != language:
+                continue
+            created_at = _sort_time(doc)
+            if since is not None and created_at < since:
+                continue
+            if until is not None and created_at >= until:
+                continue
+            if kind is not None and _is_web_source(doc.get('source')) != (kind == 'url'):
+                continue
+            matched.append((cache_key, doc))
+        page = [{'cache_key': k, **doc} for k, doc in matched[offset:offset + limit]]
+        return page, len(matched)
+
+    def stats(self):
+        with self._lock:
+            return {"programs": len(self._docs), "hits": self.hits, "misses": self.misses, "live": self.live}
+
+class _CountingWriter:
+    """書き込んだバイト数を数えながら raw へ流すだけのファイルオブジェクト"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes = 0
+
+    def write(self, data):
+        self.raw.write(data)
+        self.bytes += len(data)
+        return len(data)
+
+class FirebaseRadioStore:
+    """
+    番組のキャッシュ（Firestore + Firebase Storage）。
+    同じ get/find/save/get_script/save_script を持つオブジェクトなら何でも RadioPipeline に差し込める
+    （どのメソッドも trace を受け取り、Firestore と Storage の時間を分けて記録する）。
+    index（RadioIndex）を渡すと、番組のキャッシュの確認は索引で答える
+    """
+
+    def __init__(self, db, bucket, index=None):
+        self.db = db
+        self.bucket = bucket
+        self.index = index
+
+    def get(self, cache_key, trace=None):
+        if self.index is not None:
+            doc = self.index.get(cache_key)
+            if doc is not None or self.index.live:
+                return doc
+        with tracing.span(trace, "firestore_read", collection='radios'):
+            doc_ref = self.db.collection('radios').document(cache_key)
+            doc = doc_ref.get()
+        if doc.exists: return doc.to_dict()
+        return None
+
+    def find(self, script_key, mix_key, trace=None):
+        """
+        台本（script_key）と音声の設定（mix_key）が同じ保存済みの番組を索引で探す。
+        見つかれば (cache_key, doc)、索引が無い・見つからないときは None（台本を読んで audio_key で確かめる）
+        """
+        if self.index is None:
+            return None
+        return self.index.find(script_key, mix_key)
+
+    def get_script(self, script_key, trace=None):
+        with tracing.span(trace, "firestore_read", collection='scripts'):
+            doc = self.db.collection('scripts').document(script_key).get()
+        if doc.exists: return doc.to_dict()
+        return None
+
+    def save_script(self, script_key, script_text, text_hash, style, lang, trace=None):
+        from firebase_admin import firestore
+        with tracing.span(trace, "firestore_write", collection='scripts'):
+            self.db.collection('scripts').document(script_key).set({
+                'script_text': script_text,
+                'text_hash': text_hash,
+                'style': style,
+                'language': lang,
+                'created_at': firestore.SERVER_TIMESTAMP
+            })
+
+    def _upload_rendition(self, cache_key, encode, rendition, trace):
+        """encode(rendition, out) の出力を、できた分から Storage へ再開できるアップロードで送る"""
+        spec = audio_mixer.RENDITIONS[rendition]
+        with tracing.span(trace, "storage_upload", rendition=rendition) as span:
+            blob = self.bucket.blob(f"audio/{cache_key}.{spec['ext']}")
+            with blob.open("wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type=spec["content_type"]) as writer:
+                counter = _CountingWriter(writer)
+                encode(rendition, counter)
+            blob.make_public()
+            span.set(bytes=counter.bytes)
+            tracing.UPLOAD_BYTES.inc(counter.bytes)
+        return {'url': blob.public_url, 'bytes': counter.bytes, 'content_type': spec["content_type"]}
+
+    def save(self, cache_key, audio_data, source_info, style, lang, title, extra=None, trace=None,
+             renditions=audio_mixer.DEFAULT_RENDITIONS):
+        """
+        audio_data は MP3 のバイト列かファイルオブジェクト、または encode(rendition, out) という関数。
+        関数のときは renditions の形式ごとに（同時に）エンコードしながら送るので、番組全体をメモリに溜めない。
+        mp3 は古い画面のためにいつも作り、その URL を audio_url にする。
+        形式ごとの {url, bytes, content_type} を返す
+        """
+        from firebase_admin import firestore
+        if callable(audio_data):
+            names = list(dict.fromkeys(("mp3",) + tuple(renditions)))
+            with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="upload") as pool:
+                futures = {name: pool.submit(self._upload_rendition, cache_key, audio_data, name, trace)
+                           for name in names}
+                uploaded = {name: future.result() for name, future in futures.items()}
+        else:
+            with tracing.span(trace, "storage_upload", rendition="mp3") as span:
+                blob = self.bucket.blob(f"audio/{cache_key}.mp3")
+                if hasattr(audio_data, "read"):
+                    # 一時ファイルに逃がした番組は、読み込み直さずにそのまま送る
+                    blob.upload_from_file(audio_data, content_type="audio/mp3", rewind=True)
+                    size = audio_data.tell()
+                else:
+                    blob.upload_from_string(audio_data, content_type="audio/mp3")
+                    size = len(audio_data)
+                blob.make_public()
+                span.set(bytes=size)
+                tracing.UPLOAD_BYTES.inc(size)
+            uploaded = {"mp3": {'url': blob.public_url, 'bytes': size, 'content_type': "audio/mpeg"}}
+        audio_url = uploaded["mp3"]["url"]
+
+        doc = {
+            'source': source_info,
+            'style': style,
+            'language': lang,
+            'title': title,
+            'audio_url': audio_url,
+            'renditions': uploaded,
+            'created_at': firestore.SERVER_TIMESTAMP,
+            **(extra or {})
+        }
+        with tracing.span(trace, "firestore_write", collection='radios'):
+            doc_ref = self.db.collection('radios').document(cache_key)
+            doc_ref.set(doc)
+        if self.index is not None:
+            self.index.put(cache_key, {**doc, 'created_at': datetime.now(timezone.utc)})
+        return uploaded
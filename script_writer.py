@@ -0,0 +1,176 @@
+import hashlib
+import re
+
+# 台本を書く（Gemini）と、台本（「A: セリフ」「B: セリフ」形式）を1行ずつ {voice, text} に変換する
+
+GEMINI_MODEL = "gemini-2.5-flash"
+# 台本の作り方（プロンプト・解析）を変えて、保存済みの台本を作り直したいときに上げる。
+# プロンプトの文面や get_style_config の役割を変えたときは、指紋が変わるので上げなくてよい
+PROMPT_VERSION = 1
+
+def get_style_config(style_key, language):
+    config = {
+        "prompt_role": f"【役割】A:メインMC B:アシスタント 口調:{language}の標準的ニュース。落ち着いたトーンで。",
+        "voice_a": "onyx", "voice_b": "nova",
+        "speed": 1.0
+    }
+
+    if style_key == "jk":
+        config = {
+            "prompt_role": "【役割】A:元気なJK(ボケ) B:冷静なJK(ツッコミ) 口調:『〜だし！』『マジで？』等のタメ口。短文でテンポよく。",
+            "voice_a": "nova", "voice_b": "alloy",
+            "speed": 1.15
+        }
+    elif style_key == "comedian":
+        config = {
+            "prompt_role": "【役割】A:ボケ(ハイテンション) B:ツッコミ(鋭く) 口調:関西弁や漫才口調。掛け合いを早く。",
+            "voice_a": "echo", "voice_b": "onyx",
+            "speed": 1.1
+        }
+    elif style_key == "okayama":
+        config = {
+            "prompt_role": "【役割】A,B:岡山出身の女性。口調:『〜じゃが』『〜だけぇ』等の岡山弁。親しみやすく。",
+            "voice_a": "nova", "voice_b": "alloy",
+            "speed": 1.05
+        }
+    elif style_key == "university":
+        config = {
+            "prompt_role": "【役割】A:男子大学生 B:女子大学生 口調:敬語混じりのカジュアルな会話。サークル棟での会話風。",
+            "voice_a": "fable", "voice_b": "nova",
+            "speed": 1.1
+        }
+    return config
+
+def build_prompt(style_config, content_text, pdf_title=None):
+    """台本作成用のプロンプトを作る（PDFのときは資料名を冒頭で言わせる）"""
+    source_statement = ""
+    if pdf_title is not None:
+        source_statement = f"冒頭で『この放送は、資料 {pdf_title} を元にAIが作成しました』と明言すること。"
+
+    return f"""
+    以下の情報を元にラジオ台本を作成してください。
+    {style_config['prompt_role']}
+    {source_statement}
+
+    【重要：出力形式】
+    - 各行は「A: セリフ」「B: セリフ」の形式で書くこと。
+    - 箇条書きの記号（・や*）は使わないこと。
+    - ト書き（笑いや拍手など）は書かないこと。
+    - 専門用語はわかりやすく噛み砕くこと。
+
+    【構成】OP→本題→ED。5分程度。
+
+    【入力データ】
+    {content_text}
+    """
+
+def prompt_fingerprint(style_config, pdf_title=None):
+    """台本キャッシュ用のプロンプトの指紋（版・モデル・資料以外のプロンプト全文から作る）"""
+    template = build_prompt(style_config, "", pdf_title=pdf_title)
+    unique_string = f"{PROMPT_VERSION}\n{GEMINI_MODEL}\n{template}"
+    return hashlib.sha256(unique_string.encode()).hexdigest()[:16]
+
+def parse_script_line(line, voice_a, voice_b):
+    """台本の1行を {voice, text} にする。セリフにならない行は None"""
+    line = line.strip()
+    if not line:
+        return None
+
+    # クリーニング処理
+    clean_line = re.sub(r'^[\*\-・\s]+', '', line)
+    clean_line = clean_line.replace('**', '')
+
+    parts = re.split('[:：]', clean_line, 1)
+
+    # 話者判定と声の割り当て
+    if len(parts) >= 2:
+        speaker_part = parts[0].strip()
+        text_content = parts[1].strip()
+        if "A" in speaker_part or "Ａ" in speaker_part:
+            voice = voice_a
+        elif "B" in speaker_part or "Ｂ" in speaker_part:
+            voice = voice_b
+        else:
+            voice = voice_a
+            text_content = clean_line
+    else:
+        voice = voice_a
+        text_content = clean_line
+
+    if not text_content:
+        return None
+    return {"voice": voice, "text": text_content}
+
+class ScriptLineParser:
+    """
+    ストリーミングで届く台本の断片を受け取り、
+    1行が完成するたびに {voice, text} を返すパーサー（行の途中は次の断片まで持ち越す）
+    """
+
+    def __init__(self, voice_a, voice_b):
+        self.voice_a = voice_a
+        self.voice_b = voice_b
+        self._pending = ""
+        self.lines_emitted = 0
+
+    def _parse(self, line):
+        item = parse_script_line(line, self.voice_a, self.voice_b)
+        if item is not None:
+            self.lines_emitted += 1
+        return item
+
+    def feed(self, chunk):
+        """断片を追加し、完成した行のセリフをリストで返す"""
+        self._pending += chunk
+        *lines, self._pending = self._pending.split('\n')
+        return [item for item in map(self._parse, lines) if item is not None]
+
+    def close(self):
+        """最後の（改行で終わっていない）行を処理する"""
+        line, self._pending = self._pending, ""
+        item = self._parse(line)
+        return [item] if item is not None else []
+
+def parse_script(script_text, voice_a, voice_b):
+    """台本全体をまとめて {voice, text} のリストにする"""
+    parser = ScriptLineParser(voice_a, voice_b)
+    return parser.feed(script_text) + parser.close()
+
+def iter_script_items(chunks, parser):
+    """
+    台本の断片（ジェネレーターなど）を parser に流し込み、
+    完成したセリフから順にyieldする（そのままTTSに渡せる）
+    """
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+def stream_script(model, prompt, on_text=None):
+    """
+    Geminiにストリーミングで台本を書かせ、届いた断片を順にyieldする。
+    on_text を渡すと断片ごとに呼ばれる（台本全体の記録用）
+    """
+    response = model.generate_content(prompt, stream=True)
+    for chunk in response:
+        text = chunk.text
+        if on_text:
+            on_text(text)
+        yield text
+
+class GeminiScriptWriter:
+    """
+    台本を書く役（generate_content を持つモデルなら何でもよい）。
+    同じ stream(prompt) を持つオブジェクトなら何でも RadioPipeline に差し込める
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    @classmethod
+    def from_api_key(cls, api_key, model_name=GEMINI_MODEL):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        return cls(genai.GenerativeModel(model_name))
+
+    def stream(self, prompt, on_text=None):
+        return stream_script(self.model, prompt, on_text=on_text)
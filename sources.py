@@ -0,0 +1,77 @@
+from urllib.parse import urlparse, parse_qs
+import fetcher
+import pdf_ingest
+
+# 番組の元になる資料（URL・PDF）を読み込む
+# bs4 と youtube_transcript_api は使うときに読み込む（画面の起動を遅くしないため）
+
+class SourceError(Exception):
+    """資料から番組にできる文章が取れなかったときのエラー"""
+
+def is_safe_domain(url):
+    try:
+        domain = urlparse(url).netloc
+        safe_suffixes = ['.go.jp', '.lg.jp', '.ac.jp', '.ed.jp', '.or.jp']
+        for suffix in safe_suffixes:
+            if domain.endswith(suffix):
+                return True
+        return False
+    except:
+        return False
+
+# 長い資料モードでないときに台本に渡す文字数（記事・字幕）
+URL_CHAR_LIMIT = 5000
+
+def fetch_content_from_url(url, openai_api_key=None, cache=None, max_chars=URL_CHAR_LIMIT):
+    """URL（Web記事・YouTube字幕）の文章を先頭 max_chars 文字まで返す（None なら全文）"""
+    if "youtube.com" in url or "youtu.be" in url:
+        parsed = urlparse(url)
+        if "youtube.com" in parsed.netloc: video_id = parse_qs(parsed.query).get("v", [None])[0]
+        elif "youtu.be" in parsed.netloc: video_id = parsed.path[1:]
+        else: video_id = None
+
+        if not video_id: return "Error: Video ID not found"
+        try:
+            from youtube_transcript_api import YouTubeTranscriptApi
+            ts = YouTubeTranscriptApi.get_transcript(video_id, languages=['ja','en'])
+            return f"【YouTube(字幕)】\n{' '.join([t['text'] for t in ts])[:max_chars]}..."
+        except:
+            return "字幕が見つかりませんでした。"
+    else:
+        try:
+            # 接続は使い回し、同じページは条件付きGETで変わっていなければキャッシュを使う
+            page = fetcher.fetch_url(url, cache=cache)
+            from bs4 import BeautifulSoup
+            soup = BeautifulSoup(page["text"], 'html.parser')
+            title = soup.title.string if soup.title else "Web記事"
+            return f"【Web記事：{title}】\n{' '.join([p.text for p in soup.find_all('p')])[:max_chars]}..."
+        except: return f"Error: {url}"
+
+class SourceFetcher:
+    """
+    RadioRequest から (番組の元になる文章, タイトル) を取り出す標準の取得役。
+    同じ fetch(request) を持つオブジェクトなら何でも RadioPipeline に差し込める
+    """
+
+    def __init__(self, pdf_cache=None, page_cache=None):
+        self.pdf_cache = pdf_cache # pdf_ingest.PdfTextCache（None ならキャッシュしない）
+        self.page_cache = page_cache # fetcher.SourceContentCache（None ならキャッシュしない）
+
+    def fetch(self, request):
+        # 長い資料モードでは全文を渡す（台本に渡す前に RadioPipeline の summarizer が要約する）
+        long_document = request.long_document
+        if request.pdf_file is None:
+            content_text = fetch_content_from_url(request.source, cache=self.page_cache,
+                                                  max_chars=None if long_document else URL_CHAR_LIMIT)
+            title = request.title
+            if "【Web記事：" in content_text:
+                title = content_text.split("【Web記事：")[1].split("】")[0]
+            return content_text, title
+
+        # 台本に渡す文字数に達したら残りのページは読まない（長い資料モードでは全ページ読む）
+        max_chars = None if long_document else pdf_ingest.PDF_CHAR_LIMIT
+        text = pdf_ingest.read_pdf(request.pdf_file, max_chars, cache=self.pdf_cache)
+        print(f"PDF text: {len(text)} chars ({request.title})")
+        if len(text) == 0:
+            raise SourceError("⚠️ エラー: 文字が読み取れませんでした。このPDFは「画像（スキャンデータ）」ではありませんか？ 現在の仕組みでは画像PDFは読めません。")
+        return f"【PDF資料：{request.title}】\n{text}...", request.title
@@ -0,0 +1,282 @@
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+
+# 長い資料の要約（map-reduce）
+# ・資料を「かたまり（チャンク）」に分けて、Gemini で並列に要約する（同時に投げる数は max_workers まで）
+# ・要約をつなげて、台本に渡せる長さ（target_chars）に収まるまで要約し直す
+# ・かたまりの要約は中身のハッシュでキャッシュする（資料の一部が変わっても、変わったかたまりだけ作り直す）。
+#   何番目のかたまりかはプロンプトにもキーにも入れない（途中にかたまりが増えても、ほかの要約はそのまま使える）
+# ・かたまりの区切りは中身で決める（途中に文章が足されても、その後ろの区切りはずれない）
+
+SUMMARY_VERSION = 2 # 要約のプロンプトを変えて、キャッシュした要約を作り直したいときに上げる
+LONG_SOURCE_MIN_CHARS = 10000 # これより長い資料だけ要約する（短ければそのまま台本に渡す）
+DEFAULT_TARGET_CHARS = 10000 # 台本に渡す要約の長さの上限
+DEFAULT_MAX_CHUNK_TOKENS = 6000 # 1つのかたまりの大きさ（トークンの目安）
+DEFAULT_MIN_CHUNK_TOKENS = 2000 # これより小さいかたまりは作らない（最後を除く）
+DEFAULT_SUMMARY_CHARS = 800 # 1つのかたまりの要約の長さ
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+MAX_REDUCE_ROUNDS = 4
+DEFAULT_CACHE_DIR = ".summary_cache"
+DEFAULT_CACHE_MAX_BYTES = 50 * 1024 * 1024 # 50MBを超えたら古いものから消す
+CUT_AVERAGE_TOKENS = 2000 # 区切ってよい文が、平均してこのトークン数に1つ出るようにする
+
+# 文の終わり（句点・感嘆符・疑問符・改行）の直後で分ける
+_SENTENCE_END = re.compile(r"(?<=[。！？!?\n])")
+
+def estimate_tokens(text):
+    """トークン数の目安（英数字は4文字で1トークン、日本語などは1文字1トークン）"""
+    ascii_chars = sum(1 for c in text if c < "\x80")
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+def _split_units(text, max_tokens):
+    """文ごとに分ける（1文が max_tokens を超えるときは、さらに文字数で切る）"""
+    for sentence in _SENTENCE_END.split(text):
+        if not sentence:
+            continue
+        if estimate_tokens(sentence) <= max_tokens:
+            yield sentence
+            continue
+        step = max(1, max_tokens)
+        for i in range(0, len(sentence), step):
+            yield sentence[i:i + step]
+
+def _is_cut_point(sentence, tokens):
+    """
+    文のハッシュで区切ってよい文かを決める（長い文ほど選ばれやすく、文の長さによらず平均 CUT_AVERAGE_TOKENS に1つ）。
+    区切りがまばらなので、途中に文章が足されても、すぐ後ろの区切りから前と同じかたまりに戻る
+    """
+    return int(hashlib.md5(sentence.encode()).hexdigest()[:8], 16) < 0x100000000 * tokens / CUT_AVERAGE_TOKENS
+
+def split_chunks(text, max_tokens=DEFAULT_MAX_CHUNK_TOKENS, min_tokens=DEFAULT_MIN_CHUNK_TOKENS):
+    """
+    文章をかたまりに分ける。かたまりは文の切れ目で終わり、大きさは min_tokens〜max_tokens。
+    min_tokens を超えたあとは「ハッシュが区切りの条件に合う文」の後ろで切るので、
+    区切りは文の中身で決まり、前の方の文章が変わっても後ろの区切りは同じになる
+    """
+    chunks = []
+    current = []
+    size = 0
+    for sentence in _split_units(text, max_tokens):
+        tokens = estimate_tokens(sentence)
+        if current and size + tokens > max_tokens:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += tokens
+        if size >= min_tokens and _is_cut_point(sentence, tokens):
+            chunks.append("".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+def build_map_prompt(chunk, summary_chars):
+    return f"""
+    以下は長い資料の一部です。ラジオ番組の台本の材料にするため、
+    重要な事実・数字・日付・固有名詞を落とさずに、{summary_chars}文字以内で要約してください。
+    前置きや感想は書かず、要約だけを書くこと。
+
+    【資料の一部】
+    {chunk}
+    """
+
+def build_reduce_prompt(summaries, summary_chars):
+    return f"""
+    以下は長い資料の各部分の要約です。重複をまとめ、資料全体の流れがわかるように
+    重要な事実・数字・日付・固有名詞を残して、{summary_chars}文字以内の1つの要約にしてください。
+    前置きや感想は書かず、要約だけを書くこと。
+
+    【部分ごとの要約】
+    {summaries}
+    """
+
+class SummaryCache:
+    """
+    要約のディスクキャッシュ（キーは Summarizer が作る。かたまりの要約なら、かたまりの中身とモデルのハッシュ）。
+    合計サイズが max_bytes を超えると古い順（LRU）に消す
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> サイズ（古い順）
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def _load_index(self):
+        """起動時にディスク上のファイルを更新日時順に読み込む"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".txt"):
+                continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            files.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                text = f.read()
+            os.utime(self._path(key)) # 再起動後もLRUの順番が保たれるように
+        except OSError:
+            with self._lock:
+                if key in self._entries:
+                    self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key, text):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{random.getrandbits(32)}.tmp"
+        data = text.encode("utf-8")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Summary cache write error: {e}")
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+def _is_rate_limit_error(e):
+    """Geminiのレート制限エラー(429 / ResourceExhausted)かどうか"""
+    if type(e).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    return getattr(e, "code", None) == 429 or getattr(e, "status_code", None) == 429
+
+class Summarizer:
+    """
+    長い資料を map-reduce で要約する役（generate_content を持つモデルなら何でもよい）。
+    同じ condense(text, trace) を持つオブジェクトなら何でも RadioPipeline に差し込める
+    """
+
+    def __init__(self, model, model_name="", cache=None, max_workers=DEFAULT_MAX_WORKERS,
+                 target_chars=DEFAULT_TARGET_CHARS, max_chunk_tokens=DEFAULT_MAX_CHUNK_TOKENS,
+                 summary_chars=DEFAULT_SUMMARY_CHARS):
+        self.model = model
+        self.model_name = model_name
+        self.cache = cache
+        self.max_workers = max_workers
+        self.target_chars = target_chars
+        self.max_chunk_tokens = max_chunk_tokens
+        self.summary_chars = summary_chars
+
+    def fingerprint(self):
+        """要約の作り方の指紋（台本キャッシュのキーに混ぜる）"""
+        template = build_map_prompt("", self.summary_chars) + build_reduce_prompt("", self.summary_chars)
+        unique_string = (f"{SUMMARY_VERSION}\n{self.model_name}\n{self.target_chars}\n"
+                         f"{self.max_chunk_tokens}\n{template}")
+        return hashlib.sha256(unique_string.encode()).hexdigest()[:16]
+
+    def _generate(self, prompt):
+        attempt = 0
+        while True:
+            try:
+                return self.model.generate_content(prompt).text.strip()
+            except Exception as e:
+                if attempt >= DEFAULT_MAX_RETRIES or not _is_rate_limit_error(e):
+                    raise
+                wait = DEFAULT_BACKOFF * (2 ** attempt) + random.uniform(0, DEFAULT_BACKOFF)
+                print(f"Rate limited (summary), retry in {wait:.1f}s")
+                time.sleep(wait)
+                attempt += 1
+
+    def _map_key(self, chunk):
+        """かたまりの要約のキャッシュキー（かたまりの位置は入れない）"""
+        unique_string = f"{SUMMARY_VERSION}\nmap\n{self.model_name}\n{self.summary_chars}\n{chunk}"
+        return hashlib.sha256(unique_string.encode()).hexdigest()
+
+    def _summarize(self, prompt, trace, span_name, key=None, **attrs):
+        """プロンプト1つぶんを要約する（キャッシュにあればそれを使う。key が無ければプロンプトから作る）"""
+        with tracing.span(trace, span_name, **attrs) as span:
+            if self.cache is not None:
+                if key is None:
+                    key = hashlib.sha256(f"{SUMMARY_VERSION}\n{self.model_name}\n{prompt}".encode()).hexdigest()
+                cached = self.cache.get(key)
+                if cached is not None:
+                    span.set(cached=True)
+                    return cached
+            summary = self._generate(prompt)
+            span.set(cached=False, chars=len(summary))
+        if self.cache is not None and summary:
+            self.cache.put(key, summary)
+        return summary
+
+    def _map(self, prompts, trace, span_name, keys=None):
+        """プロンプトを並列に要約して、順番どおりのリストで返す（同時に投げるのは max_workers まで）"""
+        keys = keys or [None] * len(prompts)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="summary") as pool:
+            futures = [pool.submit(self._summarize, prompt, trace, span_name, key=key, part=i + 1)
+                       for i, (prompt, key) in enumerate(zip(prompts, keys))]
+            return [future.result() for future in futures]
+
+    def condense(self, text, trace=None):
+        """text を target_chars 文字以内の要約にする（もともと短ければそのまま返す）"""
+        if len(text) <= self.target_chars:
+            return text
+        chunks = split_chunks(text, self.max_chunk_tokens)
+        print(f"Long source: {len(text)} chars -> {len(chunks)} chunks")
+        summaries = self._map([build_map_prompt(c, self.summary_chars) for c in chunks], trace, "summarize_map",
+                              keys=[self._map_key(c) for c in chunks])
+
+        # 要約をつなげても長すぎるときは、いくつかずつまとめて要約し直す
+        for _ in range(MAX_REDUCE_ROUNDS):
+            joined = "\n\n".join(summaries)
+            if len(joined) <= self.target_chars or len(summaries) == 1:
+                break
+            groups = []
+            current = []
+            for summary in summaries:
+                if current and len("\n\n".join(current + [summary])) > self.target_chars:
+                    groups.append(current)
+                    current = []
+                current.append(summary)
+            groups.append(current)
+            if len(groups) == 1:
+                summaries = [self._summarize(build_reduce_prompt("\n\n".join(groups[0]), self.target_chars),
+                                             trace, "summarize_reduce")]
+                break
+            summaries = self._map([build_reduce_prompt("\n\n".join(g), self.summary_chars * 2)
+                                   for g in groups], trace, "summarize_reduce")
+        return "\n\n".join(summaries)[:self.target_chars]
@@ -0,0 +1,9 @@
+"""
+テストの共通設定（リポジトリ直下のモジュールと fakes.py を読み込めるようにする）
+
+外部APIには出ず、fakes.py のフェイクで動かす。MP3やPCMを扱うテストには ffmpeg が必要
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,33 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py が読み込む自前のモジュール
+APP_MODULES = ["audio_mixer", "audio_post", "ephemeral_audio", "tts_cache", "script_writer", "summarizer",
+               "sources", "radio_store", "pipeline", "job_queue", "pdf_ingest", "fetcher", "tracing"]
+# 使うときまで読み込まないもの
+LAZY_MODULES = ["openai", "yt_dlp", "firebase_admin", "google.generativeai", "PyPDF2", "bs4",
+                "youtube_transcript_api"]
+
+
+def test_app_modules_do_not_import_heavy_clients():
+    code = (f"import importlib, json, sys\n"
+            f"for name in {APP_MODULES!r}:\n"
+            f"    importlib.import_module(name)\n"
+            f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))")
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    assert json.loads(out.strip().splitlines()[-1]) == []
+
+
+def test_app_runs_and_reruns():
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.secrets["GEMINI_API_KEY"] = "dummy"
+    at.secrets["OPENAI_API_KEY"] = "dummy"
+    at.run()
+    assert not at.exception
+    at.run()
+    assert not at.exception
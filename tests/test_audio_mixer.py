@@ -0,0 +1,130 @@
+import tempfile
+import threading
+
+import pytest
+
+import audio_mixer
+import pipeline
+from fakes import FakeTTSClient, RateLimitError, dominant_freq, make_script, tone_mp3
+
+
+def test_synthesized_lines_keep_script_order():
+    script = make_script(20)
+    client = FakeTTSClient(latency=0.01, content=b"ID3")
+    results = list(audio_mixer.iter_synthesized(script, client, max_workers=8))
+    assert [item for item, _ in results] == script
+    assert client.max_in_flight > 1
+
+
+def test_rate_limited_lines_are_retried_in_order():
+    script = make_script(20)
+    client = FakeTTSClient(latency=0.0, content=b"ID3", fail_every=3)
+    results = list(audio_mixer.iter_synthesized(script, client, max_workers=4))
+    assert [item for item, _ in results] == script
+    assert all(audio == b"ID3" for _, audio in results)
+    assert client.rate_limited > 0
+    assert client.calls == len(script) + client.rate_limited
+
+
+def test_always_rate_limited_gives_up_after_max_retries():
+    client = FakeTTSClient(latency=0.0, content=b"ID3", fail_every=1)
+    with pytest.raises(RateLimitError):
+        audio_mixer.synthesize_line(client, "nova", "テスト", max_retries=2, backoff=0.01)
+    assert client.calls == 3
+
+
+def test_concurrent_renders_do_not_mix():
+    # 番組Aは440Hz、番組Bは880Hzの音だけでできている
+    programs = {"A": (440, 3), "B": (880, 6)}
+    outputs = {}
+
+    def render(name):
+        freq, lines = programs[name]
+        client = FakeTTSClient(latency=0.01, content=tone_mp3(freq))
+        outputs[name] = audio_mixer.combine_audio_with_ma(make_script(lines), client, max_workers=4)
+
+    threads = [threading.Thread(target=render, args=(name,)) for name in programs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert outputs["A"] != outputs["B"]
+    for name, (freq, lines) in programs.items():
+        pcm = audio_mixer.decode_mp3(outputs[name])
+        seconds = len(pcm) / audio_mixer.ms_to_bytes(1000)
+        # 無音の「間」があるので、音の高さは実際より少し低めに出る
+        measured = dominant_freq(pcm) * seconds / lines
+        assert seconds >= lines
+        assert abs(measured - freq) < freq * 0.1, (name, measured)
+
+
+@pytest.mark.parametrize("name", list(audio_mixer.RENDITIONS))
+def test_renditions_decode_to_program_length(name):
+    pcm = audio_mixer.decode_mp3(tone_mp3(440, 3000))
+    path = tempfile.mktemp(suffix="." + audio_mixer.RENDITIONS[name]["ext"])
+    with open(path, "wb") as f:
+        audio_mixer.encode_rendition_to(pcm, f, name)
+    decoded = audio_mixer._ffmpeg(["-i", path] + audio_mixer._PCM_ARGS + ["-acodec", "pcm_s16le", "pipe:1"], b"")
+    assert abs(len(decoded) - len(pcm)) < audio_mixer.ms_to_bytes(200)
+
+
+AGENTS = {
+    "iPhone Safari": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 "
+                     "Version/17.0 Mobile/15E148 Safari/604.1",
+    "Android Chrome": "Mozilla/5.0 (Linux; Android 14) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36",
+    "Firefox": "Mozilla/5.0 (Windows NT 10.0; rv:121.0) Gecko/20100101 Firefox/121.0",
+}
+
+
+@pytest.mark.parametrize("label, expected", [("iPhone Safari", "aac"), ("Android Chrome", "opus"),
+                                             ("Firefox", "opus")])
+def test_pick_rendition_chooses_smallest_playable(label, expected):
+    # Safari は Ogg の Opus を再生できない
+    renditions = {"mp3": {"bytes": 1000}, "mp3_low": {"bytes": 500}, "opus": {"bytes": 200}, "aac": {"bytes": 300}}
+    assert audio_mixer.pick_rendition(renditions, AGENTS[label]) == expected
+
+
+def test_pick_rendition_falls_back_to_mp3():
+    assert audio_mixer.pick_rendition({"mp3": {}}, AGENTS["iPhone Safari"]) == "mp3"
+
+
+def test_parse_renditions_accepts_list_or_comma_separated():
+    assert audio_mixer.parse_renditions("mp3, opus") == audio_mixer.parse_renditions(["mp3", "opus"])
+
+
+def test_unknown_rendition_is_rejected_before_tts():
+    with pytest.raises(ValueError):
+        pipeline.RadioPipeline(fetcher=None, writer=None, tts_client=None, renditions="mp3,flac")
+
+
+class _FailingWriter:
+    """何回か書いたところで失敗する書き込み先（アップロードが途中で切れた場合の代わり）"""
+
+    def __init__(self, fail_after=1):
+        self.fail_after = fail_after
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        if self.writes > self.fail_after:
+            raise OSError("upload failed")
+        return len(data)
+
+
+def test_failing_writer_stops_encoder_instead_of_hanging():
+    # 数分の番組：ffmpeg の出力がパイプに溜まりきるくらい大きい
+    pcm = b"\x01\x00" * (audio_mixer.FRAME_RATE * 300)
+    result = []
+
+    def encode():
+        try:
+            audio_mixer.encode_pcm_to(pcm, _FailingWriter(), format="wav", chunk_size=4096)
+        except OSError as e:
+            result.append(e)
+
+    thread = threading.Thread(target=encode, daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), "エンコードが止まったまま戻ってきません"
+    assert len(result) == 1
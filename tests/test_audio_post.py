@@ -0,0 +1,52 @@
+import random
+
+import numpy as np
+import pytest
+
+import audio_mixer
+import audio_post
+from fakes import VOICE_LEVELS, speech_like_pcm, voice_spread
+
+
+def _assemble(post, seconds=60):
+    """iter_program_parts と同じ順番で組み立てて (番組, [(声, 始まり, 終わり)]) を返す"""
+    rng = np.random.default_rng(0)
+    random.seed(0)
+    voices = list(VOICE_LEVELS)
+    program = audio_mixer.PcmBuffer(seconds * 1000 + 10000)
+    program.append_silence(500)
+    lines = []
+    gap_start = 0
+    while len(program) < audio_mixer.ms_to_bytes(seconds * 1000):
+        voice = voices[len(lines) % len(voices)]
+        if lines:
+            gap_start = len(program)
+            program.append_silence(audio_mixer.create_silence(300, 800))
+        line_start = len(program)
+        program.append_pcm(speech_like_pcm(rng, VOICE_LEVELS[voice], rng.uniform(2, 6)))
+        lines.append((voice, line_start, len(program)))
+        if post is not None:
+            post.process_line(program, gap_start, line_start, len(program))
+    if post is not None:
+        post.finish(program)
+    return program, lines
+
+
+def _peak_db(program):
+    data = np.frombuffer(program.slice(), dtype=np.int16).astype(np.int32)
+    return 20 * np.log10(max(np.max(np.abs(data)), 1) / 32768)
+
+
+def test_normalize_evens_out_voices():
+    raw, lines = _assemble(None)
+    assert voice_spread(raw, lines) > 5
+    program, lines = _assemble(audio_post.PostProcessor())
+    assert voice_spread(program, lines) < 1.0
+
+
+@pytest.mark.parametrize("with_bgm", [False, True])
+def test_limiter_keeps_peaks_under_limit(with_bgm):
+    bgm = speech_like_pcm(np.random.default_rng(1), -12.0, 7.3) if with_bgm else None
+    post = audio_post.PostProcessor(bgm=bgm)
+    program, _ = _assemble(post)
+    assert _peak_db(program) <= post.limit_db + 0.01
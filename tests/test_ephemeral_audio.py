@@ -0,0 +1,84 @@
+import http.client
+import random
+import time
+
+import pytest
+
+import ephemeral_audio
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def store():
+    return ephemeral_audio.EphemeralAudioStore(max_bytes=MB * 5 // 2, max_per_session=2)
+
+
+@pytest.fixture
+def server(store):
+    server = ephemeral_audio.serve(store, 0, host="127.0.0.1")
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def audio():
+    return random.Random(0).randbytes(MB)
+
+
+def _request(server, method, url, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    try:
+        conn.request(method, url, headers=headers or {})
+        res = conn.getresponse()
+        return res.status, dict(res.getheaders()), res.read()
+    finally:
+        conn.close()
+
+
+def test_ranges(store, server, audio):
+    path = store.signed_path(store.put("session-a", audio))
+    status, headers, body = _request(server, "GET", path)
+    assert status == 200 and body == audio and headers["Accept-Ranges"] == "bytes"
+    status, headers, body = _request(server, "GET", path, {"Range": "bytes=0-1"})
+    assert status == 206 and body == audio[:2] and headers["Content-Range"] == f"bytes 0-1/{len(audio)}"
+    status, _, body = _request(server, "GET", path, {"Range": "bytes=-500"})
+    assert status == 206 and body == audio[-500:]
+    status, _, body = _request(server, "GET", path, {"Range": f"bytes={len(audio) - 10}-"})
+    assert status == 206 and body == audio[-10:]
+    status, headers, _ = _request(server, "GET", path, {"Range": f"bytes={len(audio)}-"})
+    assert status == 416 and headers["Content-Range"] == f"bytes */{len(audio)}"
+    status, headers, body = _request(server, "HEAD", path)
+    assert status == 200 and body == b"" and int(headers["Content-Length"]) == len(audio)
+
+
+def test_signature_is_required(store, server, audio):
+    key = store.put("session-a", audio)
+    path = store.signed_path(key)
+    assert _request(server, "GET", path.replace("sig=", "sig=0"))[0] == 403
+    assert _request(server, "GET", f"/audio/{key}")[0] == 403
+
+
+def test_session_and_total_limits_evict_oldest(store, server, audio):
+    first = store.put("session-a", audio)
+    path = store.signed_path(first)
+    keys = [store.put("session-b", audio) for _ in range(3)]
+    assert store.get(keys[0]) is None and store.get(keys[2]) is not None
+    assert store.get(first) is None # 全体の上限で一番古い session-a のものが消えた
+    assert _request(server, "GET", path)[0] == 404
+
+
+def test_expired_audio_is_gone():
+    short = ephemeral_audio.EphemeralAudioStore(ttl=0.2)
+    key = short.put("s", b"x" * 10)
+    path = short.signed_path(key)
+    assert path is not None # 置いた直後に期限切れにならない（期限は秒に切り上げる）
+    time.sleep(short.get(key)["expires_at"] - time.time() + 0.1)
+    assert short.get(key) is None
+    assert not short.verify(key, *[v.split("=")[1] for v in path.split("?")[1].split("&")])
+
+
+def test_shared_audio_does_not_count_against_sessions(store):
+    parts = [store.put(None, b"x" * 10, key=f"part-{i}") for i in range(5)]
+    store.put("session-a", b"y" * 10)
+    assert all(store.get(key) is not None for key in parts)
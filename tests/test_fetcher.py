@@ -0,0 +1,49 @@
+import pytest
+
+import fetcher
+from fakes import StubHTTPServer
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = StubHTTPServer()
+    yield server
+    server.close()
+
+
+def test_cache_paths(server, tmp_path):
+    cache = fetcher.SourceContentCache(str(tmp_path))
+    url = f"{server.url}/article"
+    assert fetcher.fetch_url(url, cache=cache)["status"] == "miss"
+    assert fetcher.fetch_url(url + "#top", cache=cache)["status"] == "hit"
+    assert fetcher.fetch_url(url, cache=cache, max_age=0)["status"] == "revalidated"
+    server.version += 1
+    page = fetcher.fetch_url(url, cache=cache, max_age=0)
+    assert page["status"] == "miss" and f"版{server.version}" in page["text"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["revalidated"], stats["misses"]) == (1, 1, 2)
+
+
+def test_cache_evicts_least_recently_used_over_cap(tmp_path):
+    body = b"x" * 1000
+    cache = fetcher.SourceContentCache(str(tmp_path), max_bytes=2500)
+    cache.put("https://example.jp/a", {}, body)
+    cache.put("https://example.jp/b", {}, body)
+    assert cache.get("https://example.jp/a") is not None # a を最近使ったので、次に消えるのは b
+    cache.put("https://example.jp/c", {}, body)
+    assert cache.get("https://example.jp/b") is None
+    assert cache.get("https://example.jp/a") is not None and cache.get("https://example.jp/c") is not None
+    assert cache.stats()["bytes"] <= 2500 and len(list(tmp_path.iterdir())) == 4
+    # 作り直しても、ディスクに残った分を数えて上限を守る
+    assert fetcher.SourceContentCache(str(tmp_path), max_bytes=1500).stats()["entries"] == 1
+
+
+def test_meta_charset_is_detected(server):
+    page = fetcher.fetch_url(f"{server.url}/sjis")
+    assert page["encoding"] == "shift_jis"
+    assert "岡山市" in page["text"]
+
+
+def test_large_page_is_truncated(server):
+    page = fetcher.fetch_url(f"{server.url}/big", max_bytes=64 * 1024)
+    assert len(page["text"]) == 64 * 1024
@@ -0,0 +1,51 @@
+import threading
+
+import job_queue
+
+
+def _wait(job):
+    version = -1
+    while not job.finished:
+        version = job.wait(version)
+
+
+def test_same_program_runs_once():
+    runs = []
+    release = threading.Event()
+
+    def run_job(job):
+        runs.append(job.key)
+        release.wait(5) # 全員が頼み終わるまで終わらせない
+        for stage in ("fetch", "record", "save"):
+            job.set_stage(stage)
+        return {"from_cache": False}
+
+    queue = job_queue.JobQueue(max_concurrent=2)
+    submitted = [queue.submit(f"program{i % 3}", run_job) for i in range(12)]
+    release.set()
+    for job, _ in submitted:
+        _wait(job)
+    assert sorted(runs) == ["program0", "program1", "program2"]
+    assert sum(1 for _, created in submitted if created) == 3
+    assert all(job.status == "done" for job, _ in submitted)
+
+
+def test_private_jobs_are_not_shared():
+    queue = job_queue.JobQueue(max_concurrent=2)
+    first = queue.submit_private(lambda job: {"from_cache": False})
+    second = queue.submit_private(lambda job: {"from_cache": False})
+    assert first is not second
+    for job in (first, second):
+        _wait(job)
+
+
+def test_drop_audio_keeps_timings_but_not_bytes():
+    def run_job(job):
+        job.add_part(b"part")
+        return {"from_cache": False, "audio": b"audio", "title": "t"}
+
+    job = job_queue.JobQueue().submit_private(run_job)
+    _wait(job)
+    job.drop_audio()
+    assert job.result == {"from_cache": False, "audio": None, "title": "t"}
+    assert [part for part, _ in job.parts] == [None] and job.parts[0][1] >= 0
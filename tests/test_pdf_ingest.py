@@ -0,0 +1,44 @@
+from io import BytesIO
+
+import pytest
+
+import pdf_ingest
+from fakes import make_pdf
+
+
+def _legacy_text(data, max_chars):
+    """以前の読み方（全ページを += でつないでから切る）"""
+    import PyPDF2
+    reader = PyPDF2.PdfReader(BytesIO(data))
+    text = ""
+    for page in reader.pages:
+        text += page.extract_text()
+    return text if max_chars is None else text[:max_chars]
+
+
+@pytest.fixture(scope="module")
+def pdf():
+    return make_pdf(30)
+
+
+@pytest.mark.parametrize("max_chars", [5000, None])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_extracted_text_matches_legacy_reader(pdf, max_chars, workers):
+    assert pdf_ingest.extract_pdf_text(pdf, max_chars=max_chars, max_workers=workers) == _legacy_text(pdf, max_chars)
+
+
+def test_reupload_is_served_from_cache(pdf, tmp_path):
+    cache = pdf_ingest.PdfTextCache(str(tmp_path))
+    first = pdf_ingest.read_pdf(BytesIO(pdf), cache=cache)
+    assert pdf_ingest.read_pdf(BytesIO(pdf), cache=cache) == first
+    assert cache.hits == 1
+
+
+def test_cache_evicts_least_recently_used_over_cap(tmp_path):
+    cache = pdf_ingest.PdfTextCache(str(tmp_path), max_bytes=2500)
+    cache.put("a", "あ" * 300) # 900バイト
+    cache.put("b", "い" * 300)
+    assert cache.get("a") is not None
+    cache.put("c", "う" * 300)
+    assert cache.get("b") is None and cache.get("a") == "あ" * 300 and cache.get("c") is not None
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.txt", "c.txt"]
@@ -0,0 +1,61 @@
+import pytest
+
+import pipeline
+import script_writer
+from fakes import FakeGeminiModel, FakeTTSClient, InMemoryRadioStore, StubFetcher
+
+
+@pytest.fixture
+def batch():
+    store = InMemoryRadioStore()
+    source_fetcher = StubFetcher()
+    gemini = FakeGeminiModel(4, line_latency=0.0)
+    tts = FakeTTSClient(latency=0.0)
+    radio_pipeline = pipeline.RadioPipeline(
+        fetcher=source_fetcher,
+        writer=script_writer.GeminiScriptWriter(gemini),
+        tts_client=tts,
+        store=store,
+        max_workers=4,
+    )
+    requests = [
+        pipeline.RadioRequest(f"https://example.go.jp/page{i}", style, "日本語")
+        for i in range(2) for style in ("standard", "jk")
+    ]
+
+    def run():
+        """バッチを1回流して (キャッシュから返した数, Geminiの呼び出し回数, TTSの呼び出し回数) を返す"""
+        gemini_calls, tts_calls = gemini.calls, tts.calls
+        results = radio_pipeline.run_batch(requests, jobs=2)
+        assert [e for _, _, e in results if e is not None] == []
+        cached = sum(1 for _, r, _ in results if r["from_cache"])
+        return cached, gemini.calls - gemini_calls, tts.calls - tts_calls
+
+    return store, source_fetcher, requests, run
+
+
+def test_cold_run_writes_every_script(batch):
+    _, _, requests, run = batch
+    # フェイクのGeminiは資料によらず同じ台本を書くので、音声は資料をまたいで使い回されうる
+    assert run()[:2] == (0, len(requests))
+
+
+def test_warm_run_calls_nothing(batch):
+    _, _, requests, run = batch
+    run()
+    assert run() == (len(requests), 0, 0)
+
+
+def test_dropped_audio_reuses_scripts(batch):
+    store, _, _, run = batch
+    run()
+    store.docs.clear()
+    _, gemini_calls, tts_calls = run()
+    assert gemini_calls == 0 and tts_calls > 0
+
+
+def test_changed_source_rewrites_scripts(batch):
+    _, source_fetcher, requests, run = batch
+    run()
+    source_fetcher.version += 1
+    assert run()[1] == len(requests)
@@ -0,0 +1,127 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import audio_mixer
+import pipeline
+import radio_store
+import script_writer
+from fakes import FakeBucket, FakeFirestore, FakeGeminiModel, FakeTTSClient, StubFetcher, tone_mp3, wait_until
+
+PROGRAMS = 200
+
+
+@pytest.fixture
+def db():
+    db = FakeFirestore(latency=0.0)
+    now = datetime.now(timezone.utc)
+    styles = ["standard", "jk", "comedian"]
+    languages = ["日本語", "英語"]
+    for i in range(PROGRAMS):
+        db.collection('radios').docs[f"key{i}"] = {
+            # PDF の source は 'pdf:...'。古い番組は「ファイル名 + 大きさ」のまま
+            'source': (f"pdf:{i}" if i % 10 == 0 else f"社内資料{i}.pdf{i * 1000}" if i % 5 == 0
+                       else f"https://example.go.jp/{i}"),
+            'style': styles[i % 3], 'language': languages[i % 2], 'title': f"番組{i}",
+            'audio_url': f"memory://audio/key{i}.mp3",
+            'created_at': now - timedelta(hours=i),
+        }
+    return db
+
+
+@pytest.fixture
+def index(db):
+    index = radio_store.RadioIndex(db, listen=True).start()
+    yield index
+    index.stop()
+
+
+def test_index_lookups_match_firestore_without_reads(db, index):
+    keys = [f"key{random.Random(0).randrange(PROGRAMS * 2)}" for _ in range(50)]
+    plain = radio_store.FirebaseRadioStore(db, FakeBucket())
+    expected = [plain.get(key) is not None for key in keys]
+    store = radio_store.FirebaseRadioStore(db, FakeBucket(), index=index)
+    reads = db.reads
+    assert [store.get(key) is not None for key in keys] == expected
+    assert db.reads == reads
+
+
+def test_index_sees_other_processes_and_own_saves(db, index):
+    db.collection('radios').document("from-other-process").set({
+        'source': "https://example.go.jp/x", 'style': "jk", 'language': "日本語", 'title': "別プロセス",
+        'audio_url': "memory://x", 'created_at': datetime.now(timezone.utc)})
+    assert wait_until(lambda: index.get("from-other-process") is not None)
+    # このプロセスで保存した番組は、通知を待たずにすぐ引ける
+    store = radio_store.FirebaseRadioStore(db, FakeBucket(), index=index)
+    store.save("saved-here", b"ID3", "https://example.go.jp/y", "standard", "英語", "ここで保存")
+    assert store.get("saved-here") is not None
+
+
+def test_library_pages_list_web_sources_newest_first(db, index):
+    docs = db.collection('radios').docs
+    since = datetime.now(timezone.utc) - timedelta(hours=PROGRAMS // 2)
+    expected = [k for k, d in sorted(docs.items(), key=lambda kv: kv[1]['created_at'], reverse=True)
+                if d['style'] == "jk" and d['language'] == "日本語" and d['created_at'] >= since
+                and d['source'].startswith("https://")]
+    seen, offset = [], 0
+    while True:
+        page, total = index.query(style="jk", language="日本語", since=since, kind="url", offset=offset, limit=10)
+        if not page:
+            break
+        seen += [item['cache_key'] for item in page]
+        offset += len(page)
+    assert seen == expected and total == len(expected)
+
+
+def test_ttl_index_falls_back_and_refreshes(db):
+    index = radio_store.RadioIndex(db, listen=False, ttl=0.2).start()
+    store = radio_store.FirebaseRadioStore(db, FakeBucket(), index=index)
+    db.collection('radios').document("after-ttl-load").set({'title': "後から", 'audio_url': "memory://y",
+                                                            'created_at': datetime.now(timezone.utc)})
+    assert index.get("after-ttl-load") is None and store.get("after-ttl-load") is not None
+    assert wait_until(lambda: index.get("after-ttl-load") is not None, timeout=3.0)
+
+
+def test_cached_run_reads_nothing_with_index():
+    db = FakeFirestore(latency=0.0)
+    index = radio_store.RadioIndex(db, listen=True).start()
+    request = pipeline.RadioRequest("https://example.go.jp/cached", "standard", "日本語")
+
+    def run_once(store):
+        radio_pipeline = pipeline.RadioPipeline(
+            fetcher=StubFetcher(),
+            writer=script_writer.GeminiScriptWriter(FakeGeminiModel(3, line_latency=0.0)),
+            tts_client=FakeTTSClient(latency=0.0),
+            store=store,
+        )
+        reads = db.reads
+        result = radio_pipeline.run(request)
+        return result, db.reads - reads
+
+    try:
+        first, _ = run_once(radio_store.FirebaseRadioStore(db, FakeBucket(), index=index))
+        assert not first["from_cache"]
+        result, reads = run_once(radio_store.FirebaseRadioStore(db, FakeBucket()))
+        assert result["from_cache"] and reads == 2 # scripts と radios を1回ずつ
+        result, reads = run_once(radio_store.FirebaseRadioStore(db, FakeBucket(), index=index))
+        assert result["from_cache"] and reads == 0 and result["cache_key"] == first["cache_key"]
+    finally:
+        index.stop()
+
+
+def test_streamed_upload_matches_one_shot_mp3():
+    pcm = audio_mixer.decode_mp3(tone_mp3(440, 20000))
+    legacy = audio_mixer.export_mp3(pcm)
+    bucket = FakeBucket(fail_every=3)
+    store = radio_store.FirebaseRadioStore(FakeFirestore(latency=0.0), bucket)
+    names = tuple(audio_mixer.RENDITIONS)
+    uploaded = store.save("program", lambda name, out: audio_mixer.encode_rendition_to(pcm, out, name),
+                          "https://example.go.jp/", "standard", "日本語", "テスト", renditions=names)
+    assert uploaded["mp3"]["bytes"] == len(legacy)
+    for name in names:
+        blob = bucket.blobs[f"audio/program.{audio_mixer.RENDITIONS[name]['ext']}"]
+        assert uploaded[name]["bytes"] == blob.size
+    # 送り直しは失敗した塊だけで、手元に溜めるのは塊1つぶんまで
+    assert bucket.retried_chunks > 0
+    assert bucket.peak_buffer <= radio_store.UPLOAD_CHUNK_SIZE + audio_mixer.ENCODE_CHUNK_SIZE
@@ -0,0 +1,15 @@
+import audio_mixer
+import script_writer
+from fakes import FakeGeminiModel, FakeTTSClient
+
+
+def test_streamed_script_matches_full_script_in_order():
+    model = FakeGeminiModel(12, line_latency=0.0)
+    script = script_writer.parse_script(model.generate_content("").text, "onyx", "nova")
+
+    parser = script_writer.ScriptLineParser("onyx", "nova")
+    items = script_writer.iter_script_items(script_writer.stream_script(model, ""), parser)
+    client = FakeTTSClient(latency=0.01, content=b"ID3")
+    results = list(audio_mixer.iter_synthesized(items, client, max_workers=4))
+    assert [item for item, _ in results] == script
+    assert len(script) == 12
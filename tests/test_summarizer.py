@@ -0,0 +1,93 @@
+from io import BytesIO
+
+import pytest
+
+import pdf_ingest
+import pipeline
+import script_writer
+import sources
+import summarizer
+import tracing
+from fakes import FakeGeminiModel, FakeSummaryModel, FakeTTSClient, make_pdf
+
+PAGES = 80
+
+
+@pytest.fixture(scope="module")
+def text():
+    return pdf_ingest.extract_pdf_text(make_pdf(PAGES), max_chars=None, max_workers=1)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_condense_respects_worker_limit_and_target(text, workers):
+    model = FakeSummaryModel(latency=0.01)
+    summary = summarizer.Summarizer(model, max_workers=workers).condense(text)
+    assert len(summary) <= summarizer.DEFAULT_TARGET_CHARS
+    assert model.max_in_flight <= workers
+    assert model.calls >= len(summarizer.split_chunks(text))
+
+
+@pytest.fixture
+def condenser(text, tmp_path):
+    model = FakeSummaryModel(latency=0.0)
+    condenser = summarizer.Summarizer(model, cache=summarizer.SummaryCache(str(tmp_path)), max_workers=4)
+    condenser.condense(text)
+    return condenser, model
+
+
+def _remapped(condenser, text, new_text):
+    """new_text を要約し直して (LLMに投げ直したかたまりの数, 前に無かったかたまりの数) を返す"""
+    before = set(summarizer.split_chunks(text))
+    changed = {c for c in summarizer.split_chunks(new_text) if c not in before}
+    trace = tracing.Trace("rerun")
+    condenser.condense(new_text, trace=trace)
+    map_calls = sum(1 for sp in trace.spans if sp.name == "summarize_map" and not sp.attrs.get("cached"))
+    return map_calls, len(changed)
+
+
+def test_rerun_calls_nothing(text, condenser):
+    condenser, model = condenser
+    calls = model.calls
+    first = condenser.condense(text)
+    assert condenser.condense(text) == first and model.calls == calls
+
+
+def test_one_page_edit_remaps_only_changed_chunks(text, condenser):
+    condenser, _ = condenser
+    page = PAGES // 2
+    edited = text.replace(f"Page {page} line 7:", f"Page {page} line 7 (revised):")
+    assert edited != text
+    map_calls, changed = _remapped(condenser, text, edited)
+    assert map_calls == changed <= 2
+
+
+def test_inserted_text_keeps_later_chunks(text, condenser):
+    # 途中にかたまり1つぶんくらいの文章を足す：かたまりの数と位置がずれても、ほかの要約は使い回す
+    condenser, _ = condenser
+    marker = f"Page {PAGES // 2} line 1:"
+    assert marker in text
+    inserted = "".join(f"Inserted line {i}: new findings about item {i} were added.\n" for i in range(300))
+    map_calls, changed = _remapped(condenser, text, text.replace(marker, inserted + marker, 1))
+    assert map_calls == changed <= 4 # 足した文章と、その前後のかたまりだけ
+
+
+def test_cache_keeps_total_under_cap(text, tmp_path):
+    cache = summarizer.SummaryCache(str(tmp_path), max_bytes=4000)
+    condenser = summarizer.Summarizer(FakeSummaryModel(latency=0.0), cache=cache, max_workers=4)
+    condenser.condense(text)
+    assert sum(p.stat().st_size for p in tmp_path.iterdir()) <= 4000
+    assert len(list(tmp_path.iterdir())) < len(summarizer.split_chunks(text))
+
+
+def test_long_document_is_summarized_before_the_script():
+    trace = tracing.Trace("summarize")
+    radio_pipeline = pipeline.RadioPipeline(
+        fetcher=sources.SourceFetcher(),
+        writer=script_writer.GeminiScriptWriter(FakeGeminiModel(4, line_latency=0.0)),
+        tts_client=FakeTTSClient(latency=0.0),
+        summarizer=summarizer.Summarizer(FakeSummaryModel(latency=0.0), max_workers=4),
+    )
+    request = pipeline.RadioRequest.for_pdf(BytesIO(make_pdf(PAGES)), "report.pdf", long_document=True)
+    result = radio_pipeline.run(request, trace=trace)
+    assert result["lines"] == 4
+    assert trace.summary()["summarize_map"]["count"] > 1
@@ -0,0 +1,54 @@
+import json
+
+import job_queue
+import pipeline
+import script_writer
+import tracing
+from fakes import FakeGeminiModel, FakeTTSClient, InMemoryRadioStore, StubFetcher
+
+LINES = 6
+
+
+def _run_jobs(programs):
+    radio_pipeline = pipeline.RadioPipeline(
+        fetcher=StubFetcher(),
+        writer=script_writer.GeminiScriptWriter(FakeGeminiModel(LINES, line_latency=0.0)),
+        tts_client=FakeTTSClient(latency=0.0),
+        store=InMemoryRadioStore(),
+        max_workers=4,
+    )
+    queue = job_queue.JobQueue(max_concurrent=2)
+
+    def submit(i):
+        request = pipeline.RadioRequest(f"https://example.go.jp/page{i}", "standard", "日本語")
+        return queue.submit(f"trace-program{i}", lambda job: radio_pipeline.run_job(request, job))[0]
+
+    jobs = [submit(i) for i in range(programs)]
+    for job in jobs:
+        version = -1
+        while not job.finished:
+            version = job.wait(version)
+    assert all(job.status == "done" for job in jobs), [job.error for job in jobs]
+    return jobs
+
+
+def test_otlp_export_has_one_job_root_with_every_stage():
+    expected = {"job", "queue_wait", "run", "fetch", "firestore_read", "gemini", "tts", "decode",
+                "mix", "part_export", "export", "storage_upload", "firestore_write"}
+    for job in _run_jobs(2):
+        otlp = job.trace.to_otlp()
+        spans = otlp["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        assert expected <= {sp["name"] for sp in spans}
+        roots = [sp for sp in spans if not sp["parentSpanId"]]
+        assert [sp["name"] for sp in roots] == ["job"]
+        assert all(sp["parentSpanId"] == roots[0]["spanId"] for sp in spans if sp is not roots[0])
+        assert sum(1 for sp in spans if sp["name"] == "tts") == LINES
+        json.dumps(otlp)
+
+
+def test_prometheus_output_has_stage_and_upload_metrics():
+    _run_jobs(1)
+    text = tracing.render_prometheus()
+    assert 'webradio_stage_duration_seconds_count{stage="tts"}' in text
+    assert "webradio_upload_bytes_total" in text
+    assert tracing.STAGE_SECONDS.count(stage="tts") >= LINES
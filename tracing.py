@@ -0,0 +1,309 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 処理の計測（番組1本の時間がどこで使われているかを見る）
+# ・段階ごとに span（開始・終了・属性）を取り、番組1本ぶんを Trace にまとめる（デバッグ画面のウォーターフォール用）
+# ・span の所要時間はプロセス全体のヒストグラムにも積む（Prometheus のテキスト形式で出せる）
+# ・Trace は OpenTelemetry の OTLP/JSON の形でも書き出せる
+# trace を渡さなくても（None でも）ヒストグラムとカウンターには積まれる
+
+# 所要時間のヒストグラムの区切り（秒）
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# セリフ音声の大きさのヒストグラムの区切り（バイト）
+SIZE_BUCKETS = (4096, 16384, 65536, 262144, 1048576)
+SERVICE_NAME = "webradio"
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{str(v)}"'.replace("\n", " ") for k, v in pairs)
+    return "{" + body + "}"
+
+class Counter:
+    """ラベルごとに足し上げるだけのカウンター"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    """ラベルごとの累積ヒストグラム（Prometheus と同じく le 以下の数を数える）"""
+
+    def __init__(self, name, help_text, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {} # ラベル -> [区切りごとの数, 合計, 件数]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            entry = self._values.get(_label_key(labels))
+            return entry[2] if entry else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._values.items()):
+                for bound, c in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {c}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {n}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {n}")
+        return lines
+
+class Registry:
+    """プロセス全体のメトリクスの置き場所"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text):
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=DURATION_BUCKETS):
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus のテキスト形式（/metrics でそのまま返せる）"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("webradio_stage_duration_seconds", "Duration of each pipeline stage")
+STAGE_ERRORS = REGISTRY.counter("webradio_stage_errors_total", "Pipeline stages that raised")
+TTS_BYTES = REGISTRY.histogram("webradio_tts_line_bytes", "MP3 bytes per synthesized line", SIZE_BUCKETS)
+TTS_CHARS = REGISTRY.counter("webradio_tts_chars_total", "Characters of dialogue by TTS cache result")
+TTS_RETRIES = REGISTRY.counter("webradio_tts_retries_total", "TTS requests retried after rate limiting")
+UPLOAD_BYTES = REGISTRY.counter("webradio_upload_bytes_total", "Bytes uploaded to Firebase Storage")
+
+def render_prometheus():
+    return REGISTRY.render()
+
+class Span:
+    """
+    1つの段階の記録（start / end は UNIX 時刻の秒）。
+    cpu はその段階でこのスレッドが使ったCPU秒（始めたスレッドと終えたスレッドが違うときは None）
+    """
+
+    def __init__(self, name, span_id, parent_id, attrs):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attrs = dict(attrs)
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.end = None
+        self.cpu = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+class Trace:
+    """
+    番組1本ぶんの span の集まり。どのスレッドから span を足してもよい。
+    最初に開いた span（ジョブキューなら job、バッチなら pipeline の run）が根になり、それ以降の span はその子になる
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.trace_id = os.urandom(16).hex()
+        self.created_at = time.time()
+        self._lock = threading.Lock()
+        self._spans = []
+        self._root_id = None
+
+    def start_span(self, name, **attrs):
+        span_id = os.urandom(8).hex()
+        with self._lock:
+            if self._root_id is None:
+                self._root_id = span_id
+                parent_id = None
+            else:
+                parent_id = self._root_id
+            span = Span(name, span_id, parent_id, attrs)
+            self._spans.append(span)
+        return span
+
+    @property
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def summary(self):
+        """段階ごとの {name: {count, total, max, cpu}}（同時に走った span の時間は重ねて足す）"""
+        stages = {}
+        for span in self.spans:
+            entry = stages.setdefault(span.name, {"count": 0, "total": 0.0, "max": 0.0, "cpu": 0.0})
+            entry["count"] += 1
+            entry["total"] += span.duration
+            entry["max"] = max(entry["max"], span.duration)
+            entry["cpu"] += span.cpu or 0.0
+        return stages
+
+    def to_otlp(self):
+        """OTLP/JSON（ExportTraceServiceRequest）の形の dict にする"""
+        def attributes(attrs):
+            out = []
+            for key, value in attrs.items():
+                if isinstance(value, bool):
+                    out.append({"key": key, "value": {"boolValue": value}})
+                elif isinstance(value, int):
+                    out.append({"key": key, "value": {"intValue": str(value)}})
+                elif isinstance(value, float):
+                    out.append({"key": key, "value": {"doubleValue": value}})
+                else:
+                    out.append({"key": key, "value": {"stringValue": str(value)}})
+            return out
+
+        spans = []
+        for span in self.spans:
+            end = span.end if span.end is not None else time.time()
+            spans.append({
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or "",
+                "name": span.name,
+                "kind": 1, # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(int(span.start * 1e9)),
+                "endTimeUnixNano": str(int(end * 1e9)),
+                "attributes": attributes({**span.attrs, "thread.name": span.thread}),
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            })
+        return {"resourceSpans": [{
+            "resource": {"attributes": attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]}
+
+@contextmanager
+def span(trace, name, since=None, **attrs):
+    """
+    name という段階を計る。所要時間はいつも STAGE_SECONDS に積み、
+    trace を渡したときはその Trace にも span を残す（yield した span に属性を足せる）。
+    since（UNIX 時刻）を渡すと、そこから始まったことにする（順番待ちを含めたいときなど）
+    """
+    if trace is not None:
+        current = trace.start_span(name, **attrs)
+    else:
+        current = Span(name, None, None, attrs)
+    before = 0.0
+    if since is not None:
+        before = max(0.0, current.start - since)
+        current.start = since
+    start = time.perf_counter()
+    thread = threading.get_ident()
+    cpu_start = time.thread_time()
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {e}"
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        elapsed = before + time.perf_counter() - start
+        current.end = current.start + elapsed
+        if threading.get_ident() == thread:
+            current.cpu = time.thread_time() - cpu_start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+
+def record(trace, name, start, end, **attrs):
+    """すでに終わった区間（UNIX 時刻の start〜end）を name の span として残す（順番待ちの時間など）"""
+    STAGE_SECONDS.observe(end - start, stage=name)
+    if trace is not None:
+        current = trace.start_span(name, **attrs)
+        current.start = start
+        current.end = end
+
+def iter_span(trace, name, iterable, **attrs):
+    """
+    iterable を最後まで取り出すまでを1つの span として計る（ストリーミングの Gemini 用）。
+    最初の1つが届くまでの秒数を first_item_s、取り出した数を items に入れる
+    """
+    with span(trace, name, **attrs) as current:
+        start = time.perf_counter()
+        n = 0
+        for n, value in enumerate(iterable, 1):
+            if n == 1:
+                current.set(first_item_s=round(time.perf_counter() - start, 3))
+            yield value
+        current.set(items=n)
+
+def write_trace(trace, path):
+    """Trace を OTLP/JSON で1行にして path に追記する（OpenTelemetry Collector の filelog などで読める）"""
+    line = (json.dumps(trace.to_otlp(), ensure_ascii=False) + "\n").encode()
+    # 複数のスレッド・プロセスから追記しても行が混ざらないように、1回の write で書く
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+def serve_metrics(port, host="0.0.0.0"):
+    """/metrics を返すだけの HTTP サーバーを裏のスレッドで立てる（Prometheus から取りに来てもらう）"""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# セリフ単位の音声キャッシュ（同じ声・速度・モデル・テキストならTTSを呼ばずに使い回す）
+DEFAULT_CACHE_DIR = ".tts_cache"
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024 # 500MBを超えたら古いものから消す
+
+def make_segment_key(voice, speed, model, text):
+    """(voice, speed, model, text) からキャッシュキーを作る"""
+    unique_string = f"{model}\n{voice}\n{float(speed):.3f}\n{text}"
+    return hashlib.sha256(unique_string.encode()).hexdigest()
+
+class FirebaseSegmentStore:
+    """
+    リモート層の例：Firebase Storage にセリフ音声を置く
+    （get/put を持つオブジェクトなら何でもリモート層として差し込める）
+    """
+
+    def __init__(self, bucket, prefix="tts_segments/"):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key):
+        blob = self.bucket.blob(f"{self.prefix}{key}.mp3")
+        if not blob.exists():
+            return None
+        return blob.download_as_bytes()
+
+    def put(self, key, data):
+        blob = self.bucket.blob(f"{self.prefix}{key}.mp3")
+        blob.upload_from_string(data, content_type="audio/mp3")
+
+class SegmentCache:
+    """
+    セリフ音声(MP3バイト列)のキャッシュ。
+    ローカルディスク層は合計サイズが max_bytes を超えると古い順（LRU）に削除する。
+    remote を渡すと、ディスクに無いときにリモート層も見に行く
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, remote=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.remote = remote
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> サイズ（古い順）
+        self._total_bytes = 0
+
+        # 集計用カウンター
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.saved_chars = 0 # キャッシュのおかげでTTSに送らずに済んだ文字数
+        self.miss_seconds = 0.0 # キャッシュに無かったときにTTSにかかった時間の合計
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _load_index(self):
+        """起動時にディスク上のファイルを更新日時順に読み込む"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".mp3"):
+                continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            files.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _store_local(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _read_local(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key)) # 再起動後もLRUの順番が保たれるように
+            return data
+        except OSError:
+            with self._lock:
+                if key in self._entries:
+                    self._total_bytes -= self._entries.pop(key)
+            return None
+
+    def get(self, key, chars=0):
+        """キャッシュから取り出す。無ければ None"""
+        data = self._read_local(key)
+        if data is None and self.remote is not None:
+            try:
+                data = self.remote.get(key)
+            except Exception as e:
+                print(f"Segment cache remote get error: {e}")
+                data = None
+            if data is not None:
+                try:
+                    self._store_local(key, data)
+                except OSError as e:
+                    print(f"Segment cache write error: {e}")
+                with self._lock:
+                    self.remote_hits += 1
+
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_chars += chars
+        return data
+
+    def put(self, key, data, elapsed=0.0):
+        """TTSで新しく作った音声を保存する（elapsed はTTSにかかった秒数）"""
+        with self._lock:
+            self.miss_seconds += elapsed
+        try:
+            self._store_local(key, data)
+        except OSError as e:
+            print(f"Segment cache write error: {e}")
+        if self.remote is not None:
+            try:
+                self.remote.put(key, data)
+            except Exception as e:
+                print(f"Segment cache remote put error: {e}")
+
+    def stats(self):
+        """ヒット・ミスの集計を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_miss = self.miss_seconds / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "remote_hits": self.remote_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_chars": self.saved_chars,
+                "saved_seconds": avg_miss * self.hits, # 平均TTS時間からの概算
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }